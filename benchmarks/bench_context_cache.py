@@ -0,0 +1,79 @@
+"""
+Compares chat turns with and without Gemini context caching against the local mock server.
+
+    python benchmarks/bench_context_cache.py --turns 30 --prefill-per-1k 0.2
+
+Each run streams a growing conversation through the same backend stack the
+app uses and reports cached and uncached prompt tokens, time to first token
+and the context cache outcomes, all read back from the metrics.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_journal_index import synthetic_entry
+from context_cache import ContextCache
+from gemini_client import GeminiClient
+from llm_backend import GeminiBackend
+from metrics import Metrics
+from mock_gemini import MockConfig, start_server
+
+PERSONA = "You are a warm, empathetic friend who listens without judgment and offers encouragement."
+
+
+def run(api_base, turns, message_words, think, cached, seed):
+    metrics = Metrics()
+    client = GeminiClient(api_base, "mock-model", metrics=metrics)
+    backend = GeminiBackend(client, context_cache=ContextCache(client, metrics=metrics) if cached else None)
+    rng = random.Random(seed)
+    history = []
+    for _ in range(turns):
+        message = " ".join(synthetic_entry(rng) for _ in range(message_words // 60 + 1))
+        payload = {
+            "systemInstruction": {"parts": [{"text": PERSONA}]},
+            "contents": [*history, {"role": "user", "parts": [{"text": message}]}],
+        }
+        reply = "".join(backend.stream_text("bench-key", payload, call_site="chat"))
+        history += [payload["contents"][-1], {"role": "model", "parts": [{"text": reply}]}]
+        time.sleep(think)
+    return metrics
+
+
+def report(label, metrics):
+    counters, histograms = metrics.snapshot()
+    tokens = {dict(labels)["kind"]: value for (name, labels), value in counters.items() if name == "gemini_tokens_total"}
+    outcomes = {dict(labels)["outcome"]: value for (name, labels), value in counters.items()
+                if name == "gemini_context_cache_total"}
+    first = [(dict(labels)["cached"], sum(counts), total) for (name, labels), (counts, total) in histograms.items()
+             if name == "gemini_first_token_seconds"]
+    print(f"{label}:")
+    print(f"  prompt tokens: {tokens.get('prompt', 0):,} total, {tokens.get('prompt_cached', 0):,} cached, "
+          f"{tokens.get('prompt_uncached', 0):,} uncached")
+    for cached, count, total in sorted(first):
+        print(f"  first token (cached={cached}): {count} turns, mean {total / count * 1000:.0f} ms")
+    if outcomes:
+        print("  context cache: " + ", ".join(f"{name} {value}" for name, value in sorted(outcomes.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--message-words", type=int, default=200)
+    parser.add_argument("--prefill-per-1k", type=float, default=0.2, help="Mock seconds per 1000 uncached prompt tokens.")
+    parser.add_argument("--think", type=float, default=0.1, help="Seconds between turns.")
+    args = parser.parse_args()
+
+    server = start_server(MockConfig(latency="const:0.02", chunk_delay="const:0", prefill_per_1k=args.prefill_per_1k))
+    for label, cached in [("uncached", False), ("context cache", True)]:
+        report(label, run(server.api_base, args.turns, args.message_words, args.think, cached, seed=1))
+    print("mock requests:", server.stats.snapshot())
+
+
+if __name__ == "__main__":
+    main()
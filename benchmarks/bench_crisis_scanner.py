@@ -0,0 +1,77 @@
+"""
+Scans a synthetic chat/journal corpus with the crisis phrase scanner.
+
+    python benchmarks/bench_crisis_scanner.py --messages 200000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from crisis_scanner import CrisisScanner, normalize
+
+LEXICON = os.path.join(ROOT, "crisis_lexicon.json")
+FILLER = (
+    "today work was long and i felt tired but my friend called and we talked about "
+    "exams family college dinner music aaj bahut kaam tha lekin shaam ko walk pe gaya "
+    "मैं आज थोड़ा थका हुआ हूँ पर ठीक हूँ"
+).split()
+
+
+def synthetic_corpus(count, phrases, hit_rate):
+    corpus = []
+    for _ in range(count):
+        words = random.choices(FILLER, k=random.randint(5, 60))
+        if random.random() < hit_rate:
+            words.insert(random.randrange(len(words) + 1), random.choice(phrases))
+        corpus.append(" ".join(words) + random.choice([".", "!", "?", "..."]))
+    return corpus
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lexicon", default=LEXICON)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--hit-rate", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with open(args.lexicon, encoding="utf-8") as f:
+        lexicon = json.load(f)["phrases"]
+    started = time.perf_counter()
+    scanner = CrisisScanner(lexicon)
+    print(f"build: {len(lexicon)} phrases in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    corpus = synthetic_corpus(args.messages, [entry["phrase"] for entry in lexicon], args.hit_rate)
+    latencies, flagged = [], 0
+    started = time.perf_counter()
+    for text in corpus:
+        before = time.perf_counter()
+        flagged += scanner.scan(text).is_crisis
+        latencies.append(time.perf_counter() - before)
+    elapsed = time.perf_counter() - started
+    print(f"scanner: {len(corpus) / elapsed:,.0f} messages/s, "
+          f"p50 {percentile(latencies, 50) * 1e6:.1f} us, p99 {percentile(latencies, 99) * 1e6:.1f} us, "
+          f"{flagged} flagged")
+
+    # Baseline: one substring search per phrase; its cost grows with the lexicon size.
+    phrases = scanner.matcher.phrases
+    started = time.perf_counter()
+    for text in corpus:
+        padded = f" {normalize(text)} "
+        any(f" {phrase} " in padded for phrase in phrases)
+    elapsed = time.perf_counter() - started
+    print(f"naive per-phrase search: {len(corpus) / elapsed:,.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
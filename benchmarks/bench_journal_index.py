@@ -0,0 +1,77 @@
+"""
+Measures build, update and query time of the journal retrieval index.
+
+    python benchmarks/bench_journal_index.py --sizes 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal_index import JournalIndex
+
+TOPICS = (
+    "exams college hostel roommate family parents sister brother friend breakup project deadline "
+    "sleep insomnia gym running anxiety stress panic calm meditation walk music guitar coding "
+    "internship interview money rent food cooking rain monsoon festival diwali holi cricket "
+    "teacher professor assignment marks results scholarship placement coffee chai train bus"
+).split()
+FILLER = "the day was long and i felt tired but then something changed".split()
+
+
+def synthetic_entry(rng):
+    # Zipf-like topic choice so some words are common and most are rare.
+    words = [TOPICS[min(int(rng.paretovariate(1.2)) - 1, len(TOPICS) - 1)] for _ in range(rng.randint(10, 40))]
+    words += rng.choices(FILLER, k=20)
+    words += [f"rare{rng.randrange(20000)}" for _ in range(3)]
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--updates", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'entries':>8} {'build s':>8} {'add us':>8} {'delete us':>10} {'query p50 ms':>13} {'query p99 ms':>13}")
+    for size in args.sizes:
+        entries = [(i, synthetic_entry(rng), None) for i in range(size)]
+        index = JournalIndex(lambda user_id: entries)
+
+        started = time.perf_counter()
+        index.search("bench", "warm up")
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for i in range(args.updates):
+            index.add_entry("bench", size + i, synthetic_entry(rng))
+        add = (time.perf_counter() - started) / args.updates
+
+        started = time.perf_counter()
+        for entry_id in rng.sample(range(size), args.updates):
+            index.remove_entry("bench", entry_id)
+        delete = (time.perf_counter() - started) / args.updates
+
+        latencies = []
+        for _ in range(args.queries):
+            query = " ".join(rng.choices(TOPICS, k=rng.randint(3, 12)) + FILLER[:5])
+            started = time.perf_counter()
+            index.search("bench", query, k=3)
+            latencies.append(time.perf_counter() - started)
+        print(f"{size:>8} {build:>8.2f} {add * 1e6:>8.1f} {delete * 1e6:>10.1f} "
+              f"{percentile(latencies, 50) * 1000:>13.2f} {percentile(latencies, 99) * 1000:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
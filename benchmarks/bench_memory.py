@@ -0,0 +1,154 @@
+"""
+Measures memory held per user and per session with 1k chat messages and 1k journal entries.
+
+    python benchmarks/bench_memory.py --users 20 --messages 1000 --entries 1000
+
+Process-wide per-user caches (journal index, mood aggregates) are measured
+with tracemalloc, then reloaded under a small budget to show that least
+recently used users are evicted and rebuilt from storage. Session state is
+measured on a real AppTest session that opens the Chat and Journal pages for
+a user with the full history in SQLite.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_journal_index import synthetic_entry
+from journal_index import JournalIndex
+from mood_analytics import MOODS, MoodAnalytics
+from storage import SQLiteStorage
+
+
+def user_id_for(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+
+
+def seed(storage, user_id, messages, entries, rng):
+    start = date.today() - timedelta(days=entries)
+    storage.add_journal_entries(user_id, [
+        {
+            "date": (start + timedelta(days=i)).isoformat(),
+            "text": synthetic_entry(rng),
+            "mood": rng.choice(MOODS[:-1]),
+            "summary": "A short summary of the day.",
+            "tip": "Take a short walk.",
+        }
+        for i in range(entries)
+    ])
+    storage.add_messages(user_id, [
+        {
+            "conversation_id": "bench",
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": synthetic_entry(rng),
+            "created_at": time.time() - (messages - i),
+        }
+        for i in range(messages)
+    ])
+
+
+def deep_size(value, seen=None):
+    """Bytes reachable from `value`, counting shared objects once."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if hasattr(value, "nbytes") and not isinstance(value, (bytes, memoryview)):
+        return size + int(value.nbytes)
+    if isinstance(value, dict):
+        return size + sum(deep_size(k, seen) + deep_size(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset, deque)):
+        return size + sum(deep_size(item, seen) for item in value)
+    if hasattr(value, "__dict__"):
+        size += deep_size(vars(value), seen)
+    for name in getattr(type(value), "__slots__", ()):
+        size += deep_size(getattr(value, name, None), seen)
+    return size
+
+
+def measure_caches(storage, user_ids):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = JournalIndex(storage.iter_journal_texts)
+    for user_id in user_ids:
+        index.search(user_id, "exams")
+    index_bytes = tracemalloc.get_traced_memory()[0] - before
+
+    before = tracemalloc.get_traced_memory()[0]
+    analytics = MoodAnalytics(storage.iter_journal_moods)
+    for user_id in user_ids:
+        analytics.streak(user_id)
+    analytics_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print(f"journal index:   {index_bytes / len(user_ids) / 1024:8,.0f} KiB per user "
+          f"(estimate {index.stats()['bytes'] / len(user_ids) / 1024:,.0f} KiB)")
+    print(f"mood aggregates: {analytics_bytes / len(user_ids) / 1024:8,.0f} KiB per user "
+          f"(estimate {analytics.stats()['bytes'] / len(user_ids) / 1024:,.0f} KiB)")
+
+    budget = index.stats()["bytes"] // 4
+    capped = JournalIndex(storage.iter_journal_texts, max_bytes=budget)
+    for user_id in user_ids:
+        capped.search(user_id, "exams")
+    started = time.perf_counter()
+    capped.search(user_ids[0], "exams")
+    rebuild_ms = (time.perf_counter() - started) * 1000
+    stats = capped.stats()
+    print(f"with a {budget / 1024:,.0f} KiB index budget: {stats['users']} users resident, "
+          f"{stats['evictions']} evicted, {rebuild_ms:.0f} ms to page an evicted user back in")
+
+
+def measure_session(db_path, api_key, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=timeout)
+    app.session_state.logged_in = True
+    app.session_state.quiz_complete = True
+    app.session_state.gemini_api_key = api_key
+    app.session_state.conversation_id = "bench"
+    app.run()
+    for page in ["Chat", "Journal", "Chat"]:
+        app.sidebar.selectbox[0].set_value(page).run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+    state = app.session_state.to_dict()
+    total = deep_size(state)
+    print(f"session state:   {total / 1024:8,.1f} KiB per session after opening Chat and Journal")
+    for key, value in sorted(state.items(), key=lambda item: -deep_size(item[1])):
+        print(f"  {key:<24} {deep_size(value):>8,} B")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["MANNMITRA_DB_PATH"] = db_path
+    storage = SQLiteStorage(db_path)
+    api_keys = [f"bench-{i}" for i in range(args.users)]
+    for api_key in api_keys:
+        seed(storage, user_id_for(api_key), args.messages, args.entries, rng)
+    print(f"{args.users} users, {args.messages} messages and {args.entries} journal entries each")
+
+    measure_caches(storage, [user_id_for(api_key) for api_key in api_keys])
+    measure_session(db_path, api_keys[0], args.timeout)
+
+
+if __name__ == "__main__":
+    main()
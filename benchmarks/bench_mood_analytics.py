@@ -0,0 +1,77 @@
+"""
+Compares incremental mood aggregates against rescanning the full history.
+
+    python benchmarks/bench_mood_analytics.py --entries 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mood_analytics import MOODS, NEGATIVE_MOODS, MoodAnalytics
+
+
+def synthetic_history(count, end=date(2026, 1, 1)):
+    start = end - timedelta(days=count // 3)
+    return [
+        (i, (start + timedelta(days=i // 3)).isoformat(), random.choice(MOODS[:-1]))
+        for i in range(count)
+    ]
+
+
+def timed(label, fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    per_call = (time.perf_counter() - started) / repeat * 1e6
+    print(f"{label:>34}: {per_call:10.1f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    history = synthetic_history(args.entries)
+    analytics = MoodAnalytics(lambda user_id: iter(()))
+
+    started = time.perf_counter()
+    for entry_id, entry_date, mood in history:
+        analytics.add_entry("bench", entry_id, entry_date, mood)
+    elapsed = time.perf_counter() - started
+    print(f"incremental build: {args.entries} entries in {elapsed:.2f}s ({elapsed / args.entries * 1e6:.1f} us/append)")
+
+    started = time.perf_counter()
+    MoodAnalytics(lambda user_id: iter(history)).streak("bench")
+    print(f"cold build from history: {time.perf_counter() - started:.2f}s")
+
+    end = date.fromisoformat(history[-1][1])
+    timed("recent_negative_count (last 3)", lambda: analytics.recent_negative_count("bench", 3), args.repeat)
+    timed("negative_ratio", lambda: analytics.negative_ratio("bench"), args.repeat)
+    timed("daily_counts (30 days)", lambda: analytics.daily_counts("bench", end - timedelta(days=29), end), args.repeat)
+    timed("weekly_counts (1 year)", lambda: analytics.weekly_counts("bench", end - timedelta(days=364), end), args.repeat)
+    timed("streak", lambda: analytics.streak("bench", end), args.repeat)
+    timed("append", lambda: analytics.add_entry("bench", args.entries, end.isoformat(), "calm"), args.repeat)
+
+    def rescan_last_three():
+        return sum(mood in NEGATIVE_MOODS for _, _, mood in history[-3:])
+
+    def rescan_daily():
+        cutoff = (end - timedelta(days=29)).isoformat()
+        counts = {}
+        for _, entry_date, mood in history:
+            if entry_date >= cutoff:
+                counts[(entry_date, mood)] = counts.get((entry_date, mood), 0) + 1
+        return counts
+
+    timed("rescan: last 3 moods", rescan_last_three, args.repeat)
+    timed("rescan: daily counts (30 days)", rescan_daily, max(1, args.repeat // 20))
+
+
+if __name__ == "__main__":
+    main()
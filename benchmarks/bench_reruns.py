@@ -0,0 +1,76 @@
+"""
+Measures server-side rerun time of the Chat and Journal pages as history grows,
+using Streamlit's AppTest against a temporary database.
+
+    python benchmarks/bench_reruns.py --sizes 100 1000 10000
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from storage import SQLiteStorage
+
+API_KEY = "bench-key"
+
+
+def seed(storage, user_id, size):
+    storage.add_journal_entries(user_id, (
+        {
+            "date": (date(2020, 1, 1) + timedelta(days=i)).isoformat(),
+            "text": f"Entry {i}",
+            "mood": "calm",
+            "summary": "A synthetic summary.",
+            "tip": "Breathe.",
+        }
+        for i in range(size)
+    ))
+    for i in range(size):
+        storage.add_message(user_id, "bench", "user" if i % 2 == 0 else "assistant", f"Message {i}")
+
+
+def time_page(page, runs):
+    app = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=60)
+    app.session_state.logged_in = True
+    app.session_state.quiz_complete = True
+    app.session_state.gemini_api_key = API_KEY
+    app.session_state.conversation_id = "bench"
+    app.run()
+    app.sidebar.selectbox[0].set_value(page).run()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        app.run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    user_id = hashlib.sha256(API_KEY.encode("utf-8")).hexdigest()[:32]
+    print(f"{'history':>8} {'chat rerun (ms)':>16} {'journal rerun (ms)':>19}")
+    for size in args.sizes:
+        os.environ["MANNMITRA_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+        storage = SQLiteStorage(os.environ["MANNMITRA_DB_PATH"])
+        seed(storage, user_id, size)
+        storage.close()
+        st.cache_resource.clear()
+        print(f"{size:>8} {time_page('Chat', args.runs):>16.1f} {time_page('Journal', args.runs):>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Inserts and queries synthetic journal rows through SQLiteStorage.
+
+    python benchmarks/bench_storage.py --rows 1000000 --users 1000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SQLiteStorage
+
+MOODS = ["happy", "sad", "stressed", "anxious", "calm"]
+
+
+def synthetic_entries(count, start=date(2020, 1, 1)):
+    for i in range(count):
+        yield {
+            "date": (start + timedelta(days=i)).isoformat(),
+            "text": f"Synthetic journal entry number {i}. " * 4,
+            "mood": random.choice(MOODS),
+            "summary": "A synthetic summary.",
+            "tip": "Take a short walk.",
+        }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--db", default=None, help="Database path (defaults to a temporary file).")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    storage = SQLiteStorage(path)
+    users = [f"user-{i}" for i in range(args.users)]
+    per_user = args.rows // args.users
+
+    started = time.perf_counter()
+    for user_id in users:
+        storage.add_journal_entries(user_id, synthetic_entries(per_user))
+    elapsed = time.perf_counter() - started
+    total = per_user * args.users
+    print(f"insert: {total} rows in {elapsed:.2f}s ({total / elapsed:,.0f} rows/s)")
+
+    for name, query in [
+        ("first page", lambda u: storage.list_journal_entries(u, limit=20)),
+        ("deep page", lambda u: storage.list_journal_entries(u, limit=20, offset=per_user // 2)),
+        ("recent moods", lambda u: storage.recent_moods(u, limit=3)),
+        ("count", lambda u: storage.count_journal_entries(u)),
+    ]:
+        samples = []
+        for _ in range(args.queries):
+            user_id = random.choice(users)
+            t = time.perf_counter()
+            query(user_id)
+            samples.append((time.perf_counter() - t) * 1000)
+        print(
+            f"{name:>12}: p50 {statistics.median(samples):.3f} ms  "
+            f"p95 {percentile(samples, 95):.3f} ms  p99 {percentile(samples, 99):.3f} ms"
+        )
+    storage.close()
+
+
+if __name__ == "__main__":
+    main()
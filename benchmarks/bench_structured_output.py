@@ -0,0 +1,59 @@
+"""
+Runs the tolerant structured-output parser over a corpus of messy model outputs.
+
+    python benchmarks/bench_structured_output.py --repeat 2000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from structured_output import ParseStats, parse_journal_analysis, parse_story
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures", "messy_outputs.jsonl")
+PARSERS = {
+    "journal": (parse_journal_analysis, "mood"),
+    "story": (parse_story, "title"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(args.fixtures, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    mismatches = 0
+    stats = ParseStats()
+    for case in cases:
+        parse, field = PARSERS[case["kind"]]
+        result = parse(case["output"], stats=stats)
+        expected = case["expected"][field]
+        got = result[field] if result else None
+        if got != expected:
+            mismatches += 1
+            print(f"mismatch ({case['kind']}): expected {expected!r}, got {got!r}\n  {case['output'][:70]!r}")
+
+    snapshot = stats.snapshot()
+    print(f"{len(cases)} fixtures, {mismatches} mismatches, parse success rate {snapshot['success_rate']:.0%}")
+    print("by strategy:", dict(sorted(snapshot["by_strategy"].items())))
+
+    throughput_stats = ParseStats()
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for case in cases:
+            PARSERS[case["kind"]][0](case["output"], stats=throughput_stats)
+    elapsed = time.perf_counter() - started
+    parsed = args.repeat * len(cases)
+    print(f"throughput: {parsed / elapsed:,.0f} outputs/s ({elapsed / parsed * 1e6:.1f} us/output)")
+
+
+if __name__ == "__main__":
+    main()
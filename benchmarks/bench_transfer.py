@@ -0,0 +1,68 @@
+"""
+Round-trips synthetic journal rows through the streaming export and import.
+
+    python benchmarks/bench_transfer.py --rows 1000000 --format jsonl
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_transfer import export_journal, import_journal
+from storage import SQLiteStorage
+
+MOODS = ["happy", "sad", "stressed", "anxious", "calm"]
+
+
+def synthetic_entries(count, start=date(2000, 1, 1)):
+    for i in range(count):
+        yield {
+            "date": (start + timedelta(days=i // 10)).isoformat(),
+            "text": f"Synthetic journal entry number {i}, with a comma and a \"quote\".",
+            "mood": MOODS[i % len(MOODS)],
+            "summary": "A synthetic summary.",
+            "tip": "Take a short walk.",
+        }
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    storage = SQLiteStorage(os.path.join(workdir, "bench.db"))
+    storage.add_journal_entries("source", synthetic_entries(args.rows))
+    print(f"seeded {args.rows} rows, peak RSS {peak_rss_mib():.0f} MiB")
+
+    path = os.path.join(workdir, f"export.{args.format}")
+    started = time.perf_counter()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for chunk in export_journal(storage, "source", args.format):
+            f.write(chunk)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path) / 2 ** 20
+    print(f"export: {elapsed:.2f}s ({args.rows / elapsed:,.0f} rows/s, {size:.0f} MiB), peak RSS {peak_rss_mib():.0f} MiB")
+
+    started = time.perf_counter()
+    with open(path, encoding="utf-8", newline="") as f:
+        imported, errors = import_journal(storage, "target", f, args.format)
+    elapsed = time.perf_counter() - started
+    print(f"import: {elapsed:.2f}s ({imported / elapsed:,.0f} rows/s, {errors.count} rejected), peak RSS {peak_rss_mib():.0f} MiB")
+
+    matches = all(a == b for a, b in zip(storage.iter_journal_entries("source"), storage.iter_journal_entries("target")))
+    print(f"round trip: {storage.count_journal_entries('target')} rows, identical: {matches}")
+
+
+if __name__ == "__main__":
+    main()
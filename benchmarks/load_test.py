@@ -0,0 +1,145 @@
+"""
+Drives simulated concurrent MannMitra sessions against the local mock Gemini server.
+
+    python benchmarks/load_test.py --sessions 200 --concurrency 50 --latency lognormal:-1,0.5
+
+Each session logs in, takes the quiz and then walks the Chat, Journal,
+Planner and Stories pages through Streamlit's AppTest, so page times include
+the full server-side script run and every model call it waits on. AppTest
+swaps a process-global runtime on every run, so concurrent sessions run in
+separate worker processes that share the mock server and the database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from mock_gemini import MockConfig, start_server
+
+SCENARIO = ["Chat", "Journal", "Planner", "Stories", "Chat"]
+
+
+def rss_bytes():
+    """Current resident set size, or the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def button(app, label):
+    return next(widget for widget in app.button if widget.label == label)
+
+
+# Finished sessions are kept alive in each worker so that RSS growth reflects their state.
+_finished_apps = []
+
+
+def run_session(scenario, timeout):
+    """Runs one scripted session and returns ([(step, seconds, failed)], rss growth in bytes)."""
+    from streamlit.testing.v1 import AppTest
+
+    samples = []
+    rss_before = rss_bytes()
+    # AppTest leaves the app script registered as __main__, which breaks unpickling the next task.
+    driver_module = sys.modules["__main__"]
+    app = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=timeout)
+
+    def timed(name, action):
+        started = time.perf_counter()
+        action()
+        samples.append((name, time.perf_counter() - started, bool(app.exception)))
+
+    timed("login page", app.run)
+    app.text_input[0].set_value(f"load-{uuid.uuid4().hex}")
+    timed("login", button(app, "Login").click().run)
+    timed("quiz", button(app, "Submit Quiz").click().run)
+    for page in scenario:
+        timed(f"{page} view", app.sidebar.selectbox[0].set_value(page).run)
+        if page == "Chat":
+            timed("Chat message", app.chat_input[0].set_value("I had a stressful day at college.").run)
+        elif page == "Journal":
+            app.text_area[0].set_value("Exams are close and I could not sleep well.")
+            timed("Journal analyze", button(app, "Analyze Journal Entry").click().run)
+        elif page == "Stories":
+            timed("Stories generate", button(app, "Generate New Stories").click().run)
+    _finished_apps.append(app)
+    sys.modules["__main__"] = driver_module
+    return samples, rss_bytes() - rss_before
+
+
+def init_worker(api_base, db_path):
+    os.environ["MANNMITRA_GEMINI_API_BASE"] = api_base
+    os.environ["MANNMITRA_DB_PATH"] = db_path
+    # Warm up imports so the first session's memory is not dominated by them.
+    import numpy, pandas, streamlit.testing.v1  # noqa: F401
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 4,
+                        help="Number of worker processes running sessions side by side.")
+    parser.add_argument("--latency", default="lognormal:-1,0.5")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--api-base", default=None, help="Use an already running server instead of the in-process mock.")
+    args = parser.parse_args()
+
+    server = None
+    if args.api_base is None:
+        server = start_server(MockConfig(args.latency, args.rate_429, args.rate_5xx))
+    api_base = args.api_base or server.api_base
+    db_path = os.path.join(tempfile.mkdtemp(), "load.db")
+
+    samples, errors, memory, completed = defaultdict(list), defaultdict(int), [], 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(args.concurrency, initializer=init_worker, initargs=(api_base, db_path)) as pool:
+        futures = [pool.submit(run_session, SCENARIO, args.timeout) for _ in range(args.sessions)]
+        for future in as_completed(futures):
+            try:
+                steps, rss_growth = future.result()
+            except Exception as e:
+                errors["session"] += 1
+                print(f"session failed: {e!r}")
+                continue
+            completed += 1
+            memory.append(rss_growth)
+            for name, seconds, failed in steps:
+                samples[name].append(seconds)
+                errors[name] += failed
+    elapsed = time.perf_counter() - started
+
+    print(f"{'step':<18} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'errors':>6}")
+    for name, values in samples.items():
+        print(f"{name:<18} {len(values):>6} {percentile(values, 50) * 1000:>8.1f} "
+              f"{percentile(values, 95) * 1000:>8.1f} {percentile(values, 99) * 1000:>8.1f} "
+              f"{statistics.mean(values) * 1000:>8.1f} {errors.get(name, 0):>6}")
+    runs = sum(len(values) for values in samples.values())
+    print(f"sessions: {completed}/{args.sessions} completed in {elapsed:.1f}s "
+          f"({completed / elapsed:.2f} sessions/s, {runs / elapsed:.1f} script runs/s)")
+    if memory:
+        print(f"memory: {statistics.median(memory) / 1024:,.0f} KiB median RSS growth per session")
+    if server is not None:
+        print("mock requests:", dict(sorted(server.stats.snapshot().items())))
+
+
+if __name__ == "__main__":
+    main()
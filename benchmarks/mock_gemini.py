@@ -0,0 +1,277 @@
+"""
+Local stand-in for the Gemini REST API, for load tests and offline development.
+
+    python benchmarks/mock_gemini.py --port 8765 --latency lognormal:0.4,0.5 --rate-429 0.05
+    MANNMITRA_GEMINI_API_BASE=http://127.0.0.1:8765/v1beta streamlit run main.py
+
+Cached contents (create, extend, delete, and `cachedContent` in requests)
+are supported, with the API's minimum size. `--prefill-per-1k` adds
+latency per 1000 uncached prompt tokens, so caching shows up in
+time-to-first-token.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ROUTE = re.compile(r"^/[^/]+/models/([^/:]+):(generateContent|streamGenerateContent)")
+_CACHE_ROUTE = re.compile(r"^/[^/]+/(cachedContents(?:/[^/?]+)?)(?:\?|$)")
+REPLY_WORDS = (
+    "That sounds like a lot to carry. It is okay to take things one step at a time, "
+    "and to be gentle with yourself while you do."
+).split()
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution in seconds: "const:0.2", "uniform:0.1,0.5",
+    "normal:0.3,0.1" or "lognormal:mu,sigma" (the parameters of the
+    underlying normal, e.g. "lognormal:-1,0.5" has a median of ~0.37s).
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    samplers = {
+        "const": lambda: values[0],
+        "uniform": lambda: random.uniform(values[0], values[1]),
+        "normal": lambda: max(0.0, random.gauss(values[0], values[1])),
+        "lognormal": lambda: random.lognormvariate(values[0], values[1]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution: {spec}")
+    return samplers[kind]
+
+
+def text_tokens(value):
+    """Rough token count of every "text" field in a request body."""
+    if isinstance(value, dict):
+        return sum(len(item) // 4 if name == "text" and isinstance(item, str) else text_tokens(item)
+                   for name, item in value.items())
+    if isinstance(value, list):
+        return sum(text_tokens(item) for item in value)
+    return 0
+
+
+def sample_value(schema):
+    """Builds a value that satisfies a Gemini response schema."""
+    kind = schema.get("type", "STRING").upper()
+    if kind == "OBJECT":
+        return {name: sample_value(field) for name, field in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        return [sample_value(schema.get("items", {}))]
+    if kind in ("INTEGER", "NUMBER"):
+        return 1
+    if kind == "BOOLEAN":
+        return True
+    if schema.get("enum"):
+        return random.choice(schema["enum"])
+    return " ".join(REPLY_WORDS[:random.randint(6, len(REPLY_WORDS))])
+
+
+class MockConfig:
+    def __init__(self, latency="const:0", rate_429=0.0, rate_5xx=0.0, retry_after=1,
+                 chunks=8, chunk_delay="const:0.02", prefill_per_1k=0.0, cache_min_tokens=1024):
+        self.latency = parse_latency(latency)
+        self.prefill_per_1k = prefill_per_1k
+        self.cache_min_tokens = cache_min_tokens
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.chunks = chunks
+        self.chunk_delay = parse_latency(chunk_delay)
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def record(self, outcome):
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class MockCaches:
+    """Cached contents held by the mock: name -> (model, tokens, expiry as a Unix time)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+        self.sequence = 0
+
+    def create(self, model, tokens, ttl):
+        with self.lock:
+            self.sequence += 1
+            name = f"cachedContents/mock{self.sequence}"
+            self.items[name] = (model, tokens, time.time() + ttl)
+            return name
+
+    def get(self, name):
+        with self.lock:
+            item = self.items.get(name)
+            if item is not None and item[2] <= time.time():
+                del self.items[name]
+                return None
+            return item
+
+
+def _ttl_seconds(value):
+    return float(str(value or "3600s").rstrip("s"))
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+    def do_POST(self):
+        config, stats = self.server.config, self.server.stats
+        body = self._body()
+        if _CACHE_ROUTE.match(self.path):
+            return self._create_cache(body)
+        route = _ROUTE.match(self.path)
+        if route is None:
+            stats.record("404")
+            return self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+        cached_tokens = 0
+        if body.get("cachedContent"):
+            cached = self.server.caches.get(body["cachedContent"])
+            if cached is None or cached[0] != f"models/{route.group(1)}":
+                stats.record("403")
+                return self._send_json(403, {"error": {"code": 403, "message": "CachedContent not found (or permission denied)"}})
+            cached_tokens = cached[1]
+        prompt_tokens = text_tokens(body)
+        time.sleep(config.latency() + config.prefill_per_1k * prompt_tokens / 1000)
+        roll = random.random()
+        if roll < config.rate_429:
+            stats.record("429")
+            return self._send_json(429, {"error": {"code": 429, "message": "Resource exhausted"}},
+                                   {"Retry-After": str(config.retry_after)})
+        if roll < config.rate_429 + config.rate_5xx:
+            status = random.choice([500, 503])
+            stats.record(str(status))
+            return self._send_json(status, {"error": {"code": status, "message": "Mock server error"}})
+
+        schema = body.get("generationConfig", {}).get("responseSchema")
+        text = json.dumps(sample_value(schema)) if schema else sample_value({})
+        usage = {"promptTokenCount": prompt_tokens + cached_tokens, "cachedContentTokenCount": cached_tokens}
+        if route.group(2) == "streamGenerateContent":
+            stats.record("stream")
+            return self._send_stream(text, config, usage)
+        stats.record("200")
+        self._send_json(200, self._response(text, usage))
+
+    def do_PATCH(self):
+        body, route = self._body(), _CACHE_ROUTE.match(self.path)
+        item = self.server.caches.get(route.group(1)) if route else None
+        if item is None:
+            self.server.stats.record("cache_404")
+            return self._send_json(404, {"error": {"code": 404, "message": "CachedContent not found"}})
+        with self.server.caches.lock:
+            self.server.caches.items[route.group(1)] = (item[0], item[1], time.time() + _ttl_seconds(body.get("ttl")))
+        self.server.stats.record("cache_update")
+        self._send_json(200, {"name": route.group(1), "model": item[0]})
+
+    def do_DELETE(self):
+        route = _CACHE_ROUTE.match(self.path)
+        with self.server.caches.lock:
+            found = route is not None and self.server.caches.items.pop(route.group(1), None) is not None
+        self.server.stats.record("cache_delete" if found else "cache_404")
+        self._send_json(200 if found else 404, {})
+
+    def _create_cache(self, body):
+        tokens = text_tokens(body)
+        if tokens < self.server.config.cache_min_tokens:
+            self.server.stats.record("cache_too_small")
+            return self._send_json(400, {"error": {"code": 400, "message": (
+                f"Cached content is too small. total_token_count={tokens}, "
+                f"min_total_token_count={self.server.config.cache_min_tokens}"
+            )}})
+        name = self.server.caches.create(body.get("model"), tokens, _ttl_seconds(body.get("ttl")))
+        self.server.stats.record("cache_create")
+        self._send_json(200, {"name": name, "model": body.get("model"), "usageMetadata": {"totalTokenCount": tokens}})
+
+    def _response(self, text, usage=None):
+        usage = usage or {"promptTokenCount": 100}
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+            "usageMetadata": {**usage, "candidatesTokenCount": len(text) // 4},
+        }
+
+    def _send_json(self, status, payload, headers=None):
+        out = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _send_stream(self, text, config, usage=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = text.split(" ")
+        size = max(1, -(-len(words) // config.chunks))
+        for start in range(0, len(words), size):
+            piece = " ".join(words[start:start + size]) + (" " if start + size < len(words) else "")
+            event = f"data: {json.dumps(self._response(piece, usage))}\r\n\r\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            self.wfile.flush()
+            time.sleep(config.chunk_delay())
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Starts the mock in a daemon thread and returns the server; its base URL is `server.api_base`."""
+    server = ThreadingHTTPServer((host, port), MockGeminiHandler)
+    server.daemon_threads = True
+    server.config = config or MockConfig()
+    server.stats = MockStats()
+    server.caches = MockCaches()
+    server.api_base = f"http://{host}:{server.server_port}/v1beta"
+    threading.Thread(target=server.serve_forever, name="mock-gemini", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:-1,0.5", help=parse_latency.__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--chunks", type=int, default=8)
+    parser.add_argument("--chunk-delay", default="const:0.02")
+    parser.add_argument("--prefill-per-1k", type=float, default=0.0, help="Seconds per 1000 uncached prompt tokens.")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024)
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.rate_429, args.rate_5xx, args.retry_after, args.chunks, args.chunk_delay,
+                        args.prefill_per_1k, args.cache_min_tokens)
+    server = start_server(config, args.host, args.port)
+    print(f"mock Gemini API at {server.api_base}")
+    try:
+        while True:
+            time.sleep(10)
+            print("requests:", server.stats.snapshot())
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for budgeting requests."""
+    return len(text) // 4 + 1
+
+
+def _to_content(message):
+    role = "model" if message["role"] == "assistant" else "user"
+    return {"role": role, "parts": [{"text": message["content"]}]}
+
+
+class ChatContextManager:
+    """
+    Builds the multi-turn `contents` sent with each chat message.
+
+    Recent turns are sent verbatim while they fit in `token_budget`. Older
+    turns are folded into a rolling summary that is stored per conversation,
+    so each turn is summarized once and request size stays bounded however
+    long the conversation gets. When folding, the window is trimmed down to
+    `token_budget * keep_ratio` so summarization runs every few turns rather
+    than on every message.
+
+    Summarizing is a model call, so `build` never waits for it: once the
+    turns outgrow the budget it calls `schedule_fold(user_id, conversation_id)`,
+    which should run `fold` in the background, and keeps sending every
+    unsummarized turn until the new summary is stored.
+    """
+
+    def __init__(self, storage, token_budget=4000, keep_ratio=0.5, schedule_fold=None):
+        self.storage = storage
+        self.token_budget = token_budget
+        self.keep_ratio = keep_ratio
+        self.schedule_fold = schedule_fold
+
+    def build(self, user_id, conversation_id):
+        """Returns (contents, summary) describing the conversation so far."""
+        summary, summarized_through = self.storage.load_conversation_summary(user_id, conversation_id)
+        messages = self.storage.list_messages_after(user_id, conversation_id, summarized_through)
+        if self.schedule_fold is not None and sum(estimate_tokens(m["content"]) for m in messages) > self.token_budget:
+            self.schedule_fold(user_id, conversation_id)
+
+        # Gemini expects the conversation to open with a user turn.
+        while messages and messages[0]["role"] != "user":
+            messages = messages[1:]
+        return [_to_content(message) for message in messages], summary
+
+    def fold(self, user_id, conversation_id, summarize):
+        """
+        Folds the turns that no longer fit in the trimmed window into the stored
+        summary. `summarize(summary, messages)` returns the new summary text and
+        may raise; nothing is stored unless it succeeds. Returns True if the
+        summary was updated.
+        """
+        summary, summarized_through = self.storage.load_conversation_summary(user_id, conversation_id)
+        messages = self.storage.list_messages_after(user_id, conversation_id, summarized_through)
+        sizes = [estimate_tokens(message["content"]) for message in messages]
+        if sum(sizes) <= self.token_budget:
+            return False
+        folded = messages[:self._window_start(sizes, int(self.token_budget * self.keep_ratio))]
+        if not folded:
+            return False
+        new_summary = summarize(summary, folded)
+        if not new_summary:
+            return False
+        self.storage.save_conversation_summary(user_id, conversation_id, new_summary, folded[-1]["seq"])
+        return True
+
+    @staticmethod
+    def _window_start(sizes, budget):
+        """Index of the oldest message that still fits in `budget` counting back from the newest."""
+        total = 0
+        for index in range(len(sizes) - 1, -1, -1):
+            total += sizes[index]
+            if total > budget:
+                return index + 1
+        return 0
+
+
+def summary_prompt(summary, messages):
+    transcript = "\n".join(f"{message['role'].title()}: {message['content']}" for message in messages)
+    return (
+        f"You keep a running summary of a supportive conversation between a user and their AI companion.\n\n"
+        f"Current summary:\n{summary or '(none yet)'}\n\n"
+        f"New turns:\n{transcript}\n\n"
+        f"Rewrite the summary to include the new turns in at most 150 words. Keep the user's feelings, "
+        f"concerns, names and any plans or advice given. Reply with the summary only."
+    )
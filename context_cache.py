@@ -0,0 +1,185 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from gemini_client import GeminiError
+from metrics import METRICS
+
+# A cache closer than this to expiring is not used, so it cannot expire while the request is in flight.
+MIN_REMAINING_SECONDS = 30
+# Superseded or evicted caches are shortened to this TTL rather than deleted, so requests using them can finish.
+RETIRED_TTL_SECONDS = 120
+
+
+def _chain(digest, item):
+    return hashlib.sha256(digest + json.dumps(item, sort_keys=True, ensure_ascii=False).encode("utf-8")).digest()
+
+
+def _text_tokens(items):
+    """Rough token count of the text parts of `contents` entries (or a system instruction)."""
+    return sum(len(part.get("text", "")) for item in items if item for part in item.get("parts", [])) // 4
+
+
+class _CachedContext:
+    __slots__ = ("name", "api_key", "expires_at", "refreshing")
+
+    def __init__(self, name, api_key, expires_at):
+        self.name = name
+        self.api_key = api_key
+        self.expires_at = expires_at
+        self.refreshing = False
+
+
+class ContextCache:
+    """
+    Server-side Gemini cached contents for the stable prefix of requests: the
+    system instruction (the persona) plus the earlier turns of a conversation.
+
+    `prepare` swaps the longest live cached prefix of a payload for a
+    `cachedContent` reference. Once the uncached part of the prefix reaches
+    `min_tokens` (the API's minimum cache size), a cache covering all of it
+    is created in the background for the next turn, and the shorter caches
+    of that conversation are retired. Caches live for `ttl` seconds and are
+    extended when used within `refresh_margin` seconds of expiring; at most
+    `max_entries` are kept. Caches belong to the API key that created them.
+    A failed creation is not retried for `retry_after` seconds.
+    """
+
+    def __init__(self, client, ttl=3600, refresh_margin=300, min_tokens=1024, max_entries=256,
+                 retry_after=600.0, metrics=METRICS):
+        self.client = client
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self.retry_after = retry_after
+        self.metrics = metrics
+        self._entries = OrderedDict()
+        self._names = {}
+        self._failed = OrderedDict()
+        self._creating = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="context-cache")
+
+    @staticmethod
+    def _prefix_keys(api_key, model, payload):
+        """Keys of the system instruction alone and of each longer prefix of earlier turns, shortest first."""
+        digest = _chain(b"", [hashlib.sha256(api_key.encode("utf-8")).hexdigest(), model, payload.get("systemInstruction")])
+        keys = [digest]
+        for item in payload["contents"][:-1]:
+            digest = _chain(digest, item)
+            keys.append(digest)
+        return keys
+
+    def prepare(self, api_key, payload, model, call_site="other"):
+        """
+        Returns the payload to send: either `payload` itself, or a copy whose
+        system instruction and leading turns are replaced by a cached content.
+        """
+        keys = self._prefix_keys(api_key, model, payload)
+        now = time.monotonic()
+        hit, refresh = None, False
+        with self._lock:
+            for length in range(len(keys) - 1, -1, -1):
+                entry = self._entries.get(keys[length])
+                if entry is None:
+                    continue
+                if entry.expires_at - now < MIN_REMAINING_SECONDS:
+                    self._drop(keys[length])
+                    self.metrics.inc("gemini_context_cache_total", call_site=call_site, outcome="expired")
+                    continue
+                self._entries.move_to_end(keys[length])
+                hit = length, entry
+                if entry.expires_at - now < self.refresh_margin and not entry.refreshing:
+                    entry.refreshing = refresh = True
+                break
+
+        cached_length = hit[0] if hit is not None else -1
+        uncached = payload["contents"][max(cached_length, 0):-1]
+        if cached_length < 0:
+            uncached = [payload.get("systemInstruction"), *uncached]
+        if _text_tokens(uncached) >= self.min_tokens:
+            self._create_later(api_key, model, payload, keys, call_site)
+        if refresh:
+            self._executor.submit(self._refresh, hit[1], call_site)
+
+        if hit is None:
+            self.metrics.inc("gemini_context_cache_total", call_site=call_site, outcome="miss")
+            return payload
+        self.metrics.inc("gemini_context_cache_total", call_site=call_site, outcome="hit")
+        prepared = {name: value for name, value in payload.items() if name != "systemInstruction"}
+        prepared["contents"] = payload["contents"][cached_length:]
+        prepared["cachedContent"] = hit[1].name
+        return prepared
+
+    def invalidate(self, name):
+        """Forgets a cached content the API no longer accepts, e.g. one that expired early."""
+        with self._lock:
+            key = self._names.get(name)
+            if key is not None:
+                self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        del self._names[entry.name]
+        return entry
+
+    def _create_later(self, api_key, model, payload, keys, call_site):
+        key = keys[-1]
+        with self._lock:
+            if key in self._entries or key in self._creating or self._failed.get(key, 0) > time.monotonic():
+                return
+            self._failed.pop(key, None)
+            self._creating.add(key)
+        self._executor.submit(self._create, api_key, model, payload, keys, call_site)
+
+    def _create(self, api_key, model, payload, keys, call_site):
+        key = keys[-1]
+        started = time.monotonic()
+        try:
+            name = self.client.create_cached_content(
+                api_key, model, payload.get("systemInstruction"), payload["contents"][:-1], self.ttl, call_site,
+            )
+        except GeminiError:
+            with self._lock:
+                self._creating.discard(key)
+                self._failed[key] = time.monotonic() + self.retry_after
+                while len(self._failed) > self.max_entries:
+                    self._failed.popitem(last=False)
+            self.metrics.inc("gemini_context_cache_total", call_site=call_site, outcome="create_failed")
+            return
+
+        with self._lock:
+            self._creating.discard(key)
+            self._entries[key] = _CachedContext(name, api_key, started + self.ttl)
+            self._names[name] = key
+            # Shorter caches of the same conversation are superseded; the bare
+            # system instruction is shared by every conversation and is kept.
+            stale = [self._drop(other) for other in keys[1:-1] if other in self._entries]
+            while len(self._entries) > self.max_entries:
+                stale.append(self._drop(next(iter(self._entries))))
+        self.metrics.inc("gemini_context_cache_total", call_site=call_site, outcome="created")
+        for entry in stale:
+            self._retire(entry, call_site)
+
+    def _refresh(self, entry, call_site):
+        started = time.monotonic()
+        try:
+            self.client.update_cached_content_ttl(entry.api_key, entry.name, self.ttl, call_site)
+        except GeminiError:
+            self.metrics.inc("gemini_context_cache_total", call_site=call_site, outcome="refresh_failed")
+        else:
+            entry.expires_at = started + self.ttl
+            self.metrics.inc("gemini_context_cache_total", call_site=call_site, outcome="refreshed")
+        finally:
+            entry.refreshing = False
+
+    def _retire(self, entry, call_site):
+        try:
+            self.client.update_cached_content_ttl(entry.api_key, entry.name, RETIRED_TTL_SECONDS, call_site)
+        except GeminiError:
+            # It expires on its own after the TTL.
+            pass
@@ -0,0 +1,112 @@
+import json
+import math
+import re
+import string
+import time
+from collections import deque
+
+# Punctuation becomes a separator; letters, digits and Devanagari vowel signs are kept.
+_SEPARATORS = str.maketrans({char: " " for char in string.punctuation.replace("'", "") + "।॥‘’“”…"})
+
+
+def normalize(text):
+    return " ".join(text.casefold().replace("’", "'").translate(_SEPARATORS).split())
+
+
+class PhraseMatcher:
+    """
+    Finds a fixed set of phrases with one compiled regex: an alternation,
+    longest phrase first, tried at every word start. Only matches that start
+    and end on word boundaries are reported. A phrase contained in a longer
+    match (e.g. "die" in "want to die") is reported along with it.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = [normalize(phrase) for phrase in phrases]
+        index = {}
+        for i, phrase in enumerate(self.phrases):
+            index.setdefault(phrase, []).append(i)
+        # Spaces, not \b: normalized words can contain apostrophes and
+        # Devanagari vowel signs, which \b treats as boundaries.
+        alternation = "|".join(re.escape(phrase) for phrase in sorted(index, key=len, reverse=True))
+        self._pattern = re.compile(f"(?<![^ ])(?=({alternation})(?![^ ]))") if index else None
+        self._contained = {
+            phrase: frozenset(i for other, indices in index.items() if f" {other} " in f" {phrase} " for i in indices)
+            for phrase in index
+        }
+
+    def find(self, normalized_text):
+        """Returns the indices of the phrases found in already-normalized text."""
+        if self._pattern is None:
+            return set()
+        found = set()
+        for match in self._pattern.finditer(normalized_text):
+            found |= self._contained[match.group(1)]
+        return found
+
+
+class Verdict:
+    def __init__(self, level, message_score, window_score, matches):
+        self.level = level
+        self.message_score = message_score
+        self.window_score = window_score
+        self.matches = matches
+
+    @property
+    def is_crisis(self):
+        return self.level == "high"
+
+
+class CrisisScanner:
+    """
+    Scores text against a weighted, multilingual phrase lexicon. A single
+    phrase at or above `immediate_weight` flags a crisis straight away; weaker
+    signals accumulate in a per-session window where they decay with
+    `half_life` seconds.
+    """
+
+    def __init__(self, lexicon, immediate_weight=0.8, high_threshold=1.0,
+                 elevated_threshold=0.5, half_life=1800.0, window=20):
+        weights = {}
+        for entry in lexicon:
+            phrase = normalize(entry["phrase"])
+            weights[phrase] = max(weights.get(phrase, 0.0), float(entry["weight"]))
+        self.matcher = PhraseMatcher(list(weights))
+        self.weights = list(weights.values())
+        self.immediate_weight = immediate_weight
+        self.high_threshold = high_threshold
+        self.elevated_threshold = elevated_threshold
+        self.half_life = half_life
+        self.window = window
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["phrases"], **kwargs)
+
+    def new_window(self):
+        """Per-session sliding window of (timestamp, score) signals."""
+        return deque(maxlen=self.window)
+
+    def scan(self, text, signals=None, now=None):
+        """Scores one message and, if a window is given, records it there."""
+        now = time.time() if now is None else now
+        found = self.matcher.find(normalize(text))
+        weights = [self.weights[index] for index in found]
+        message_score = sum(weights)
+        if signals is not None:
+            if message_score:
+                signals.append((now, message_score))
+            window_score = sum(
+                score * math.pow(0.5, (now - at) / self.half_life) for at, score in signals
+            )
+        else:
+            window_score = message_score
+
+        if (weights and max(weights) >= self.immediate_weight) or window_score >= self.high_threshold:
+            level = "high"
+        elif window_score >= self.elevated_threshold:
+            level = "elevated"
+        else:
+            level = "none"
+        return Verdict(level, message_score, window_score, sorted(self.matcher.phrases[index] for index in found))
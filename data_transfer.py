@@ -0,0 +1,276 @@
+"""
+Streaming export and import of journal entries and chat transcripts.
+
+Exports are generators of text chunks and imports consume an iterator of
+lines, so the command line's memory use does not depend on the size of the
+history. The app's download and upload widgets hold the whole file in
+memory, so there exports and imports are capped in size. Command line:
+
+    python data_transfer.py export --db mannmitra.db --user USER_ID --kind journal --format jsonl -o journal.jsonl
+    python data_transfer.py import --db mannmitra.db --user USER_ID --kind journal --format csv -i journal.csv
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+from datetime import date
+
+JOURNAL_EXPORT_FIELDS = ("date", "text", "mood", "summary", "tip")
+MESSAGE_EXPORT_FIELDS = ("conversation_id", "seq", "role", "content", "created_at")
+IMPORT_MOODS = {"happy", "calm", "sad", "stressed", "anxious"}
+MESSAGE_ROLES = {"user", "assistant"}
+MAX_TEXT_LENGTH = 50_000
+CHUNK_SIZE = 64 * 1024
+# Well above MAX_TEXT_LENGTH, so an over-long field is reported as an invalid
+# row instead of stopping the import with csv.Error.
+csv.field_size_limit(max(csv.field_size_limit(), 4 * MAX_TEXT_LENGTH))
+
+
+class ImportErrors:
+    """Collects per-row validation errors, keeping only the first few messages."""
+
+    def __init__(self, keep=20):
+        self.keep = keep
+        self.count = 0
+        self.messages = []
+
+    def add(self, line_number, message):
+        self.count += 1
+        if len(self.messages) < self.keep:
+            self.messages.append(f"Line {line_number}: {message}")
+
+
+class ImportAborted(Exception):
+    """
+    Raised when a file cannot be read any further (bad encoding, malformed
+    CSV). Rows of the batches before the failure are already stored.
+    """
+
+    def __init__(self, message, imported, errors):
+        super().__init__(message)
+        self.imported = imported
+        self.errors = errors
+
+
+def _chunked(pieces, size=CHUNK_SIZE):
+    """Joins small strings into chunks of roughly `size` characters."""
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def export_jsonl(rows, fields):
+    """Yields JSON Lines chunks for an iterator of row tuples in `fields` order."""
+    return _chunked(json.dumps(dict(zip(fields, row)), ensure_ascii=False) + "\n" for row in rows)
+
+
+def export_csv(rows, fields):
+    """Yields CSV chunks (with a header) for an iterator of row tuples in `fields` order."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def lines():
+        for row in itertools.chain([fields], rows):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    return _chunked(lines())
+
+
+EXPORTERS = {"jsonl": export_jsonl, "csv": export_csv}
+MIME_TYPES = {"jsonl": "application/jsonl", "csv": "text/csv"}
+
+
+def collect(chunks, max_bytes):
+    """
+    Encodes text chunks into one UTF-8 bytes object, for consumers that need
+    the whole file in memory. Raises ValueError once it would exceed `max_bytes`.
+    """
+    out, size = [], 0
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        size += len(data)
+        if size > max_bytes:
+            raise ValueError(f"The export is larger than {max_bytes // (1024 * 1024)} MB.")
+        out.append(data)
+    return b"".join(out)
+
+
+def read_records(lines, fmt):
+    """Yields (line number, dict) for each record of a JSONL or CSV text stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f"invalid JSON ({e})")
+            continue
+        yield line_number, record if isinstance(record, dict) else ValueError("expected a JSON object")
+
+
+def _optional_text(record, field):
+    value = record.get(field)
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be text")
+    return value.strip() or None
+
+
+def validate_journal_entry(record):
+    """Returns a clean entry dict for storage, or raises ValueError."""
+    entry_date = record.get("date")
+    try:
+        entry_date = date.fromisoformat(str(entry_date).strip()).isoformat()
+    except ValueError:
+        raise ValueError(f"date must be YYYY-MM-DD, got {entry_date!r}")
+    text = record.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("text is required")
+    if len(text) > MAX_TEXT_LENGTH:
+        raise ValueError(f"text is longer than {MAX_TEXT_LENGTH} characters")
+    mood = _optional_text(record, "mood")
+    if mood is not None:
+        mood = mood.lower()
+        if mood not in IMPORT_MOODS:
+            raise ValueError(f"unknown mood {mood!r}")
+    return {
+        "date": entry_date,
+        "text": text,
+        "mood": mood,
+        "summary": _optional_text(record, "summary"),
+        "tip": _optional_text(record, "tip"),
+    }
+
+
+def validate_message(record):
+    conversation_id = _optional_text(record, "conversation_id")
+    if conversation_id is None:
+        raise ValueError("conversation_id is required")
+    role = _optional_text(record, "role")
+    if role not in MESSAGE_ROLES:
+        raise ValueError(f"role must be user or assistant, got {role!r}")
+    content = record.get("content")
+    if not isinstance(content, str) or not content:
+        raise ValueError("content is required")
+    if len(content) > MAX_TEXT_LENGTH:
+        raise ValueError(f"content is longer than {MAX_TEXT_LENGTH} characters")
+    created_at = record.get("created_at")
+    try:
+        created_at = float(created_at) if created_at not in (None, "") else None
+    except (TypeError, ValueError):
+        raise ValueError("created_at must be a Unix timestamp")
+    return {"conversation_id": conversation_id, "role": role, "content": content, "created_at": created_at}
+
+
+def _valid(records, validate, errors):
+    for line_number, record in records:
+        if isinstance(record, Exception):
+            errors.add(line_number, str(record))
+            continue
+        try:
+            yield validate(record)
+        except ValueError as e:
+            errors.add(line_number, str(e))
+
+
+def import_records(lines, fmt, validate, insert_batch, batch_size=5000):
+    """
+    Validates records from a text stream and inserts them `batch_size` at a
+    time with `insert_batch(list)`. Invalid rows are skipped and reported.
+    Returns (rows imported, ImportErrors), or raises ImportAborted if the
+    stream cannot be read to the end.
+    """
+    errors = ImportErrors()
+    valid = _valid(read_records(lines, fmt), validate, errors)
+    imported = 0
+    while True:
+        try:
+            batch = list(itertools.islice(valid, batch_size))
+        except UnicodeDecodeError:
+            raise ImportAborted("The file is not UTF-8 encoded text.", imported, errors)
+        except csv.Error as e:
+            raise ImportAborted(f"The file is not valid CSV ({e}).", imported, errors)
+        if not batch:
+            return imported, errors
+        insert_batch(batch)
+        imported += len(batch)
+
+
+def export_journal(storage, user_id, fmt):
+    return EXPORTERS[fmt](storage.iter_journal_entries(user_id), JOURNAL_EXPORT_FIELDS)
+
+
+def export_messages(storage, user_id, fmt):
+    return EXPORTERS[fmt](storage.iter_messages(user_id), MESSAGE_EXPORT_FIELDS)
+
+
+def import_journal(storage, user_id, lines, fmt, batch_size=5000):
+    return import_records(lines, fmt, validate_journal_entry,
+                          lambda batch: storage.add_journal_entries(user_id, batch), batch_size)
+
+
+def import_messages(storage, user_id, lines, fmt, batch_size=5000):
+    return import_records(lines, fmt, validate_message,
+                          lambda batch: storage.add_messages(user_id, batch), batch_size)
+
+
+def main():
+    from storage import SQLiteStorage
+
+    parser = argparse.ArgumentParser(description="Export or import MannMitra journals and chat transcripts.")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("--db", default="mannmitra.db")
+    parser.add_argument("--user", required=True, help="User id (the hashed API key).")
+    parser.add_argument("--kind", choices=["journal", "messages"], default="journal")
+    parser.add_argument("--format", choices=sorted(EXPORTERS), default="jsonl")
+    parser.add_argument("-o", "--output", help="Export destination (defaults to stdout).")
+    parser.add_argument("-i", "--input", help="Import source.")
+    args = parser.parse_args()
+
+    storage = SQLiteStorage(args.db)
+    if args.action == "export":
+        export = export_journal if args.kind == "journal" else export_messages
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            for chunk in export(storage, args.user, args.format):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return
+
+    if not args.input:
+        parser.error("import needs --input")
+    load = import_journal if args.kind == "journal" else import_messages
+    aborted = None
+    with open(args.input, encoding="utf-8", newline="") as f:
+        try:
+            imported, errors = load(storage, args.user, f, args.format)
+        except ImportAborted as e:
+            aborted, imported, errors = e, e.imported, e.errors
+    print(f"imported {imported} rows, skipped {errors.count}")
+    for message in errors.messages:
+        print(f"  {message}")
+    if aborted is not None:
+        sys.exit(f"import stopped early: {aborted}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+from rate_limit import CALL_SITE_PRIORITIES, RateLimitTimeout, SingleFlight
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    """
+    Raised when a Gemini call fails and should not be retried any further.
+    `status` is the HTTP status of the API's answer, if there was one.
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(GeminiError):
+    """Raised without touching the network while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated upstream failures. After `reset_timeout` seconds
+    a single trial call is let through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_inconclusive(self):
+        """Ends a call that says nothing about upstream health, e.g. a malformed request."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+def _retry_after_seconds(response):
+    """Parses a Retry-After header given either in seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_sse_data(lines):
+    """Yields the decoded JSON payload of each server-sent event."""
+    data = []
+    for line in lines:
+        if line is None:
+            continue
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line:
+            if data:
+                yield json.loads("\n".join(data))
+                data = []
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+    if data:
+        yield json.loads("\n".join(data))
+
+
+def extract_text(result):
+    """Returns the text of the first candidate of a generateContent result."""
+    try:
+        parts = result["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError, TypeError):
+        raise GeminiError("The API returned a response without any text.")
+    return "".join(part.get("text", "") for part in parts)
+
+
+def record_usage(metrics, call_site, result):
+    """
+    Adds the prompt and response token counts from `usageMetadata` to the
+    metrics and returns their total, or None if the result has no usage.
+    """
+    usage = result.get("usageMetadata") if isinstance(result, dict) else None
+    if not usage:
+        return None
+    prompt, response = usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0)
+    cached = usage.get("cachedContentTokenCount", 0)
+    metrics.inc("gemini_tokens_total", prompt, call_site=call_site, kind="prompt")
+    metrics.inc("gemini_tokens_total", cached, call_site=call_site, kind="prompt_cached")
+    metrics.inc("gemini_tokens_total", prompt - cached, call_site=call_site, kind="prompt_uncached")
+    metrics.inc("gemini_tokens_total", response, call_site=call_site, kind="response")
+    return prompt + response
+
+
+def estimate_payload_tokens(payload):
+    """Rough token count of a request, used to reserve tokens/minute before sending it."""
+    return len(json.dumps(payload, ensure_ascii=False)) // 4
+
+
+class GeminiClient:
+    """
+    Process-wide Gemini REST client. Keeps a keep-alive connection pool, applies
+    connect/read timeouts, retries 429/5xx and connection errors with jittered
+    exponential backoff (honoring Retry-After) and guards the upstream with a
+    circuit breaker. At most `max_concurrency_per_key` requests per API key are
+    in flight at once. With a `rate_limiter`, every attempt first waits for
+    request and token capacity for its key, queued by call-site priority.
+    Identical concurrent generateContent calls are coalesced into one.
+    Latency, attempt outcomes and token usage are recorded in `metrics`,
+    labelled with the caller's `call_site`.
+    """
+
+    def __init__(self, api_base, model, connect_timeout=5.0, read_timeout=60.0,
+                 max_retries=3, backoff_base=0.5, backoff_cap=8.0, pool_size=32,
+                 circuit_breaker=None, max_concurrency_per_key=4, max_workers=16, metrics=METRICS,
+                 rate_limiter=None):
+        self.api_base = api_base.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.metrics = metrics
+        self.rate_limiter = rate_limiter
+        self._single_flight = SingleFlight()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.max_concurrency_per_key = max_concurrency_per_key
+        # api_key -> [semaphore, callers holding or waiting for it]; an entry is
+        # dropped when its last caller leaves, so idle keys do not accumulate.
+        self._key_slots = {}
+        self._key_slots_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+
+    def _url(self, method, api_key, model=None, query=""):
+        return f"{self.api_base}/models/{model or self.model}:{method}?{query}key={api_key}"
+
+    def _resource_url(self, name, api_key, query=""):
+        return f"{self.api_base}/{name}?{query}key={api_key}"
+
+    def _backoff(self, attempt, response=None):
+        retry_after = _retry_after_seconds(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_cap)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    @contextmanager
+    def _key_slot(self, api_key):
+        with self._key_slots_lock:
+            slot = self._key_slots.get(api_key)
+            if slot is None:
+                slot = self._key_slots[api_key] = [threading.BoundedSemaphore(self.max_concurrency_per_key), 0]
+            slot[1] += 1
+        try:
+            with slot[0]:
+                yield
+        finally:
+            with self._key_slots_lock:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self._key_slots[api_key]
+
+    def _acquire(self, api_key, tokens, call_site):
+        if self.rate_limiter is None:
+            return
+        try:
+            waited = self.rate_limiter.acquire(api_key, tokens, CALL_SITE_PRIORITIES.get(call_site, CALL_SITE_PRIORITIES["other"]))
+        except RateLimitTimeout as e:
+            self.metrics.inc("gemini_attempts_total", call_site=call_site, outcome="rate_limited")
+            raise GeminiError(str(e))
+        self.metrics.observe("gemini_rate_limit_wait_seconds", waited, call_site=call_site)
+
+    def _settle(self, api_key, estimated_tokens, actual_tokens):
+        if self.rate_limiter is not None and actual_tokens is not None:
+            self.rate_limiter.settle(api_key, estimated_tokens, actual_tokens)
+
+    def _post(self, url, payload, api_key, stream=False, call_site="other", tokens=0, method="POST", rate_limited=True):
+        """
+        Sends the request with retries and returns a 200 response; raises
+        GeminiError otherwise. Requests that are not `rate_limited` skip the
+        per-key rate limiter, e.g. cached content management.
+        """
+        last_error, last_status = "Failed to get a response after multiple retries.", None
+        for attempt in range(self.max_retries):
+            if attempt:
+                self.metrics.inc("gemini_retries_total", call_site=call_site)
+            if rate_limited:
+                self._acquire(api_key, tokens, call_site)
+            if not self.circuit_breaker.allow():
+                self.metrics.inc("gemini_attempts_total", call_site=call_site, outcome="circuit_open")
+                raise CircuitOpenError("The Gemini API is currently unavailable. Please try again shortly.")
+            try:
+                with self._key_slot(api_key):
+                    response = self.session.request(method, url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                # ChunkedEncodingError is a connection reset partway through the body.
+                self.metrics.inc("gemini_attempts_total", call_site=call_site, outcome="connection_error")
+                self.circuit_breaker.record_failure()
+                last_error = f"Request failed: {e}"
+                if attempt + 1 < self.max_retries:
+                    time.sleep(self._backoff(attempt))
+                last_status = None
+                continue
+            except requests.exceptions.RequestException as e:
+                self.metrics.inc("gemini_attempts_total", call_site=call_site, outcome="request_error")
+                self.circuit_breaker.record_inconclusive()
+                raise GeminiError(f"Request failed: {e}")
+
+            self.metrics.inc("gemini_attempts_total", call_site=call_site, outcome=str(response.status_code))
+            if response.status_code == 200:
+                self.circuit_breaker.record_success()
+                return response
+            body = response.text
+            response.close()
+            if response.status_code not in RETRY_STATUSES:
+                self.circuit_breaker.record_success()
+                raise GeminiError(f"API Error: {response.status_code} - {body}", status=response.status_code)
+            if response.status_code == 429:
+                self.circuit_breaker.record_success()
+            else:
+                self.circuit_breaker.record_failure()
+            last_error = f"API Error: {response.status_code} - {body}"
+            last_status = response.status_code
+            if attempt + 1 < self.max_retries:
+                delay = self._backoff(attempt, response)
+                if response.status_code == 429 and self.rate_limiter is not None:
+                    # Hold back the other requests queued for this key as well.
+                    self.rate_limiter.pause(api_key, delay)
+                time.sleep(delay)
+        raise GeminiError(last_error, status=last_status)
+
+    @contextmanager
+    def _timed(self, method, call_site):
+        started = time.perf_counter()
+        try:
+            yield
+        except GeminiError:
+            self.metrics.inc("gemini_errors_total", call_site=call_site)
+            raise
+        finally:
+            self.metrics.observe("gemini_request_seconds", time.perf_counter() - started, call_site=call_site, method=method)
+
+    def _generate_once(self, api_key, payload, model, call_site):
+        tokens = estimate_payload_tokens(payload)
+        try:
+            with self._timed("generateContent", call_site):
+                response = self._post(
+                    self._url("generateContent", api_key, model), payload, api_key, call_site=call_site, tokens=tokens,
+                )
+                try:
+                    result = response.json()
+                except ValueError:
+                    raise GeminiError("The API returned a malformed response.")
+        except GeminiError as e:
+            return None, e
+        self._settle(api_key, tokens, record_usage(self.metrics, call_site, result))
+        return result, None
+
+    def generate(self, api_key, payload, model=None, call_site="other"):
+        """
+        Calls generateContent and returns the decoded JSON result. A call made
+        while an identical one (same model and payload) is in flight waits for
+        and shares that call's result instead of going upstream again.
+        """
+        key = hashlib.sha256(json.dumps([model or self.model, payload], sort_keys=True).encode("utf-8")).hexdigest()
+        (result, error), shared = self._single_flight.do(
+            key, lambda: self._generate_once(api_key, payload, model, call_site)
+        )
+        if shared:
+            self.metrics.inc("gemini_coalesced_total", call_site=call_site)
+            if error is not None:
+                # The leader's failure may be specific to its API key, so try with ours.
+                result, error = self._generate_once(api_key, payload, model, call_site)
+        if error is not None:
+            raise error
+        return result
+
+    def generate_text(self, api_key, payload, model=None, call_site="other"):
+        return extract_text(self.generate(api_key, payload, model, call_site))
+
+    def generate_many(self, api_key, payloads, model=None, call_site="other"):
+        """
+        Runs independent generateContent calls concurrently on the shared pool.
+        Returns one (text, error) pair per payload, in the order given.
+        """
+        def run(payload):
+            try:
+                return self.generate_text(api_key, payload, model, call_site), None
+            except GeminiError as e:
+                return None, str(e)
+
+        return list(self._executor.map(run, payloads))
+
+    def stream_text(self, api_key, payload, model=None, call_site="other"):
+        """
+        Calls streamGenerateContent over SSE and yields text chunks as they arrive.
+        Retries only happen before the first chunk has been yielded.
+        """
+        tokens = estimate_payload_tokens(payload)
+        started, first = time.perf_counter(), True
+        cached = "true" if "cachedContent" in payload else "false"
+        with self._timed("streamGenerateContent", call_site):
+            response = self._post(
+                self._url("streamGenerateContent", api_key, model, "alt=sse&"), payload, api_key,
+                stream=True, call_site=call_site, tokens=tokens,
+            )
+            usage = None
+            with response:
+                try:
+                    # SSE is always UTF-8, but requests would decode a charset-less
+                    # text/event-stream as ISO-8859-1, so lines are decoded in iter_sse_data.
+                    for event in iter_sse_data(response.iter_lines(decode_unicode=False)):
+                        usage = event.get("usageMetadata", usage)
+                        for candidate in event.get("candidates", [])[:1]:
+                            for part in candidate.get("content", {}).get("parts", []):
+                                if part.get("text"):
+                                    if first:
+                                        first = False
+                                        self.metrics.observe(
+                                            "gemini_first_token_seconds", time.perf_counter() - started,
+                                            call_site=call_site, cached=cached,
+                                        )
+                                    yield part["text"]
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    raise GeminiError(f"The response stream was interrupted: {e}")
+            # The final event carries the usage totals for the whole response.
+            self._settle(api_key, tokens, record_usage(self.metrics, call_site, {"usageMetadata": usage}))
+
+    def create_cached_content(self, api_key, model, system_instruction, contents, ttl_seconds, call_site="other"):
+        """
+        Stores a request prefix (system instruction and earlier turns) as a
+        cachedContents resource on the server and returns its name, for use
+        as `cachedContent` in later requests to the same model.
+        """
+        body = {"model": f"models/{model or self.model}", "contents": contents, "ttl": f"{int(ttl_seconds)}s"}
+        if system_instruction:
+            body["systemInstruction"] = system_instruction
+        with self._timed("cachedContents.create", call_site):
+            response = self._post(
+                self._resource_url("cachedContents", api_key), body, api_key, call_site=call_site, rate_limited=False,
+            )
+            try:
+                return response.json()["name"]
+            except (ValueError, KeyError, TypeError):
+                raise GeminiError("The API returned a malformed response.")
+
+    def update_cached_content_ttl(self, api_key, name, ttl_seconds, call_site="other"):
+        """Extends a cached content's lifetime to `ttl_seconds` from now."""
+        with self._timed("cachedContents.patch", call_site):
+            self._post(
+                self._resource_url(name, api_key, "updateMask=ttl&"), {"ttl": f"{int(ttl_seconds)}s"}, api_key,
+                call_site=call_site, method="PATCH", rate_limited=False,
+            ).close()
@@ -0,0 +1,152 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be accepted because the queue is at capacity."""
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures that retrying will not fix."""
+
+
+class Job:
+    __slots__ = ("id", "user_id", "payload", "state", "attempts", "result", "error")
+
+    def __init__(self, user_id, payload):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.payload = payload
+        self.state = "queued"
+        self.attempts = 0
+        self.result = None
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed")
+
+
+class JobQueue:
+    """
+    Background worker pool for slow model calls.
+
+    Jobs are queued per user and workers take users round-robin, so one busy
+    user cannot starve the others. The total queue depth and the number of
+    pending jobs per user are bounded. A job whose handler raises is retried
+    with exponential backoff up to `max_attempts` times; a handler that
+    raises `PermanentJobError` fails the job straight away.
+    """
+
+    def __init__(self, handler, workers=4, max_depth=200, max_pending_per_user=5,
+                 max_attempts=3, retry_delay=2.0, keep_finished=1000):
+        self.handler = handler
+        self.max_depth = max_depth
+        self.max_pending_per_user = max_pending_per_user
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.keep_finished = keep_finished
+        self._jobs = OrderedDict()
+        self._per_user = {}
+        self._ready_users = deque()
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._depth = 0
+        self._open_by_user = Counter()
+        self._condition = threading.Condition()
+        for index in range(workers):
+            threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True).start()
+
+    def submit(self, user_id, payload):
+        """Queues a job and returns its id; raises QueueFullError when over capacity."""
+        with self._condition:
+            if self._depth >= self.max_depth:
+                raise QueueFullError("The analysis queue is full.")
+            if self._open_by_user[user_id] >= self.max_pending_per_user:
+                raise QueueFullError("Too many analyses are already pending for this user.")
+            job = Job(user_id, payload)
+            self._jobs[job.id] = job
+            self._enqueue(job)
+            self._depth += 1
+            self._open_by_user[user_id] += 1
+            self._condition.notify()
+            return job.id
+
+    def status(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def depth(self):
+        with self._condition:
+            return self._depth
+
+    def _enqueue(self, job):
+        pending = self._per_user.get(job.user_id)
+        if pending is None:
+            pending = self._per_user[job.user_id] = deque()
+            self._ready_users.append(job.user_id)
+        pending.append(job)
+
+    def _next_job(self):
+        """Pops the next job round-robin across users; must hold the lock."""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, job = heapq.heappop(self._delayed)
+            self._enqueue(job)
+        if not self._ready_users:
+            return None
+        user_id = self._ready_users.popleft()
+        pending = self._per_user[user_id]
+        job = pending.popleft()
+        if pending:
+            self._ready_users.append(user_id)
+        else:
+            del self._per_user[user_id]
+        return job
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    timeout = self._delayed[0][0] - time.monotonic() if self._delayed else None
+                    self._condition.wait(timeout)
+                    job = self._next_job()
+                job.state = "running"
+                job.attempts += 1
+
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                with self._condition:
+                    job.error = str(e)
+                    if isinstance(e, PermanentJobError) or job.attempts >= self.max_attempts:
+                        self._finish(job, "failed")
+                    else:
+                        job.state = "queued"
+                        ready_at = time.monotonic() + self.retry_delay * 2 ** (job.attempts - 1)
+                        heapq.heappush(self._delayed, (ready_at, next(self._sequence), job))
+                        self._condition.notify()
+                continue
+
+            with self._condition:
+                job.result = result
+                job.error = None
+                self._finish(job, "done")
+
+    def _finish(self, job, state):
+        job.state = state
+        # Finished jobs are kept for status polling only, so the request is no longer needed.
+        job.payload = None
+        self._depth -= 1
+        self._open_by_user[job.user_id] -= 1
+        if not self._open_by_user[job.user_id]:
+            del self._open_by_user[job.user_id]
+        self._jobs.move_to_end(job.id)
+        finished = [job_id for job_id, other in self._jobs.items() if other.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
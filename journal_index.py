@@ -0,0 +1,234 @@
+import math
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a about after again all also an and any are as at be because been before being but by can could "
+    "did do does don dont for from got had has have he her him his how i if im in into is it its just "
+    "me more much my not now of on only or other our out over really she so some than that the their "
+    "them then there these they this to too up very was we were what when which who will with would "
+    "you your am today feel felt "
+    "hai hain main mein ka ki ke ko se bhi aur tha thi the ho hoon nahi kya".split()
+)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall((text or "").casefold()) if token not in STOPWORDS and len(token) > 1]
+
+
+# Rough per-object overheads, used to estimate an index's memory for the cache budget.
+_TERM_OVERHEAD = 210
+_DOC_OVERHEAD = 130
+_FREQUENCY_BITS = 8
+_FREQUENCY_MASK = (1 << _FREQUENCY_BITS) - 1
+
+
+class _UserIndex:
+    """
+    BM25 inverted index over one user's entries. Deleted entries are
+    tombstoned and swept out once they make up a large share of the index.
+
+    Each term's postings are a single int32 array of (doc slot << 8 | term
+    frequency), and the terms of every doc live in one flat array with
+    offsets, so the index holds a few objects per term rather than per posting.
+    """
+
+    def __init__(self):
+        self.term_ids = {}
+        self.postings = []  # term id -> packed (doc slot, term frequency)
+        self.postings_size = 0
+        self.df = array("i")
+        self.entry_ids = array("q")
+        self.lengths = array("f")
+        self.alive = array("b")
+        self.doc_terms = array("i")
+        self.doc_offsets = array("q", [0])
+        self.slot_of = {}
+        self.total_length = 0.0
+        self.dead = 0
+        self._arrays = None
+
+    def nbytes(self):
+        """Approximate memory held by the index."""
+        return (
+            4 * (self.postings_size + len(self.doc_terms))
+            + _TERM_OVERHEAD * len(self.postings)
+            + _DOC_OVERHEAD * len(self.entry_ids)
+        )
+
+    def add(self, entry_id, text):
+        if entry_id in self.slot_of:
+            self.remove(entry_id)
+        tokens = tokenize(text)
+        counts = {}
+        for token in tokens:
+            term_id = self.term_ids.get(token)
+            if term_id is None:
+                term_id = self.term_ids[token] = len(self.postings)
+                self.postings.append(array("i"))
+                self.df.append(0)
+            counts[term_id] = counts.get(term_id, 0) + 1
+        slot = len(self.entry_ids)
+        for term_id, count in counts.items():
+            self.postings[term_id].append(slot << _FREQUENCY_BITS | min(count, _FREQUENCY_MASK))
+            self.df[term_id] += 1
+        self.postings_size += len(counts)
+        self.entry_ids.append(entry_id)
+        self.lengths.append(len(tokens))
+        self.alive.append(1)
+        self.doc_terms.extend(counts)
+        self.doc_offsets.append(len(self.doc_terms))
+        self.slot_of[entry_id] = slot
+        self.total_length += len(tokens)
+        self._arrays = None
+
+    def remove(self, entry_id):
+        slot = self.slot_of.pop(entry_id, None)
+        if slot is None:
+            return False
+        for term_id in self.doc_terms[self.doc_offsets[slot]:self.doc_offsets[slot + 1]]:
+            self.df[term_id] -= 1
+        self.alive[slot] = 0
+        self.total_length -= self.lengths[slot]
+        self.dead += 1
+        self._arrays = None
+        if self.dead > max(1024, len(self.slot_of)):
+            self._compact()
+        return True
+
+    def _compact(self):
+        live = [slot for slot in range(len(self.entry_ids)) if self.alive[slot]]
+        remap = np.full(len(self.entry_ids), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+        self.postings_size = 0
+        for term_id, packed in enumerate(self.postings):
+            if not packed:
+                continue
+            packed = np.frombuffer(packed, dtype=np.int32)
+            slots = remap[packed >> _FREQUENCY_BITS]
+            keep = slots >= 0
+            packed = (slots[keep] << _FREQUENCY_BITS | packed[keep] & _FREQUENCY_MASK).astype(np.int32)
+            self.postings[term_id] = array("i", packed.tobytes())
+            self.postings_size += len(packed)
+        doc_terms, doc_offsets = array("i"), array("q", [0])
+        for slot in live:
+            doc_terms.extend(self.doc_terms[self.doc_offsets[slot]:self.doc_offsets[slot + 1]])
+            doc_offsets.append(len(doc_terms))
+        self.doc_terms, self.doc_offsets = doc_terms, doc_offsets
+        self.entry_ids = array("q", (self.entry_ids[slot] for slot in live))
+        self.lengths = array("f", (self.lengths[slot] for slot in live))
+        self.alive = array("b", [1] * len(live))
+        self.slot_of = {entry_id: slot for slot, entry_id in enumerate(self.entry_ids)}
+        self.dead = 0
+        self._arrays = None
+
+    def search(self, query, k, k1, b):
+        live = len(self.slot_of)
+        term_ids = {self.term_ids[token] for token in tokenize(query) if token in self.term_ids}
+        term_ids = [term_id for term_id in term_ids if self.df[term_id]]
+        if not live or not term_ids:
+            return []
+        if self._arrays is None:
+            self._arrays = (
+                np.frombuffer(self.lengths, dtype=np.float32).copy(),
+                np.frombuffer(self.alive, dtype=np.int8).astype(bool),
+            )
+        lengths, alive = self._arrays
+        norm = k1 * (1 - b + b * lengths / (self.total_length / live or 1.0))
+        scores = np.zeros(len(lengths), dtype=np.float32)
+        for term_id in term_ids:
+            packed = np.frombuffer(self.postings[term_id], dtype=np.int32)
+            docs = packed >> _FREQUENCY_BITS
+            frequencies = (packed & _FREQUENCY_MASK).astype(np.float32)
+            df = self.df[term_id]
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * frequencies * (k1 + 1) / (frequencies + norm[docs])
+        scores[~alive] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.entry_ids[slot], float(scores[slot])) for slot in hits]
+
+
+class JournalIndex:
+    """
+    Per-user BM25 index over journal text and summaries, kept up to date on
+    every journal save, analysis and delete instead of being rebuilt.
+    A user's index is built once from `load_entries(user_id)`, which must
+    yield (entry_id, text, summary) tuples. With `max_bytes`, the least
+    recently used users are dropped once the indexes outgrow the budget and
+    are rebuilt from `load_entries` the next time they are needed.
+    Updates must be made after the change is stored: they are skipped for
+    users that are not loaded, whose index is built from the store.
+    """
+
+    def __init__(self, load_entries, k1=1.2, b=0.75, max_bytes=None):
+        self.load_entries = load_entries
+        self.k1 = k1
+        self.b = b
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._users = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _user(self, user_id):
+        index = self._users.get(user_id)
+        if index is None:
+            index = _UserIndex()
+            for entry_id, text, summary in self.load_entries(user_id):
+                index.add(entry_id, f"{text}\n{summary or ''}")
+            self._users[user_id] = index
+            self._bytes += index.nbytes()
+        self._users.move_to_end(user_id)
+        self._trim()
+        return index
+
+    def _update(self, user_id, change):
+        if user_id not in self._users:
+            return False
+        index = self._user(user_id)
+        before = index.nbytes()
+        result = change(index)
+        self._bytes += index.nbytes() - before
+        self._trim()
+        return result
+
+    def _trim(self):
+        if self.max_bytes is None:
+            return
+        # The most recently used user is kept even if it alone exceeds the budget.
+        while self._bytes > self.max_bytes and len(self._users) > 1:
+            _, index = self._users.popitem(last=False)
+            self._bytes -= index.nbytes()
+            self.evictions += 1
+
+    def add_entry(self, user_id, entry_id, text, summary=None):
+        """Indexes a new entry, or re-indexes it if it is already in the index."""
+        with self._lock:
+            self._update(user_id, lambda index: index.add(entry_id, f"{text}\n{summary or ''}"))
+
+    def remove_entry(self, user_id, entry_id):
+        with self._lock:
+            return self._update(user_id, lambda index: index.remove(entry_id))
+
+    def forget(self, user_id):
+        with self._lock:
+            index = self._users.pop(user_id, None)
+            if index is not None:
+                self._bytes -= index.nbytes()
+
+    def search(self, user_id, query, k=3):
+        """Returns up to `k` (entry_id, score) pairs for the most relevant entries, best first."""
+        with self._lock:
+            return self._user(user_id).search(query, k, self.k1, self.b)
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._users), "bytes": self._bytes, "evictions": self.evictions}
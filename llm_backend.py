@@ -0,0 +1,391 @@
+"""
+Pluggable text generation backends.
+
+Every backend takes a Gemini-style generateContent `payload` and the
+`call_site` making the call, so wrappers can be stacked:
+
+    FallbackBackend(HedgedBackend(GeminiBackend(...), GeminiBackend(...)), LocalFallbackBackend(...))
+
+picks a model per call site, hedges slow calls with a backup request and
+serves a canned or previously seen response when the upstream is slow or down.
+"""
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from gemini_client import CircuitOpenError, GeminiError
+from metrics import METRICS
+
+_DONE = object()
+
+
+class FallbackText(str):
+    """A response served by the local fallback rather than by the model."""
+
+
+class LLMBackend:
+    """Interface shared by every backend."""
+
+    def generate_text(self, api_key, payload, call_site="other"):
+        raise NotImplementedError
+
+    def stream_text(self, api_key, payload, call_site="other"):
+        """Yields text chunks; backends without streaming yield the whole response."""
+        yield self.generate_text(api_key, payload, call_site)
+
+    def generate_many(self, api_key, payloads, call_site="other"):
+        """Returns one (text, error) pair per payload, in the order given."""
+        def run(payload):
+            try:
+                return self.generate_text(api_key, payload, call_site), None
+            except GeminiError as e:
+                return None, str(e)
+
+        executor = getattr(self, "_batch_executor", None)
+        return list(executor.map(run, payloads)) if executor is not None else [run(payload) for payload in payloads]
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Calls Gemini through a shared GeminiClient with a model chosen per call
+    site. With a `context_cache`, requests from `cached_call_sites` reuse
+    server-side cached prefixes; a request the API rejects because of its
+    cached content is retried once without it.
+    """
+
+    def __init__(self, client, models=None, context_cache=None, cached_call_sites=("chat",)):
+        self.client = client
+        self.models = dict(models or {})
+        self.context_cache = context_cache
+        self.cached_call_sites = set(cached_call_sites)
+
+    def model_for(self, call_site):
+        return self.models.get(call_site, self.client.model)
+
+    def _prepare(self, api_key, payload, model, call_site):
+        if self.context_cache is None or call_site not in self.cached_call_sites:
+            return payload
+        return self.context_cache.prepare(api_key, payload, model, call_site)
+
+    def _cache_rejected(self, prepared, error, call_site):
+        if "cachedContent" not in prepared or error.status not in (400, 403, 404):
+            return False
+        self.context_cache.invalidate(prepared["cachedContent"])
+        self.client.metrics.inc("gemini_context_cache_total", call_site=call_site, outcome="fallback")
+        return True
+
+    def generate_text(self, api_key, payload, call_site="other"):
+        model = self.model_for(call_site)
+        prepared = self._prepare(api_key, payload, model, call_site)
+        try:
+            return self.client.generate_text(api_key, prepared, model, call_site)
+        except GeminiError as e:
+            if not self._cache_rejected(prepared, e, call_site):
+                raise
+        return self.client.generate_text(api_key, payload, model, call_site)
+
+    def stream_text(self, api_key, payload, call_site="other"):
+        model = self.model_for(call_site)
+        prepared = self._prepare(api_key, payload, model, call_site)
+        started = False
+        try:
+            for chunk in self.client.stream_text(api_key, prepared, model, call_site):
+                started = True
+                yield chunk
+            return
+        except GeminiError as e:
+            if started or not self._cache_rejected(prepared, e, call_site):
+                raise
+        yield from self.client.stream_text(api_key, payload, model, call_site)
+
+    def generate_many(self, api_key, payloads, call_site="other"):
+        if self.context_cache is not None and call_site in self.cached_call_sites:
+            return super().generate_many(api_key, payloads, call_site)
+        return self.client.generate_many(api_key, payloads, self.model_for(call_site), call_site)
+
+
+def _pump(open_stream, out, tag, stop):
+    """Copies a stream into `out` as (tag, chunk) items, ending with _DONE or the error."""
+    try:
+        stream = open_stream()
+        try:
+            for chunk in stream:
+                if stop.is_set():
+                    return
+                out.put((tag, chunk))
+        finally:
+            # Closing the generator also closes the HTTP response of a cancelled stream.
+            stream.close()
+        out.put((tag, _DONE))
+    except GeminiError as e:
+        out.put((tag, e))
+    except Exception as e:
+        # Anything else (e.g. a malformed event) must still reach the reader, or it waits forever.
+        error = GeminiError(f"An error occurred while streaming the response: {e}")
+        error.__cause__ = e
+        out.put((tag, error))
+
+
+def _start_pump(open_stream, out, tag, stop):
+    # Streams can last as long as the model keeps talking, so each gets its own
+    # thread instead of holding a slot of a bounded pool.
+    threading.Thread(target=_pump, args=(open_stream, out, tag, stop), name=f"llm-stream-{tag}", daemon=True).start()
+
+
+class HedgedBackend(LLMBackend):
+    """
+    Sends a backup request when the primary has not answered within the
+    `percentile` of its recent latencies for the call site, and returns
+    whichever answers first. For streams the latency is the time to the first
+    chunk. Only `call_sites` are hedged, and only once `min_samples`
+    latencies have been seen; the delay is clamped to [min_delay, max_delay].
+
+    The backup should use a different model than the primary: identical
+    concurrent requests are coalesced by GeminiClient, so a same-model
+    backup would just wait for the primary.
+    """
+
+    def __init__(self, primary, backup, call_sites=("chat", "planner", "stories"), percentile=95,
+                 window=200, min_samples=20, min_delay=0.5, max_delay=10.0, max_workers=32, metrics=METRICS):
+        self.primary = primary
+        self.backup = backup
+        self.call_sites = set(call_sites)
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.metrics = metrics
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self._batch_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-batch")
+
+    def _record(self, call_site, seconds):
+        with self._lock:
+            self._latencies[call_site].append(seconds)
+
+    def hedge_delay(self, call_site):
+        """Seconds to wait for the primary before hedging, or None to never hedge."""
+        if call_site not in self.call_sites:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies[call_site])
+        if len(samples) < self.min_samples:
+            return None
+        value = samples[min(len(samples) - 1, len(samples) * self.percentile // 100)]
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def _timed_generate(self, api_key, payload, call_site):
+        started = time.monotonic()
+        text = self.primary.generate_text(api_key, payload, call_site)
+        # Recorded even when a backup already won, so slow calls keep counting towards the percentile.
+        self._record(call_site, time.monotonic() - started)
+        return text
+
+    def generate_text(self, api_key, payload, call_site="other"):
+        if call_site not in self.call_sites:
+            return self.primary.generate_text(api_key, payload, call_site)
+        delay = self.hedge_delay(call_site)
+        primary = self._executor.submit(self._timed_generate, api_key, payload, call_site)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        self.metrics.inc("llm_hedges_total", call_site=call_site)
+        backup = self._executor.submit(self.backup.generate_text, api_key, payload, call_site)
+        names = {primary: "primary", backup: "backup"}
+        pending, error = {primary, backup}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    text = future.result()
+                except GeminiError as e:
+                    error = e
+                    continue
+                self.metrics.inc("llm_hedge_wins_total", call_site=call_site, winner=names[future])
+                return text
+        raise error
+
+    def stream_text(self, api_key, payload, call_site="other"):
+        if call_site not in self.call_sites:
+            yield from self.primary.stream_text(api_key, payload, call_site)
+            return
+
+        out = queue.Queue()
+        stops = {"primary": threading.Event()}
+        started = time.monotonic()
+        _start_pump(lambda: self.primary.stream_text(api_key, payload, call_site), out, "primary", stops["primary"])
+        delay = self.hedge_delay(call_site)
+        winner, error, hedged = None, None, False
+        try:
+            while True:
+                try:
+                    tag, item = out.get(timeout=delay if winner is None and not hedged else None)
+                except queue.Empty:
+                    hedged = True
+                    self.metrics.inc("llm_hedges_total", call_site=call_site)
+                    stops["backup"] = threading.Event()
+                    _start_pump(lambda: self.backup.stream_text(api_key, payload, call_site), out, "backup", stops["backup"])
+                    continue
+                if winner is None:
+                    if isinstance(item, GeminiError):
+                        error = item
+                        stops.pop(tag).set()
+                        if not stops:
+                            raise error
+                        continue
+                    winner = tag
+                    if tag == "primary":
+                        self._record(call_site, time.monotonic() - started)
+                    if hedged:
+                        self.metrics.inc("llm_hedge_wins_total", call_site=call_site, winner=tag)
+                    for other, stop in stops.items():
+                        if other != tag:
+                            stop.set()
+                if tag != winner:
+                    continue
+                if item is _DONE:
+                    return
+                if isinstance(item, GeminiError):
+                    raise item
+                yield item
+        finally:
+            for stop in stops.values():
+                stop.set()
+
+
+class LocalFallbackBackend(LLMBackend):
+    """
+    Deterministic offline backend. Serves the last good response seen for the
+    same call site and payload if there is one, otherwise one of the canned
+    `templates[call_site]`, picked by a hash of the payload so the same request
+    always gets the same text. Call sites without templates raise GeminiError.
+    """
+
+    def __init__(self, templates, max_remembered=512):
+        self.templates = {call_site: list(texts) for call_site, texts in templates.items()}
+        self.max_remembered = max_remembered
+        self._remembered = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(call_site, payload):
+        return hashlib.sha256(json.dumps([call_site, payload], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def remember(self, call_site, payload, text):
+        if call_site not in self.templates:
+            return
+        key = self._key(call_site, payload)
+        with self._lock:
+            self._remembered[key] = text
+            self._remembered.move_to_end(key)
+            while len(self._remembered) > self.max_remembered:
+                self._remembered.popitem(last=False)
+
+    def generate_text(self, api_key, payload, call_site="other"):
+        texts = self.templates.get(call_site)
+        if not texts:
+            raise GeminiError("No offline response is available for this request.")
+        key = self._key(call_site, payload)
+        with self._lock:
+            text = self._remembered.get(key)
+        if text is None:
+            text = texts[int(key[:8], 16) % len(texts)]
+        return FallbackText(text)
+
+
+class FallbackBackend(LLMBackend):
+    """
+    Serves `fallback` responses when `primary` fails (errors, open circuit,
+    rate-limit timeouts) or does not answer within `deadlines[call_site]`
+    seconds (time to the first chunk for streams). Call sites without a
+    deadline wait as long as the primary takes. When the fallback has nothing
+    for the call site, the primary's error is raised as before.
+    """
+
+    def __init__(self, primary, fallback, deadlines=None, max_workers=32, metrics=METRICS):
+        self.primary = primary
+        self.fallback = fallback
+        self.deadlines = dict(deadlines or {})
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-fallback")
+        self._batch_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-batch")
+
+    @staticmethod
+    def _reason(error):
+        return "circuit_open" if isinstance(error, CircuitOpenError) else "error"
+
+    def _fallback_text(self, api_key, payload, call_site, reason, error):
+        try:
+            text = self.fallback.generate_text(api_key, payload, call_site)
+        except GeminiError:
+            raise error
+        self.metrics.inc("llm_fallback_total", call_site=call_site, reason=reason)
+        return text
+
+    def _remember(self, call_site, payload, text):
+        remember = getattr(self.fallback, "remember", None)
+        if remember is not None:
+            remember(call_site, payload, text)
+
+    def generate_text(self, api_key, payload, call_site="other"):
+        deadline = self.deadlines.get(call_site)
+        try:
+            if deadline is None:
+                text = self.primary.generate_text(api_key, payload, call_site)
+            else:
+                future = self._executor.submit(self.primary.generate_text, api_key, payload, call_site)
+                try:
+                    text = future.result(timeout=deadline)
+                except FutureTimeoutError:
+                    # A call still queued behind a busy pool is dropped rather than sent
+                    # upstream late; one already running still refreshes the remembered
+                    # response for next time.
+                    if not future.cancel():
+                        future.add_done_callback(
+                            lambda f: f.exception() is None and self._remember(call_site, payload, f.result())
+                        )
+                    return self._fallback_text(
+                        api_key, payload, call_site, "timeout",
+                        GeminiError("The Gemini API took too long to respond. Please try again."),
+                    )
+        except GeminiError as e:
+            return self._fallback_text(api_key, payload, call_site, self._reason(e), e)
+        self._remember(call_site, payload, text)
+        return text
+
+    def stream_text(self, api_key, payload, call_site="other"):
+        deadline = self.deadlines.get(call_site)
+        out, stop = queue.Queue(), threading.Event()
+        _start_pump(lambda: self.primary.stream_text(api_key, payload, call_site), out, "primary", stop)
+        chunks = []
+        try:
+            while True:
+                try:
+                    _, item = out.get(timeout=deadline if not chunks else None)
+                except queue.Empty:
+                    stop.set()
+                    yield self._fallback_text(
+                        api_key, payload, call_site, "timeout",
+                        GeminiError("The Gemini API took too long to respond. Please try again."),
+                    )
+                    return
+                if item is _DONE:
+                    self._remember(call_site, payload, "".join(chunks))
+                    return
+                if isinstance(item, GeminiError):
+                    if chunks:
+                        # Part of the answer is already on screen; do not splice in a canned one.
+                        raise item
+                    yield self._fallback_text(api_key, payload, call_site, self._reason(item), item)
+                    return
+                chunks.append(item)
+                yield item
+        finally:
+            stop.set()
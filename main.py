@@ -1,81 +1,478 @@
 import streamlit as st
+import pandas as pd
 import os
-import requests
-import json
 import time
 from datetime import date, timedelta
 import calendar
+import hashlib
+import io
+import uuid
+from collections import deque
+
+from chat_context import ChatContextManager, summary_prompt
+from context_cache import ContextCache
+from data_transfer import (
+    MIME_TYPES, ImportAborted, collect, export_journal, export_messages, import_journal, import_messages,
+)
+from crisis_scanner import CrisisScanner
+from gemini_client import GeminiClient, GeminiError
+from journal_index import JournalIndex
+from llm_backend import FallbackBackend, FallbackText, GeminiBackend, HedgedBackend, LocalFallbackBackend
+from jobs import JobQueue, PermanentJobError, QueueFullError
+from metrics import METRICS, SlowRerunProfiler, start_exporter
+from mood_analytics import MOODS, MoodAnalytics, mood_code
+from rate_limit import RateLimiter
+from response_cache import ResponseCache
+from storage import SQLiteStorage
+from story_pool import StoryPool, story_hash
+from structured_output import JOURNAL_ANALYSIS_SCHEMA, STORY_SCHEMA, parse_journal_analysis, parse_story
+
+LOW_MOODS = {"sad", "stressed", "anxious"}
+# Shows operator diagnostics (cache and pool counters, rerun timings) in the app; they always go to the metrics.
+DEBUG_UI = os.environ.get("MANNMITRA_DEBUG_UI", "") not in ("", "0")
+DB_PATH = os.environ.get("MANNMITRA_DB_PATH", "mannmitra.db")
+GEMINI_API_BASE = os.environ.get("MANNMITRA_GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = "gemini-2.5-flash-preview-05-20"
+GEMINI_LIGHT_MODEL = "gemini-2.0-flash-lite"
+# Model per call site; MANNMITRA_GEMINI_MODELS="planner=...,chat=..." overrides entries.
+GEMINI_MODELS = {
+    "chat": GEMINI_MODEL,
+    "journal_analysis": GEMINI_MODEL,
+    "chat_summary": GEMINI_LIGHT_MODEL,
+    "planner": GEMINI_LIGHT_MODEL,
+    "stories": GEMINI_LIGHT_MODEL,
+    "story_pool": GEMINI_LIGHT_MODEL,
+}
+# Hedged requests go to a different model so they are not coalesced with the slow call.
+GEMINI_HEDGE_MODELS = {"chat": GEMINI_LIGHT_MODEL, "planner": GEMINI_MODEL, "stories": GEMINI_MODEL}
+HEDGE_PERCENTILE = 95
+# Server-side caching of chat prefixes (persona and earlier turns) once they reach the API's minimum size.
+CONTEXT_CACHE_TTL_SECONDS = 60 * 60
+CONTEXT_CACHE_MIN_TOKENS = 1024
+# Seconds to wait for an answer (the first chunk, for chat) before serving an offline response.
+FALLBACK_DEADLINES = {"chat": 15, "planner": 20, "stories": 30}
+FALLBACK_RESPONSES = {
+    "chat": [
+        "I'm having trouble connecting right now, but I'm still here with you. "
+        "Take a slow breath in for four counts and out for six. "
+        "If you'd like, tell me a little more and try sending it again in a moment.",
+        "My connection is a bit slow at the moment, sorry about that. "
+        "Whatever you're feeling is valid. While I reconnect, it might help to "
+        "write down the one thing weighing on you most, and we can look at it together.",
+    ],
+    "planner": [
+        "- Drink a glass of water\n- Stretch for five minutes\n- Spend 25 minutes on one small task\n"
+        "- Take a short walk outside\n- Write down one thing you did well today",
+    ],
+    "stories": [
+        '{"title": "One Page at a Time", "content": "Exams were two weeks away and every chapter felt like a wall. '
+        'I stopped trying to finish everything and promised myself one page, then a break. By the end of the week '
+        'the wall had turned into steps.", "coping_action": "Pick the smallest next step and set a 15-minute timer."}',
+        '{"title": "The Message I Almost Did Not Send", "content": "I felt left out when my friends made plans '
+        'without me. Instead of stewing, I messaged one of them. They had assumed I was busy, and we met the next day.", '
+        '"coping_action": "Reach out to one person you trust today."}',
+        '{"title": "Talking at the Dinner Table", "content": "My parents kept comparing my marks to my cousin\'s. '
+        'One evening I calmly told them how much pressure I felt. They did not change overnight, but they listened.", '
+        '"coping_action": "Write down what you want to say before a difficult conversation."}',
+    ],
+}
+STORY_THEMES = ["exams", "family pressure", "friendships"]
+JOURNAL_PAGE_SIZES = [10, 20, 50]
+CHAT_HISTORY_LIMIT = 50
+CHAT_CONTEXT_TOKEN_BUDGET = 4000
+JOURNAL_CONTEXT_ENTRIES = 3
+JOURNAL_CONTEXT_CHARS = 300
+# Memory budgets for the process-wide per-user caches; least recently used users are rebuilt from storage.
+JOURNAL_INDEX_MAX_BYTES = 256 * 1024 * 1024
+MOOD_ANALYTICS_MAX_BYTES = 32 * 1024 * 1024
+SEEN_STORIES_LIMIT = 200
+# Streamlit's download and upload widgets hold the whole file in memory; larger histories go through data_transfer.py.
+TRANSFER_MAX_MB = 50
+MOOD_TREND_DAYS = 30
+CRISIS_BANNER_SECONDS = 60 * 60
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+PERSONAS = {
+    "Supportive Friend": "You are a warm, empathetic friend who listens without judgment and offers encouragement.",
+    "Motivational Mentor": "You are a direct and positive mentor who provides structured advice, helps set goals, and pushes for action.",
+    "Peer Companion": "You are a peer who shares relatable experiences and understands struggles from a similar point of view.",
+    "Calm Counselor": "You are a calm and soothing counselor who helps users navigate their feelings with patience and understanding.",
+    "Cheerful Coach": "You are an upbeat and energetic coach who motivates users with positivity and practical tips.",
+    "Reflective Guide": "You are a thoughtful guide who encourages self-reflection and personal growth through insightful questions and observations.",
+}
+
+APP_CSS = """
+<style>
+.stApp {
+    background-color: #121212;
+    color: #ffffff;
+    font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
+}
+h1, h2, h3, h4, h5, h6 {
+    color: #bb86fc; /* A bright purple for headings */
+}
+.stTextInput label, .stTextArea label, .stSelectbox label {
+    color: #ffffff;
+}
+.stTextInput > div > div > input, .stTextArea > textarea {
+    background-color: #2c2c2c;
+    color: #ffffff;
+    border-radius: 5px;
+    border: 1px solid #555;
+}
+.stButton > button {
+    background-color: #03dac6; /* A teal color for buttons */
+    color: #000000;
+    font-weight: bold;
+    border-radius: 5px;
+    border: none;
+}
+.stMarkdown p {
+    color: #e0e0e0;
+}
+.stTabs [data-baseweb="tab-list"] button [data-testid="stMarkdownContainer"] p {
+    color: #fff;
+}
+.day-cell {
+    width: 40px;
+    height: 40px;
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    border-radius: 5px;
+    font-weight: bold;
+    margin: 2px;
+}
+.day-cell.today {
+    background-color: #03dac6;
+    color: #121212;
+    border-radius: 50%;
+}
+</style>
+"""
+
+STORY_CSS = """
+<style>
+.scrollable-container {
+    max-height: 600px;
+    overflow-y: auto;
+    border: 1px solid #444;
+    border-radius: 10px;
+    padding: 15px;
+}
+.story-card {
+    background-color: #2c2c2c;
+    border-left: 5px solid #6c757d;
+    padding: 15px;
+    border-radius: 5px;
+    margin-bottom: 15px;
+}
+</style>
+"""
 
 def get_gemini_api_key():
     return st.secrets["GEMINI_API_KEY"]
 
-def get_gemini_response(prompt, persona_system_instruction=""):
-    """
-    Sends a prompt to the Gemini API and returns the response.
-    Includes a retry mechanism for transient errors.
-    """
-    if "gemini_api_key" not in st.session_state:
-        st.error("API key not found in session state. Please log in again.")
-        return "An error occurred. Please log in again."
-    
-    api_key = st.session_state.gemini_api_key
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={api_key}"
+@st.cache_resource
+def get_storage():
+    """Process-wide SQLite storage backend."""
+    return SQLiteStorage(DB_PATH)
+
+@st.cache_resource
+def get_mood_analytics():
+    """Process-wide mood aggregates, kept up to date on every journal save and delete."""
+    return MoodAnalytics(lambda user_id: get_storage().iter_journal_moods(user_id), max_bytes=MOOD_ANALYTICS_MAX_BYTES)
+
+@st.cache_resource
+def get_journal_index():
+    """Process-wide retrieval index over journal entries, kept up to date on every save, analysis and delete."""
+    return JournalIndex(lambda user_id: get_storage().iter_journal_texts(user_id), max_bytes=JOURNAL_INDEX_MAX_BYTES)
+
+def journal_context(user_id, prompt):
+    """Returns the user's most relevant past journal entries for a chat prompt, formatted for the model."""
+    hits = get_journal_index().search(user_id, prompt, k=JOURNAL_CONTEXT_ENTRIES)
+    entries = get_storage().get_journal_entries(user_id, [entry_id for entry_id, _ in hits])
+    lines = []
+    for entry in entries:
+        text = " ".join(entry["text"].split())
+        if len(text) > JOURNAL_CONTEXT_CHARS:
+            text = text[:JOURNAL_CONTEXT_CHARS].rsplit(" ", 1)[0] + "..."
+        lines.append(f"- {entry['date']}" + (f" (mood: {entry['mood']})" if entry["mood"] else "") + f": {text}")
+    return "\n".join(lines)
 
+def get_user_id():
+    """Identifies the logged-in user by a hash of their API key, so the key itself is never stored."""
+    if "user_id" not in st.session_state:
+        st.session_state.user_id = hashlib.sha256(st.session_state.gemini_api_key.encode("utf-8")).hexdigest()[:32]
+    return st.session_state.user_id
+
+def get_latest_mood():
+    """Returns the mood of the latest analyzed journal entry, or None."""
+    moods = get_storage().recent_moods(get_user_id(), limit=1)
+    return moods[0] if moods else None
+
+def _build_payload(prompt, persona_system_instruction="", history=(), response_schema=None):
     payload = {
-        "contents": [{"parts": [{"text": prompt}]}]
+        "contents": [*history, {"role": "user", "parts": [{"text": prompt}]}]
     }
     
     if persona_system_instruction:
         payload["systemInstruction"] = {"parts": [{"text": persona_system_instruction}]}
+    if response_schema:
+        payload["generationConfig"] = {"responseMimeType": "application/json", "responseSchema": response_schema}
+    return payload
+
+@st.cache_resource
+def get_gemini_client():
+    """
+    Process-wide Gemini client, so every session shares one connection pool,
+    one rate limiter per API key and in-flight request coalescing.
+    """
+    rate_limiter = RateLimiter(
+        requests_per_minute=int(os.environ.get("MANNMITRA_GEMINI_RPM", "10")),
+        tokens_per_minute=int(os.environ.get("MANNMITRA_GEMINI_TPM", "250000")),
+    )
+    return GeminiClient(GEMINI_API_BASE, GEMINI_MODEL, rate_limiter=rate_limiter)
+
+def _model_overrides(models):
+    overrides = dict(
+        item.split("=", 1) for item in os.environ.get("MANNMITRA_GEMINI_MODELS", "").split(",") if "=" in item
+    )
+    return {**models, **{call_site.strip(): model.strip() for call_site, model in overrides.items()}}
+
+@st.cache_resource
+def get_llm_backend():
+    """
+    Process-wide text generation backend: Gemini with a model per call site
+    and cached chat prefixes, hedged when a call is slower than usual, and an
+    offline fallback for chat, planner and stories when Gemini is slow or
+    unavailable.
+    """
+    client = get_gemini_client()
+    context_cache = ContextCache(client, ttl=CONTEXT_CACHE_TTL_SECONDS, min_tokens=CONTEXT_CACHE_MIN_TOKENS)
+    hedged = HedgedBackend(
+        GeminiBackend(client, _model_overrides(GEMINI_MODELS), context_cache),
+        GeminiBackend(client, GEMINI_HEDGE_MODELS, context_cache),
+        percentile=HEDGE_PERCENTILE,
+    )
+    return FallbackBackend(hedged, LocalFallbackBackend(FALLBACK_RESPONSES), deadlines=FALLBACK_DEADLINES)
 
+def _request_gemini(prompt, persona_system_instruction="", response_schema=None, call_site="other"):
+    """
+    Sends a prompt to the Gemini API.
+    Returns a (text, error) pair where exactly one of the two is set.
+    `call_site` labels the call in the metrics.
+    """
+    if "gemini_api_key" not in st.session_state:
+        return None, "API key not found in session state. Please log in again."
+
+    payload = _build_payload(prompt, persona_system_instruction, response_schema=response_schema)
     try:
-        for i in range(3):
-            response = requests.post(api_url, json=payload)
-            if response.status_code == 200:
-                result = response.json()
-                text = result['candidates'][0]['content']['parts'][0]['text']
-                return text
-            elif response.status_code == 429:
-                time.sleep(2 ** i)
-            else:
-                st.error(f"API Error: {response.status_code} - {response.text}")
-                return "An error occurred with the API call."
-    except requests.exceptions.RequestException as e:
-        st.error(f"Request failed: {e}")
-        return "An error occurred with the network request."
-    
-    return "Failed to get a response after multiple retries."
+        return get_llm_backend().generate_text(st.session_state.gemini_api_key, payload, call_site=call_site), None
+    except GeminiError as e:
+        return None, str(e)
 
-def check_crisis():
-    """Checks for a persistent negative mood and displays a crisis alert."""
-    if "journal_entries" not in st.session_state or not st.session_state.journal_entries:
+def stream_gemini_response(prompt, persona_system_instruction="", history=()):
+    """
+    Streams a Gemini response through the streamGenerateContent SSE endpoint,
+    yielding text chunks as soon as the model produces them.
+    `history` holds earlier turns as Gemini `contents` entries.
+    """
+    if "gemini_api_key" not in st.session_state:
+        st.error("API key not found in session state. Please log in again.")
+        yield "An error occurred. Please log in again."
         return
-    
-    negative_moods = {"sad", "stressed", "anxious"}
-    negative_count = 0
-    
-    last_three_days_moods = [entry["mood"].lower() for entry in st.session_state.journal_entries[-3:]]
-    
-    for mood in last_three_days_moods:
-        if mood in negative_moods:
-            negative_count += 1
-            
-    if negative_count >= 3:
-        st.error(
-            f"""
-            <div style="text-align: center; border: 2px solid red; padding: 10px; border-radius: 10px; font-weight: bold;">
-                <h3 style="color: red;">Feeling Overwhelmed?</h3>
-                <p>It seems like you've been going through a tough time recently. Remember that help is always available.</p>
-                <p>📞 Crisis Helpline: 1-800-273-8255</p>
-                <p>💬 Text Helpline: Text "HOME" to 741741</p>
-                <p>A trusted contact can also provide support.</p>
-            </div>
-            """,
-            unsafe_allow_html=True
-        )
-        st.markdown("---")
-        if st.button("Notify Trusted Contact (Simulated)"):
-            st.info("A notification has been sent to your trusted contact.")
+
+    payload = _build_payload(prompt, persona_system_instruction, history)
+    try:
+        yield from get_llm_backend().stream_text(st.session_state.gemini_api_key, payload, call_site="chat")
+    except GeminiError as e:
+        st.error(str(e))
+
+def get_gemini_response(prompt, persona_system_instruction="", response_schema=None, call_site="other"):
+    """
+    Sends a prompt to the Gemini API and returns the response.
+    With a `response_schema` the model is asked for JSON matching that schema.
+    Errors are shown on the page and returned as a short message.
+    """
+    text, error = _request_gemini(prompt, persona_system_instruction, response_schema, call_site)
+    if error is not None:
+        st.error(error)
+        return "An error occurred. Please try again."
+    return text
+
+def get_gemini_responses(prompts, response_schema=None, call_site="other"):
+    """
+    Sends several independent prompts to the Gemini API concurrently.
+    Each item is a prompt or a (prompt, persona_system_instruction) pair;
+    responses are returned in the same order, with None for failed calls
+    (their errors are shown on the page).
+    """
+    if "gemini_api_key" not in st.session_state:
+        st.error("API key not found in session state. Please log in again.")
+        return [None] * len(prompts)
+
+    payloads = [
+        _build_payload(*item, response_schema=response_schema) if isinstance(item, tuple)
+        else _build_payload(item, response_schema=response_schema)
+        for item in prompts
+    ]
+    responses = []
+    for text, error in get_llm_backend().generate_many(st.session_state.gemini_api_key, payloads, call_site=call_site):
+        if error is not None:
+            st.error(error)
+        responses.append(text)
+    return responses
+
+@st.cache_resource
+def get_response_cache():
+    """Process-wide cache of Gemini responses, shared by all sessions."""
+    return ResponseCache(max_entries=256, ttl_seconds=30 * 60)
+
+def get_cached_gemini_response(prompt, persona_system_instruction="", mood_bucket="", call_site="other"):
+    """
+    Returns a cached Gemini response for the prompt, persona and mood bucket,
+    calling the API only on a miss. Failed calls are never cached.
+    """
+    cache = get_response_cache()
+    key = cache.make_key(prompt, persona_system_instruction, mood_bucket)
+    text = cache.get(key)
+    if text is not None:
+        METRICS.inc("response_cache_total", call_site=call_site, outcome="hit")
+        return text
+
+    METRICS.inc("response_cache_total", call_site=call_site, outcome="miss")
+    text, error = _request_gemini(prompt, persona_system_instruction, call_site=call_site)
+    if error is not None:
+        st.error(error)
+        return "An error occurred. Please try again."
+    if not isinstance(text, FallbackText):
+        cache.put(key, text)
+    return text
+
+@st.cache_resource
+def get_summary_queue():
+    """Process-wide worker pool that folds older chat turns into the rolling summary in the background."""
+    backend, manager = get_llm_backend(), ChatContextManager(get_storage(), token_budget=CHAT_CONTEXT_TOKEN_BUDGET)
+
+    def fold(job):
+        request = job.payload
+
+        def summarize(summary, messages):
+            payload = _build_payload(summary_prompt(summary, messages))
+            return backend.generate_text(request["api_key"], payload, call_site="chat_summary")
+
+        return manager.fold(request["user_id"], request["conversation_id"], summarize)
+
+    # One pending fold per conversation, so two folds never race to store a summary.
+    return JobQueue(fold, workers=2, max_depth=200, max_pending_per_user=1)
+
+def schedule_summary(user_id, conversation_id):
+    try:
+        get_summary_queue().submit(f"{user_id}/{conversation_id}", {
+            "api_key": st.session_state.gemini_api_key,
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+        })
+    except QueueFullError:
+        # A fold for this conversation is already pending, or the queue is busy; the next turn asks again.
+        pass
+
+def get_chat_context_manager():
+    return ChatContextManager(get_storage(), token_budget=CHAT_CONTEXT_TOKEN_BUDGET, schedule_fold=schedule_summary)
+
+def record_timing(name, started):
+    """Keeps the last few durations (in seconds) of a full rerun or fragment rerun for this session."""
+    elapsed = time.perf_counter() - started
+    timings = st.session_state.setdefault("rerun_timings", {})
+    timings.setdefault(name, deque(maxlen=50)).append(elapsed)
+    METRICS.observe("rerun_seconds", elapsed, rerun=name)
+
+@st.cache_resource
+def get_metrics_exporter():
+    """Serves process-wide metrics on MANNMITRA_METRICS_PORT, when it is set."""
+    port = os.environ.get("MANNMITRA_METRICS_PORT")
+    if not port:
+        return None
+    return start_exporter(METRICS, os.environ.get("MANNMITRA_METRICS_HOST", "127.0.0.1"), int(port))
+
+@st.cache_resource
+def get_rerun_profiler():
+    """
+    Samples slow reruns into MANNMITRA_PROFILE_DIR, when it is set.
+    MANNMITRA_PROFILE_THRESHOLD_MS, MANNMITRA_PROFILE_SAMPLE_RATE and
+    MANNMITRA_PROFILER (cprofile or pyinstrument) tune it.
+    """
+    output_dir = os.environ.get("MANNMITRA_PROFILE_DIR")
+    if not output_dir:
+        return None
+    return SlowRerunProfiler(
+        output_dir,
+        threshold=float(os.environ.get("MANNMITRA_PROFILE_THRESHOLD_MS", "500")) / 1000,
+        sample_rate=float(os.environ.get("MANNMITRA_PROFILE_SAMPLE_RATE", "0.1")),
+        backend=os.environ.get("MANNMITRA_PROFILER", "cprofile"),
+    )
+
+def render_timings():
+    """Shows this session's recent server-side rerun durations in the sidebar, with MANNMITRA_DEBUG_UI set."""
+    timings = st.session_state.get("rerun_timings")
+    if not DEBUG_UI or not timings:
+        return
+    with st.sidebar.expander("Performance"):
+        for name, samples in sorted(timings.items()):
+            st.caption(f"{name}: last {samples[-1] * 1000:.1f} ms, avg {sum(samples) / len(samples) * 1000:.1f} ms")
+
+def get_mood_bucket(mood):
+    """Groups a free-form mood label into the bucket the planner adapts to."""
+    return "low" if mood.strip().lower() in LOW_MOODS else "steady"
+
+@st.cache_resource
+def get_crisis_scanner():
+    """Process-wide crisis phrase scanner built from the configured lexicon."""
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crisis_lexicon.json")
+    return CrisisScanner.from_file(os.environ.get("MANNMITRA_CRISIS_LEXICON", default_path))
+
+def scan_for_crisis(text, banner_key):
+    """
+    Scans user text locally before any network call and shows the helpline
+    banner right away on a crisis verdict.
+    """
+    scanner = get_crisis_scanner()
+    if "crisis_signals" not in st.session_state:
+        st.session_state.crisis_signals = scanner.new_window()
+    verdict = scanner.scan(text, st.session_state.crisis_signals)
+    if verdict.is_crisis:
+        already_shown = crisis_flagged()
+        st.session_state.crisis_flagged_at = time.time()
+        if not already_shown:
+            render_crisis_banner(banner_key)
+    return verdict
+
+def crisis_flagged():
+    flagged_at = st.session_state.get("crisis_flagged_at")
+    return flagged_at is not None and time.time() - flagged_at < CRISIS_BANNER_SECONDS
+
+def render_crisis_banner(key="crisis"):
+    st.markdown(
+        f"""
+        <div style="text-align: center; border: 2px solid red; padding: 10px; border-radius: 10px; font-weight: bold;">
+            <h3 style="color: red;">Feeling Overwhelmed?</h3>
+            <p>It seems like you've been going through a tough time recently. Remember that help is always available.</p>
+            <p>📞 Crisis Helpline: 1-800-273-8255</p>
+            <p>💬 Text Helpline: Text "HOME" to 741741</p>
+            <p>A trusted contact can also provide support.</p>
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+    st.markdown("---")
+    if st.button("Notify Trusted Contact (Simulated)", key=f"notify_contact_{key}"):
+        st.info("A notification has been sent to your trusted contact.")
+
+def check_crisis():
+    """Checks for a persistent negative mood or a recent crisis signal and displays a crisis alert."""
+    negative_count = get_mood_analytics().recent_negative_count(get_user_id(), last=3)
+    if negative_count >= 3 or crisis_flagged():
+        render_crisis_banner()
 
 def login_page():
     """Renders the login page for API key input."""
@@ -88,6 +485,11 @@ def login_page():
         if api_key:
             st.session_state.logged_in = True
             st.session_state.gemini_api_key = api_key
+            quiz_result = get_storage().load_quiz_result(get_user_id())
+            if quiz_result is not None:
+                st.session_state.quiz_answers = quiz_result["answers"]
+                st.session_state.selected_persona = quiz_result["persona"]
+                st.session_state.quiz_complete = True
             st.rerun()
         else:
             st.warning("Please enter your API key to proceed.")
@@ -160,6 +562,7 @@ def personality_quiz_page():
             
             st.session_state.selected_persona = most_frequent_persona
             st.session_state.quiz_complete = True
+            get_storage().save_quiz_result(get_user_id(), st.session_state.quiz_answers, most_frequent_persona)
             st.success(f"Quiz complete! Your primary persona is: **{most_frequent_persona}**")
             st.rerun()
 
@@ -181,7 +584,7 @@ def home_page():
             <li>Stories: Read uplifting, relatable stories.</li>
         </ul>
         <p style="font-size: 1.1em; line-height: 1.6;">
-            Your data is stored securely in your browser's session and is not shared with anyone.
+            Your data is stored securely on this MannMitra server and is not shared with anyone.
         </p>
         """,
         unsafe_allow_html=True
@@ -191,172 +594,353 @@ def chat_page():
     """Renders the Chat page."""
     st.header("Chat")
     
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    if "conversation_id" not in st.session_state:
+        st.session_state.conversation_id = get_storage().latest_conversation_id(get_user_id()) or uuid.uuid4().hex
     
-    if "personas" not in st.session_state:
-        st.session_state.personas = {
-            "Supportive Friend": "You are a warm, empathetic friend who listens without judgment and offers encouragement.",
-            "Motivational Mentor": "You are a direct and positive mentor who provides structured advice, helps set goals, and pushes for action.",
-            "Peer Companion": "You are a peer who shares relatable experiences and understands struggles from a similar point of view.",
-            "Calm Counselor": "You are a calm and soothing counselor who helps users navigate their feelings with patience and understanding.",
-            "Cheerful Coach": "You are an upbeat and energetic coach who motivates users with positivity and practical tips.",
-            "Reflective Guide": "You are a thoughtful guide who encourages self-reflection and personal growth through insightful questions and observations.",
-        }
-
     # Persona selection
     st.subheader("Choose your AI Companion")
     selected_persona = st.selectbox(
         "Select a persona:",
-        list(st.session_state.personas.keys()),
-        index=list(st.session_state.personas.keys()).index(st.session_state.selected_persona) if "selected_persona" in st.session_state else 0,
+        list(PERSONAS),
+        index=list(PERSONAS).index(st.session_state.selected_persona) if "selected_persona" in st.session_state else 0,
         help="The AI's response style will change based on your selection."
     )
 
-    for message in st.session_state.messages:
+    chat_fragment(selected_persona)
+
+    if st.button("Start New Chat"):
+        st.session_state.conversation_id = uuid.uuid4().hex
+        st.rerun()
+    
+def load_older_messages(user_id, conversation_id, before_seq):
+    """Button callback: extends the rendered chat history by one page of older messages."""
+    older = get_storage().list_messages(user_id, conversation_id, limit=CHAT_HISTORY_LIMIT, before_seq=before_seq)
+    if older:
+        st.session_state.chat_history_start = (conversation_id, older[0]["seq"])
+
+@st.fragment
+def chat_fragment(selected_persona):
+    """Chat history and input; sending a message reruns only this fragment."""
+    started = time.perf_counter()
+    storage = get_storage()
+    user_id = get_user_id()
+    conversation_id = st.session_state.conversation_id
+
+    start = st.session_state.get("chat_history_start")
+    if start is not None and start[0] == conversation_id:
+        messages = storage.list_messages_after(user_id, conversation_id, after_seq=start[1] - 1, limit=2 ** 31)
+    else:
+        messages = storage.list_messages(user_id, conversation_id, limit=CHAT_HISTORY_LIMIT)
+    # Sequence numbers start at 1, so anything above that has older messages before it.
+    if messages and messages[0]["seq"] > 1:
+        st.button(
+            "Load older messages", key="load_older_messages",
+            on_click=load_older_messages, args=(user_id, conversation_id, messages[0]["seq"]),
+        )
+    for message in messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
     if prompt := st.chat_input("What is on your mind?"):
         st.chat_message("user").markdown(prompt)
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        already_flagged = crisis_flagged()
+        scan_for_crisis(prompt, banner_key="chat")
+        history, summary = get_chat_context_manager().build(user_id, conversation_id)
+        storage.add_message(user_id, conversation_id, "user", prompt)
         
         with st.chat_message("assistant"):
-            with st.spinner("MannMitra is thinking..."):
-                persona_instruction = st.session_state.personas[selected_persona]
-                ai_response = get_gemini_response(f"Persona: {selected_persona}. User message: {prompt}", persona_instruction)
-            
-            message_placeholder = st.empty()
-            full_response = ""
-            for chunk in ai_response.split():
-                full_response += chunk + " "
-                time.sleep(0.05)
-                message_placeholder.markdown(full_response + "▌")
-            message_placeholder.markdown(full_response)
+            # The system instruction and history stay the same from turn to turn so they
+            # can be served from a context cache; per-message context goes in the new turn.
+            persona_instruction = PERSONAS[selected_persona]
+            if summary:
+                persona_instruction += f"\n\nSummary of the earlier conversation:\n{summary}"
+            message = f"Persona: {selected_persona}. User message: {prompt}"
+            related = journal_context(user_id, prompt)
+            if related:
+                message = (
+                    f"Past journal entries of the user that may be relevant (refer to them only if they help):\n"
+                    f"{related}\n\n{message}"
+                )
+            ai_response = st.write_stream(stream_gemini_response(message, persona_instruction, history))
         
-        st.session_state.messages.append({"role": "assistant", "content": ai_response})
+        if ai_response:
+            storage.add_message(user_id, conversation_id, "assistant", ai_response)
+        if crisis_flagged() and not already_flagged:
+            # The banner drawn above lives only in this fragment run, so clicking its
+            # button would rerun the fragment without it; redraw it from check_crisis.
+            st.rerun(scope="app")
+    record_timing("chat fragment", started)
 
-    if st.button("Start New Chat"):
-        st.session_state.messages = []
-        st.rerun()
-    
 def journal_page():
     """Renders the Journal page."""
     st.header("Journal")
     st.write("Write about your day and get instant insights.")
     
-    if "journal_entries" not in st.session_state:
-        st.session_state.journal_entries = []
+    journal_entry_fragment()
+
+    if st.session_state.pop("journal_saved", False):
+        st.info("Journal entry saved!")
+    if st.session_state.get("analysis_jobs"):
+        render_pending_analyses()
 
+    error = st.session_state.pop("analysis_error", None)
+    if error is not None:
+        st.error(f"Could not analyze your entry: {error} You can retry it from Past Journal Entries.")
+    analysis = st.session_state.pop("latest_analysis", None)
+    if analysis is not None:
+        st.success("Analysis complete!")
+        st.subheader("Your Insights")
+        st.markdown(f"Mood: {analysis['mood']}")
+        st.markdown(f"Summary: {analysis['summary']}")
+        st.markdown(f"Coping Tip: {analysis['coping_tip']}")
+
+    journal_history_fragment()
+    data_transfer_fragment()
+
+@st.fragment
+def journal_entry_fragment():
+    """The journal text area and Analyze button; editing the text reruns only this fragment."""
     journal_text = st.text_area("How are you feeling today?", height=200)
 
     if st.button("Analyze Journal Entry"):
         if journal_text:
-            with st.spinner("Analyzing your entry..."):
-                analysis_prompt = (
-                    f"Analyze the following journal entry for mood, summarize it, and suggest a coping tip:\n\n"
-                    f"Journal Entry:\n{journal_text}\n\n"
-                    f"Please provide the output in the following format:\n"
-                    f"Mood: [mood (e.g., happy, sad, stressed, anxious, calm)]\n"
-                    f"Summary: [2-3 sentence summary]\n"
-                    f"Coping Tip: [One specific, actionable coping tip or micro-intervention]"
-                )
-                analysis_result = get_gemini_response(analysis_prompt)
-                
-                try:
-                    lines = analysis_result.split('\n')
-                    mood = lines[0].replace("Mood:", "").strip()
-                    summary = lines[1].replace("Summary:", "").strip()
-                    tip = lines[2].replace("Coping Tip:", "").strip()
-                    
-                    st.success("Analysis complete!")
-                    st.subheader("Your Insights")
-                    st.markdown(f"Mood: {mood}")
-                    st.markdown(f"Summary: {summary}")
-                    st.markdown(f"Coping Tip: {tip}")
-
-                    entry = {
-                        "date": time.strftime("%Y-%m-%d"),
-                        "text": journal_text,
-                        "mood": mood,
-                        "summary": summary,
-                        "tip": tip
-                    }
-                    st.session_state.journal_entries.append(entry)
-                    st.info("Journal entry saved!")
-                    
-                except (IndexError, AttributeError):
-                    st.error("Could not parse the API response. Please try again.")
+            scan_for_crisis(journal_text, banner_key="journal")
+            entry = {"date": time.strftime("%Y-%m-%d"), "text": journal_text}
+            entry["id"] = get_storage().add_journal_entry(get_user_id(), entry)
+            get_journal_index().add_entry(get_user_id(), entry["id"], entry["text"])
+            st.session_state.journal_saved = True
+            submit_journal_analysis(entry["id"], entry)
+            st.rerun()
         else:
             st.warning("Please write something in your journal before analyzing.")
 
+@st.fragment
+def journal_history_fragment():
+    """Mood trends and past entries; paging and deleting rerun only this fragment."""
+    started = time.perf_counter()
+    user_id = get_user_id()
+    st.markdown("---")
+    st.subheader("Mood Trends")
+    render_mood_trends(user_id)
+
     st.markdown("---")
     st.subheader("Past Journal Entries")
-    if not st.session_state.journal_entries:
-        st.info("You don't have any saved journal entries yet.")
-    else:
-        for i, entry in enumerate(reversed(st.session_state.journal_entries)):
-            col1, col2 = st.columns([0.9, 0.1])
-            with col1:
+    render_journal_history(get_storage(), user_id)
+    record_timing("journal history fragment", started)
+
+
+@st.cache_resource
+def get_analysis_queue():
+    """Process-wide worker pool that analyzes journal entries in the background."""
+    backend, storage, analytics, index = get_llm_backend(), get_storage(), get_mood_analytics(), get_journal_index()
+
+    def analyze(job):
+        request = job.payload
+        text = backend.generate_text(request["api_key"], request["payload"], call_site="journal_analysis")
+        analysis = parse_journal_analysis(text)
+        if analysis is None:
+            raise PermanentJobError("Could not parse the API response.")
+        if storage.update_journal_analysis(
+            job.user_id, request["entry_id"], analysis["mood"], analysis["summary"], analysis["coping_tip"]
+        ):
+            analytics.add_entry(job.user_id, request["entry_id"], request["date"], analysis["mood"])
+            index.add_entry(job.user_id, request["entry_id"], request["text"], analysis["summary"])
+        return analysis
+
+    return JobQueue(analyze, workers=4, max_depth=200, max_pending_per_user=3)
+
+@st.fragment
+def data_transfer_fragment():
+    """Export and import of journals and chat history up to TRANSFER_MAX_MB; downloads are generated only when clicked."""
+    storage, user_id = get_storage(), get_user_id()
+    max_bytes = TRANSFER_MAX_MB * 1024 * 1024
+    st.markdown("---")
+    with st.expander("Export or import your data"):
+        fmt = st.radio("Export format", ["jsonl", "csv"], horizontal=True, key="export_format")
+        journal_col, chat_col = st.columns(2)
+        journal_col.download_button(
+            "Download journal", data=lambda: collect(export_journal(storage, user_id, fmt), max_bytes),
+            file_name=f"mannmitra-journal.{fmt}", mime=MIME_TYPES[fmt], key="export_journal",
+        )
+        chat_col.download_button(
+            "Download chat history", data=lambda: collect(export_messages(storage, user_id, fmt), max_bytes),
+            file_name=f"mannmitra-chats.{fmt}", mime=MIME_TYPES[fmt], key="export_chats",
+        )
+
+        kind = st.selectbox("Import into", ["Journal", "Chat history"], key="import_kind")
+        uploaded = st.file_uploader(
+            "Upload a JSONL or CSV export", type=["jsonl", "csv"], key="import_file", max_upload_size=TRANSFER_MAX_MB,
+        )
+        if uploaded is not None and st.button("Import", key="import_data"):
+            import_fmt = "csv" if uploaded.name.lower().endswith(".csv") else "jsonl"
+            lines = io.TextIOWrapper(uploaded, encoding="utf-8", newline="")
+            try:
+                if kind == "Journal":
+                    imported, errors = import_journal(storage, user_id, lines, import_fmt)
+                else:
+                    imported, errors = import_messages(storage, user_id, lines, import_fmt)
+            except ImportAborted as e:
+                imported, errors = e.imported, e.errors
+                st.error(f"{e} The import stopped there; {imported} rows before it were imported.")
+            else:
+                st.success(f"Imported {imported} rows.")
+            finally:
+                if kind == "Journal":
+                    # Earlier batches may be stored even if the import failed; rebuilt lazily from storage.
+                    get_mood_analytics().forget(user_id)
+                    get_journal_index().forget(user_id)
+            if errors.count:
+                st.warning(f"Skipped {errors.count} invalid rows:\n\n" + "\n\n".join(errors.messages))
+
+def submit_journal_analysis(entry_id, entry):
+    """Queues a saved entry for analysis; the page polls for the result."""
+    analysis_prompt = (
+        f"Analyze the following journal entry for mood, summarize it, and suggest a coping tip:\n\n"
+        f"Journal Entry:\n{entry['text']}\n\n"
+        f"Reply with a JSON object with the fields mood (one of happy, sad, stressed, anxious, calm), "
+        f"summary (a 2-3 sentence summary) and coping_tip (one specific, actionable coping tip or micro-intervention)."
+    )
+    request = {
+        "api_key": st.session_state.gemini_api_key,
+        "payload": _build_payload(analysis_prompt, response_schema=JOURNAL_ANALYSIS_SCHEMA),
+        "entry_id": entry_id,
+        "date": entry["date"],
+        "text": entry["text"],
+    }
+    try:
+        job_id = get_analysis_queue().submit(get_user_id(), request)
+    except QueueFullError:
+        st.session_state.analysis_error = "MannMitra is busy right now."
+        return
+    st.session_state.setdefault("analysis_jobs", {})[entry_id] = job_id
+
+@st.fragment(run_every=2)
+def render_pending_analyses():
+    """Polls the background analyses of this session and refreshes the page when one finishes."""
+    queue = get_analysis_queue()
+    jobs = st.session_state.analysis_jobs
+    finished = False
+    for entry_id, job_id in list(jobs.items()):
+        job = queue.status(job_id)
+        if job is None or job.finished:
+            del jobs[entry_id]
+            finished = True
+            if job is not None and job.state == "done":
+                st.session_state.latest_analysis = job.result
+            elif job is not None:
+                st.session_state.analysis_error = job.error
+        elif job.attempts > 1:
+            st.info(f"Still analyzing your entry (attempt {job.attempts})...")
+        else:
+            st.info("Analyzing your entry...")
+    if finished:
+        st.rerun()
+
+def render_mood_trends(user_id):
+    """Charts daily mood counts over the last few weeks from the running aggregates."""
+    analytics = get_mood_analytics()
+    end = date.today()
+    start = end - timedelta(days=MOOD_TREND_DAYS - 1)
+    counts = analytics.daily_counts(user_id, start, end)
+    if not counts.any():
+        st.info("Your mood trends will appear here once you have analyzed a few entries.")
+        return
+
+    col1, col2 = st.columns(2)
+    col1.metric("Journaling streak", f"{analytics.streak(user_id)} days")
+    col2.metric("Recent negative moods", f"{analytics.negative_ratio(user_id):.0%}")
+    chart = pd.DataFrame(counts, columns=MOODS, index=pd.date_range(start, end))
+    st.bar_chart(chart.loc[:, chart.any()])
+
+def delete_journal_entry(user_id, entry):
+    """Button callback, so the fragment rerun that follows already renders without the entry."""
+    if get_storage().delete_journal_entry(user_id, entry["id"]):
+        get_mood_analytics().remove_entry(user_id, entry["id"], entry["date"], entry["mood"])
+        get_journal_index().remove_entry(user_id, entry["id"])
+
+def render_journal_history(storage, user_id):
+    """Renders one page of past journal entries; cost depends on the page size, not the history size."""
+    filter_col, size_col = st.columns([0.7, 0.3])
+    with filter_col:
+        date_range = st.date_input("Filter by date", value=(), key="journal_date_range")
+    with size_col:
+        page_size = st.selectbox("Entries per page", JOURNAL_PAGE_SIZES, index=1, key="journal_page_size")
+
+    start_date = end_date = None
+    if len(date_range) == 2:
+        start_date, end_date = (d.isoformat() for d in date_range)
+    elif len(date_range) == 1:
+        start_date = end_date = date_range[0].isoformat()
+
+    total = storage.count_journal_entries(user_id, start_date, end_date)
+    if not total:
+        if start_date is not None:
+            st.info("You don't have any journal entries in this date range.")
+        else:
+            st.info("You don't have any saved journal entries yet.")
+        return
+
+    page_count = (total + page_size - 1) // page_size
+    page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, key="journal_page")
+    entries = storage.list_journal_entries(
+        user_id, limit=page_size, offset=(page - 1) * page_size, start_date=start_date, end_date=end_date
+    )
+    for entry in entries:
+        col1, col2 = st.columns([0.9, 0.1])
+        pending = entry["id"] in st.session_state.get("analysis_jobs", {})
+        with col1:
+            if entry["mood"]:
                 st.markdown(f"{entry['date']} - Mood: {entry['mood']}")
                 st.write(f"Summary: {entry['summary']}")
-            with col2:
-                if st.button("Delete", key=f"delete_journal_{i}"):
-                    original_index = len(st.session_state.journal_entries) - 1 - i
-                    del st.session_state.journal_entries[original_index]
-                    st.rerun()
-            st.markdown("---")
+            else:
+                st.markdown(f"{entry['date']} - Mood: {'analyzing...' if pending else 'not analyzed yet'}")
+                st.write(entry["text"][:200])
+        with col2:
+            if not entry["mood"] and not pending and st.button("Analyze", key=f"analyze_journal_{entry['id']}"):
+                submit_journal_analysis(entry["id"], entry)
+                st.rerun()
+            st.button("Delete", key=f"delete_journal_{entry['id']}", on_click=delete_journal_entry, args=(user_id, entry))
+        st.markdown("---")
+    st.caption(f"Showing {len(entries)} of {total} entries")
 
 
+@st.cache_data
+def month_grid_html(year, month, today):
+    """Builds the planner's month grid once per (year, month, today)."""
+    rows = [
+        f"""<div style="display: grid; grid-template-columns: repeat(7, 1fr); text-align: center; font-weight: bold; padding-bottom: 5px;">"""
+        f"""{' '.join(f'<div>{day}</div>' for day in WEEKDAY_NAMES)}</div>"""
+    ]
+    for week in calendar.Calendar().monthdayscalendar(year, month):
+        cells = "".join(
+            '<div class="day-cell"></div>' if day == 0
+            else f'<div class="day-cell {"today" if day == today else ""}">{day}</div>'
+            for day in week
+        )
+        rows.append(f'<div style="display: grid; grid-template-columns: repeat(7, 1fr); text-align: center;">{cells}</div>')
+    return "\n".join(rows)
+
 def planner_page():
     """Renders the Planner page with tasks based on mood history."""
     st.header("Planner")
     st.write("Plan your day with tasks tailored to your emotional state.")
 
-    st.subheader(f"{date.today().strftime('%B %Y')}")
-    
-    cal = calendar.Calendar()
-    month_days = cal.monthdayscalendar(date.today().year, date.today().month)
     today = date.today()
-
-    st.markdown(
-        f"""
-        <div style="display: grid; grid-template-columns: repeat(7, 1fr); text-align: center; font-weight: bold; padding-bottom: 5px;">
-            {' '.join([f'<div>{day}</div>' for day in ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']])}
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
-
-    for week in month_days:
-        week_html = ""
-        for day in week:
-            if day == 0:
-                week_html += f'<div class="day-cell"></div>'
-            else:
-                is_today = today.day == day
-                day_class = "today" if is_today else ""
-                week_html += f'<div class="day-cell {day_class}">{day}</div>'
-        st.markdown(
-            f"""
-            <div style="display: grid; grid-template-columns: repeat(7, 1fr); text-align: center;">
-                {week_html}
-            </div>
-            """,
-            unsafe_allow_html=True
-        )
+    st.subheader(f"{today.strftime('%B %Y')}")
+    st.markdown(month_grid_html(today.year, today.month, today.day), unsafe_allow_html=True)
 
     st.markdown("---")
-    if "journal_entries" not in st.session_state or not st.session_state.journal_entries:
+    latest_mood = get_latest_mood()
+    if latest_mood is None:
         st.info("Write a few journal entries to get personalized task suggestions.")
         return
 
-    last_mood = st.session_state.journal_entries[-1]["mood"].lower()
-    low_moods = {"sad", "stressed", "anxious"}
+    # The bucket is part of the cache key, so a change of mood moves to other entries.
+    mood_bucket = get_mood_bucket(latest_mood)
 
     st.subheader("Today's Suggested Tasks")
     
-    if last_mood in low_moods:
+    if mood_bucket == "low":
         task_type = "self-care and small, achievable tasks (e.g., drink water, stretch, take a short walk)"
     else:
         task_type = "productive and challenging tasks (e.g., study for 30 minutes, organize your desk, work on a project)"
@@ -367,84 +951,120 @@ def planner_page():
     )
     
     with st.spinner("Generating tasks..."):
-        tasks = get_gemini_response(task_prompt)
+        tasks = get_cached_gemini_response(task_prompt, mood_bucket=mood_bucket, call_site="planner")
     
     if tasks:
         st.markdown(tasks)
 
+    if DEBUG_UI:
+        stats = get_response_cache().stats()
+        st.caption(f"Suggestion cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+
+def story_prompt(theme, mood):
+    reader = mood if mood not in ("any", "other") else "a student"
+    return (
+        f"Generate 1 short, peer-simulated story about a student struggling with {theme}. "
+        f"The story should be relatable to someone feeling {reader}. "
+        f"Reply with a JSON object with a title, the story content, and a simple coping_action.\n\n"
+        f"Example:\n"
+        f'{{"title": "The Procrastination Monster", '
+        f'"content": "I had a huge project due but couldn\'t focus. I just kept watching videos and felt more and more stressed.", '
+        f'"coping_action": "Start with a 15-minute timer and just begin."}}'
+    )
+
+@st.cache_resource
+def get_story_pool():
+    """
+    Process-wide pool of pre-generated stories per mood and theme, refilled in
+    the background with MANNMITRA_STORY_POOL_API_KEY, which also pre-fills
+    every bucket at startup. Without that key there are no background refills
+    and the pool only holds stories generated inline for users.
+    """
+    backend = get_llm_backend()
+
+    def generate(api_key, mood, theme):
+        payload = _build_payload(story_prompt(theme, mood), response_schema=STORY_SCHEMA)
+        return parse_story(backend.generate_text(api_key, payload, call_site="story_pool"))
+
+    pool = StoryPool(
+        generate,
+        path=os.environ.get(
+            "MANNMITRA_STORY_POOL_PATH", os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "story_pool.json")
+        ),
+        api_key=os.environ.get("MANNMITRA_STORY_POOL_API_KEY"),
+    )
+    if pool.api_key:
+        for mood in ["any", *MOODS[:-1]]:
+            for theme in STORY_THEMES:
+                pool.schedule(mood, theme)
+    return pool
+
+def get_stories(mood):
+    """
+    Serves one story per theme, from the shared pool where possible; themes
+    the pool cannot serve are generated concurrently and added to the pool.
+    """
+    pool = get_story_pool()
+    # Insertion-ordered, so the oldest hashes can be dropped once the session has seen many stories.
+    seen = st.session_state.setdefault("seen_stories", {})
+    stories = {theme: pool.take(mood, theme, exclude=seen) for theme in STORY_THEMES}
+    missing = [theme for theme, story in stories.items() if story is None]
+    if missing:
+        responses = get_gemini_responses(
+            [story_prompt(theme, mood) for theme in missing], response_schema=STORY_SCHEMA, call_site="stories"
+        )
+        for theme, response in zip(missing, responses):
+            story = parse_story(response) if response is not None else None
+            if story is not None and not isinstance(response, FallbackText):
+                pool.add(mood, theme, story, served=True)
+            stories[theme] = story
+    # Offline fallback stories can repeat across themes, so each is served once.
+    served = list({story_hash(story): story for story in stories.values() if story is not None}.items())
+    seen.update(dict.fromkeys(digest for digest, _ in served))
+    for digest in list(seen)[:max(0, len(seen) - SEEN_STORIES_LIMIT)]:
+        del seen[digest]
+    return [story for _, story in served]
+
 def stories_page():
     """Renders the Stories page with AI-generated content."""
     st.header("Stories")
     st.write("Read inspiring stories from peers who understand.")
 
-    current_mood = "a student"
-    if "journal_entries" in st.session_state and st.session_state.journal_entries:
-        current_mood = st.session_state.journal_entries[-1]["mood"]
-
-    story_prompt = (
-        f"Generate 3 short, peer-simulated stories about student struggles. "
-        f"Each story should be related to a different realistic theme (e.g., exams, family pressure, friendships). "
-        f"The stories should be relatable to someone feeling {current_mood}."
-        f"For each story, provide a title, a short content section, and a simple coping action. "
-        f"Format each story as follows:\n\n"
-        f"Title: [Story Title]\n"
-        f"Content: [Story Content]\n"
-        f"Coping Action: [One Coping Action]\n\n"
-        f"Example:\nTitle: The Procrastination Monster\nContent: I had a huge project due but couldn't focus. I just kept watching videos and felt more and more stressed.\nCoping Action: Start with a 15-minute timer and just begin."
-    )
-    
+    latest_mood = get_latest_mood()
+    mood = MOODS[mood_code(latest_mood)] if latest_mood else "any"
+
     if st.button("Generate New Stories"):
         with st.spinner("Generating stories..."):
-            stories_raw = get_gemini_response(story_prompt)
-            if stories_raw:
-                st.session_state["stories"] = stories_raw
+            st.session_state["stories"] = get_stories(mood)
     
     if "stories" in st.session_state:
-        stories = st.session_state["stories"].split("\n\n")
+        stories = st.session_state["stories"]
         st.subheader("Stories for you")
         
         with st.container():
-            st.markdown(
-                """
-                <style>
-                .scrollable-container {
-                    max-height: 600px;
-                    overflow-y: auto;
-                    border: 1px solid #444;
-                    border-radius: 10px;
-                    padding: 15px;
-                }
-                .story-card {
-                    background-color: #2c2c2c;
-                    border-left: 5px solid #6c757d;
-                    padding: 15px;
-                    border-radius: 5px;
-                    margin-bottom: 15px;
-                }
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
+            st.markdown(STORY_CSS, unsafe_allow_html=True)
             
             st.markdown('<div class="scrollable-container">', unsafe_allow_html=True)
-            for story_block in stories:
-                lines = story_block.strip().split("\n")
-                if len(lines) >= 3:
-                    title = lines[0].replace("Title:", "").strip()
-                    content = lines[1].replace("Content:", "").strip()
-                    action = lines[2].replace("Coping Action:", "").strip()
-                    
-                    st.markdown('<div class="story-card">', unsafe_allow_html=True)
-                    st.markdown(f"**{title}**")
-                    st.write(content)
-                    st.write(f"**Coping Action:** *{action}*")
-                    st.markdown("</div>", unsafe_allow_html=True)
+            for story in stories:
+                st.markdown('<div class="story-card">', unsafe_allow_html=True)
+                st.markdown(f"**{story['title']}**")
+                st.write(story["content"])
+                if story["coping_action"]:
+                    st.write(f"**Coping Action:** *{story['coping_action']}*")
+                st.markdown("</div>", unsafe_allow_html=True)
             st.markdown("</div>", unsafe_allow_html=True)
 
+        if DEBUG_UI:
+            pool_stats = get_story_pool().snapshot()
+            st.caption(
+                f"Story pool: {pool_stats['size']} stories, {get_story_pool().ratio():.0%} of stories served from the pool"
+            )
+
 def main():
     """
     Main function to set up the Streamlit app and navigation.
     """
+    started = time.perf_counter()
     st.set_page_config(
         page_title="MannMitra",
         page_icon="🧠",
@@ -452,58 +1072,8 @@ def main():
         initial_sidebar_state="expanded"
     )
 
-    st.markdown(
-        """
-        <style>
-        .stApp {
-            background-color: #121212;
-            color: #ffffff;
-            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
-        }
-        h1, h2, h3, h4, h5, h6 {
-            color: #bb86fc; /* A bright purple for headings */
-        }
-        .stTextInput label, .stTextArea label, .stSelectbox label {
-            color: #ffffff;
-        }
-        .stTextInput > div > div > input, .stTextArea > textarea {
-            background-color: #2c2c2c;
-            color: #ffffff;
-            border-radius: 5px;
-            border: 1px solid #555;
-        }
-        .stButton > button {
-            background-color: #03dac6; /* A teal color for buttons */
-            color: #000000;
-            font-weight: bold;
-            border-radius: 5px;
-            border: none;
-        }
-        .stMarkdown p {
-            color: #e0e0e0;
-        }
-        .stTabs [data-baseweb="tab-list"] button [data-testid="stMarkdownContainer"] p {
-            color: #fff;
-        }
-        .day-cell {
-            width: 40px;
-            height: 40px;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            border-radius: 5px;
-            font-weight: bold;
-            margin: 2px;
-        }
-        .day-cell.today {
-            background-color: #03dac6;
-            color: #121212;
-            border-radius: 50%;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
+    st.markdown(APP_CSS, unsafe_allow_html=True)
+    get_metrics_exporter()
 
     if "logged_in" not in st.session_state:
         st.session_state.logged_in = False
@@ -530,7 +1100,15 @@ def main():
         check_crisis()
 
         page_function = pages[selection]
-        page_function()
+        profiler = get_rerun_profiler()
+        if profiler is None:
+            page_function()
+        else:
+            with profiler.profile(f"{selection} page"):
+                page_function()
+
+        record_timing(f"{selection} page", started)
+        render_timings()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,211 @@
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """
+    In-process counters and latency histograms keyed by name and labels.
+
+    Writes are spread over a fixed number of lock-striped shards, each thread
+    sticking to one, so recording rarely contends; shards are only merged
+    when a snapshot is taken. The shard count does not grow with the number
+    of threads, which Streamlit starts one of per rerun.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, stripes=16):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._stripes = itertools.count()
+        self._shards = [({}, {}, threading.Lock()) for _ in range(stripes)]
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = self._shards[next(self._stripes) % len(self._shards)]
+        return shard
+
+    def inc(self, metric, value=1, **labels):
+        counters, _, lock = self._shard()
+        key = (metric, tuple(sorted(labels.items())))
+        with lock:
+            counters[key] = counters.get(key, 0) + value
+
+    def observe(self, metric, value, **labels):
+        """Records one sample (in seconds for latencies) into a histogram."""
+        _, histograms, lock = self._shard()
+        key = (metric, tuple(sorted(labels.items())))
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        with lock:
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        """Returns ({(name, labels): total}, {(name, labels): (bucket counts, sum)}) merged across threads."""
+        counters, histograms = {}, {}
+        for shard_counters, shard_histograms, lock in self._shards:
+            with lock:
+                shard_counters = dict(shard_counters)
+                shard_histograms = {key: list(histogram) for key, histogram in shard_histograms.items()}
+            for key, value in shard_counters.items():
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in shard_histograms.items():
+                merged = histograms.setdefault(key, [0] * len(histogram[:-1]) + [0.0])
+                for index, value in enumerate(histogram):
+                    merged[index] += value
+        return counters, {key: (value[:-1], value[-1]) for key, value in histograms.items()}
+
+    def to_json(self):
+        counters, histograms = self.snapshot()
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": sum(counts),
+                    "sum": total,
+                    "buckets": dict(zip([*map(str, self.buckets), "+Inf"], counts)),
+                }
+                for (name, labels), (counts, total) in sorted(histograms.items())
+            ],
+        }
+
+    def to_prometheus(self):
+        """Renders the Prometheus text exposition format."""
+        counters, histograms = self.snapshot()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (other, labels), value in sorted(counters.items()):
+                if other == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (other, labels), (counts, total) in sorted(histograms.items()):
+                if other != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+METRICS = Metrics()
+
+
+def start_exporter(metrics=METRICS, host="127.0.0.1", port=9464):
+    """
+    Serves `/metrics` (Prometheus text) and `/metrics.json` from a daemon
+    thread and returns the server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.to_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(metrics.to_json()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
+
+
+class SlowRerunProfiler:
+    """
+    Profiles a random sample of reruns and keeps the profile only when the
+    rerun took longer than `threshold` seconds. Uses pyinstrument when it is
+    installed and requested, cProfile otherwise.
+    """
+
+    def __init__(self, output_dir, threshold=0.5, sample_rate=0.1, backend="cprofile", metrics=METRICS):
+        self.output_dir = output_dir
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.backend = backend
+        self.metrics = metrics
+        # Only one profiler can be active per process at a time.
+        self._busy = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _start(self):
+        if self.backend == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                self.backend = "cprofile"
+            else:
+                profiler = Profiler()
+                profiler.start()
+                return profiler
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _save(self, profiler, name, elapsed):
+        stem = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{name.replace(' ', '_')}-{elapsed * 1000:.0f}ms")
+        if self.backend == "pyinstrument":
+            with open(f"{stem}.html", "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.dump_stats(f"{stem}.prof")
+        self.metrics.inc("slow_rerun_profiles_total", rerun=name)
+
+    @contextmanager
+    def profile(self, name):
+        if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            yield
+            return
+        try:
+            profiler = self._start()
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - started
+                if self.backend == "pyinstrument":
+                    profiler.stop()
+                else:
+                    profiler.disable()
+                if elapsed >= self.threshold:
+                    self._save(profiler, name, elapsed)
+        finally:
+            self._busy.release()
@@ -0,0 +1,221 @@
+import bisect
+import threading
+from collections import OrderedDict, deque
+from datetime import date, timedelta
+
+import numpy as np
+
+MOODS = ["happy", "calm", "sad", "stressed", "anxious", "other"]
+MOOD_CODES = {mood: code for code, mood in enumerate(MOODS)}
+NEGATIVE_MOODS = {"sad", "stressed", "anxious"}
+NEGATIVE_FLAGS = tuple(int(mood in NEGATIVE_MOODS) for mood in MOODS)
+
+
+def mood_code(mood):
+    """Maps a free-form mood label to a small integer code; unknown labels map to "other"."""
+    return MOOD_CODES.get((mood or "").strip().strip(".").lower(), MOOD_CODES["other"])
+
+
+class _UserMoods:
+    """Running aggregates for one user: a day x mood count matrix plus the latest entries."""
+
+    __slots__ = ("origin", "days", "daily", "window_size", "recent", "recent_negative")
+
+    def __init__(self, window):
+        self.origin = None
+        self.days = 0
+        self.daily = np.zeros((64, len(MOODS)), dtype=np.int32)
+        self.window_size = window
+        # (ordinal, entry_id, mood code) of the latest entries, oldest first.
+        self.recent = []
+        self.recent_negative = 0
+
+    def nbytes(self):
+        """Approximate memory held by the aggregates."""
+        return self.daily.nbytes + 100 * len(self.recent) + 500
+
+    def _row(self, ordinal):
+        if self.origin is None:
+            self.origin = ordinal
+        if ordinal < self.origin:
+            shift = self.origin - ordinal
+            self.daily = np.vstack([np.zeros((shift, len(MOODS)), dtype=np.int32), self.daily])
+            self.days += shift
+            self.origin = ordinal
+        row = ordinal - self.origin
+        if row >= len(self.daily):
+            grown = np.zeros((max(row + 1, 2 * len(self.daily)), len(MOODS)), dtype=np.int32)
+            grown[:len(self.daily)] = self.daily
+            self.daily = grown
+        self.days = max(self.days, row + 1)
+        return row
+
+    def add(self, entry_id, ordinal, code):
+        row = self._row(ordinal)
+        self.daily[row, code] += 1
+        item = (ordinal, entry_id, code)
+        # Analyses can finish out of order, so the entry is inserted where it sorts.
+        if len(self.recent) == self.window_size and item < self.recent[0]:
+            return
+        bisect.insort(self.recent, item)
+        self.recent_negative += NEGATIVE_FLAGS[code]
+        if len(self.recent) > self.window_size:
+            self.recent_negative -= NEGATIVE_FLAGS[self.recent.pop(0)[2]]
+
+    def remove(self, entry_id, ordinal, code):
+        """Returns True if the entry was one of the latest ones and the window needs a reload."""
+        if self.origin is not None and 0 <= ordinal - self.origin < self.days:
+            row = ordinal - self.origin
+            self.daily[row, code] = max(0, self.daily[row, code] - 1)
+        return any(item[1] == entry_id for item in self.recent)
+
+    def reset_recent(self, items):
+        self.recent = sorted(items)[-self.window_size:]
+        self.recent_negative = sum(NEGATIVE_FLAGS[code] for _, _, code in self.recent)
+
+    def window(self, start, end):
+        """Counts for the inclusive ordinal range [start, end], zero-filled outside the known days."""
+        out = np.zeros((end - start + 1, len(MOODS)), dtype=np.int32)
+        if self.origin is None:
+            return out
+        lo = max(start, self.origin)
+        hi = min(end, self.origin + self.days - 1)
+        if lo <= hi:
+            out[lo - start:hi - start + 1] = self.daily[lo - self.origin:hi - self.origin + 1]
+        return out
+
+    def streak(self, today):
+        """Walks back from today (or yesterday) in doubling blocks, so the cost follows the streak length."""
+        if self.origin is None or today < self.origin:
+            return 0
+        row = today - self.origin
+        if row >= self.days or not self.daily[row].any():
+            row -= 1
+        if row < 0 or row >= self.days:
+            return 0
+        streak, block = 0, 64
+        while row >= 0:
+            lo = max(0, row - block + 1)
+            active = self.daily[lo:row + 1].any(axis=1)[::-1]
+            gaps = np.flatnonzero(~active)
+            if len(gaps):
+                return streak + int(gaps[0])
+            streak += len(active)
+            row, block = lo - 1, block * 2
+        return streak
+
+
+class MoodAnalytics:
+    """
+    Per-user mood aggregates that are updated incrementally on every journal
+    append or delete instead of being recomputed from the full history.
+    A user's aggregates are built once from `load_entries(user_id)`, which must
+    yield (entry_id, iso_date, mood) tuples oldest first. With `max_bytes`, the
+    least recently used users are dropped once the aggregates outgrow the
+    budget and are rebuilt from `load_entries` the next time they are needed.
+    Updates must be made after the change is stored: they are skipped for
+    users that are not loaded, whose aggregates are built from the store.
+    """
+
+    def __init__(self, load_entries, window=7, max_bytes=None):
+        self.load_entries = load_entries
+        self.window_size = window
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._users = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _user(self, user_id):
+        stats = self._users.get(user_id)
+        if stats is None:
+            stats = _UserMoods(self.window_size)
+            for entry_id, entry_date, mood in self.load_entries(user_id):
+                if mood:
+                    stats.add(entry_id, date.fromisoformat(entry_date).toordinal(), mood_code(mood))
+            self._users[user_id] = stats
+            self._bytes += stats.nbytes()
+        self._users.move_to_end(user_id)
+        self._trim()
+        return stats
+
+    def _trim(self):
+        if self.max_bytes is None:
+            return
+        # The most recently used user is kept even if it alone exceeds the budget.
+        while self._bytes > self.max_bytes and len(self._users) > 1:
+            _, stats = self._users.popitem(last=False)
+            self._bytes -= stats.nbytes()
+            self.evictions += 1
+
+    def add_entry(self, user_id, entry_id, entry_date, mood):
+        if not mood:
+            return
+        with self._lock:
+            if user_id not in self._users:
+                return
+            stats = self._user(user_id)
+            before = stats.nbytes()
+            stats.add(entry_id, date.fromisoformat(entry_date).toordinal(), mood_code(mood))
+            self._bytes += stats.nbytes() - before
+            self._trim()
+
+    def remove_entry(self, user_id, entry_id, entry_date, mood):
+        if not mood:
+            return
+        with self._lock:
+            if user_id not in self._users:
+                return
+            stats = self._user(user_id)
+            before = stats.nbytes()
+            if stats.remove(entry_id, date.fromisoformat(entry_date).toordinal(), mood_code(mood)):
+                # One of the latest entries went away, so the window has to be refilled
+                # from older history; this is the only path that rescans.
+                latest = deque(maxlen=self.window_size)
+                for other_id, other_date, other_mood in self.load_entries(user_id):
+                    if other_mood and other_id != entry_id:
+                        latest.append((date.fromisoformat(other_date).toordinal(), other_id, mood_code(other_mood)))
+                stats.reset_recent(list(latest))
+            self._bytes += stats.nbytes() - before
+
+    def forget(self, user_id):
+        with self._lock:
+            stats = self._users.pop(user_id, None)
+            if stats is not None:
+                self._bytes -= stats.nbytes()
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._users), "bytes": self._bytes, "evictions": self.evictions}
+
+    def recent_negative_count(self, user_id, last=3):
+        """Number of negative moods among the latest `last` entries (at most the window size)."""
+        with self._lock:
+            stats = self._user(user_id)
+            if last >= len(stats.recent):
+                return stats.recent_negative
+            return sum(NEGATIVE_FLAGS[stats.recent[-i][2]] for i in range(1, last + 1))
+
+    def negative_ratio(self, user_id):
+        """Share of negative moods among the latest `window` entries."""
+        with self._lock:
+            stats = self._user(user_id)
+            return stats.recent_negative / len(stats.recent) if stats.recent else 0.0
+
+    def daily_counts(self, user_id, start, end):
+        """Returns a (days, moods) count matrix for the inclusive date range."""
+        with self._lock:
+            return self._user(user_id).window(start.toordinal(), end.toordinal())
+
+    def weekly_counts(self, user_id, start, end):
+        """Returns (week_starts, (weeks, moods) count matrix) for Monday-aligned weeks covering the range."""
+        start = start - timedelta(days=start.weekday())
+        end = end + timedelta(days=6 - end.weekday())
+        daily = self.daily_counts(user_id, start, end)
+        weeks = daily.reshape(-1, 7, len(MOODS)).sum(axis=1)
+        return [start + timedelta(weeks=i) for i in range(len(weeks))], weeks
+
+    def streak(self, user_id, today=None):
+        """Consecutive days with at least one entry, ending today or yesterday."""
+        with self._lock:
+            return self._user(user_id).streak((today or date.today()).toordinal())
@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict
+
+# Lower numbers are served first when requests for the same API key queue up.
+CALL_SITE_PRIORITIES = {
+    "chat": 0,
+    "chat_summary": 1,
+    "journal_analysis": 2,
+    "planner": 3,
+    "other": 3,
+    "stories": 4,
+    "story_pool": 5,
+}
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request waited longer than allowed for rate-limit capacity."""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function and every caller that arrives while it is in flight gets the
+    same result (or exception) instead of making its own call.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Returns (result, shared) where `shared` is True for callers that did not run `fn`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class _Buckets:
+    """Request and token buckets for one API key, refilled continuously."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.request_rate = requests_per_minute / 60.0
+        self.token_rate = tokens_per_minute / 60.0
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.queue = []
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+
+    def wait_time(self, now, tokens):
+        """Seconds until one request of `tokens` fits; 0 if it fits now."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        missing_requests = max(0.0, 1.0 - self.requests) / self.request_rate
+        missing_tokens = max(0.0, tokens - self.tokens) / self.token_rate
+        return max(missing_requests, missing_tokens)
+
+    def idle(self, now):
+        """True when nobody is queued and both buckets are full, i.e. the state of a new key."""
+        if self.queue or now < self.paused_until:
+            return False
+        self.refill(now)
+        return self.requests >= self.request_capacity and self.tokens >= self.token_capacity
+
+
+class RateLimiter:
+    """
+    Proactive per-API-key token buckets for requests/minute and tokens/minute.
+    Callers that have to wait queue per key by priority (then arrival order),
+    so a chat turn is sent before stories queued earlier for the same key.
+    Buckets that have refilled completely are dropped, at most once per
+    refill window, so keys that stopped sending do not accumulate.
+    """
+
+    def __init__(self, requests_per_minute=10, tokens_per_minute=250_000, max_wait=60.0, expire_every=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait = max_wait
+        self.expire_every = expire_every
+        self._keys = defaultdict(lambda: _Buckets(self.requests_per_minute, self.tokens_per_minute))
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._next_expiry = time.monotonic() + expire_every
+
+    def _expire_idle(self, now):
+        if now < self._next_expiry:
+            return
+        self._next_expiry = now + self.expire_every
+        for key in [key for key, buckets in self._keys.items() if buckets.idle(now)]:
+            del self._keys[key]
+
+    def acquire(self, key, tokens=0, priority=3):
+        """Blocks until the request may be sent and returns the seconds spent waiting."""
+        started = time.monotonic()
+        with self._condition:
+            self._expire_idle(started)
+            buckets = self._keys[key]
+            tokens = min(float(tokens), buckets.token_capacity)
+            entry = (priority, next(self._sequence))
+            heapq.heappush(buckets.queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    buckets.refill(now)
+                    wait = buckets.wait_time(now, tokens) if buckets.queue[0] == entry else None
+                    if wait == 0:
+                        buckets.requests -= 1
+                        buckets.tokens -= tokens
+                        return now - started
+                    remaining = self.max_wait - (now - started)
+                    if remaining <= 0:
+                        raise RateLimitTimeout("Too many requests are queued for this API key. Please try again shortly.")
+                    self._condition.wait(min(remaining, wait) if wait is not None else remaining)
+            finally:
+                buckets.queue.remove(entry)
+                heapq.heapify(buckets.queue)
+                self._condition.notify_all()
+
+    def settle(self, key, estimated_tokens, actual_tokens):
+        """Corrects the token bucket once the real usage of a request is known."""
+        with self._condition:
+            buckets = self._keys[key]
+            buckets.tokens = min(buckets.token_capacity, buckets.tokens + estimated_tokens - actual_tokens)
+            self._condition.notify_all()
+
+    def pause(self, key, seconds):
+        """Holds back every request for the key, e.g. after the API answered 429."""
+        with self._condition:
+            buckets = self._keys[key]
+            buckets.paused_until = max(buckets.paused_until, time.monotonic() + seconds)
+            buckets.requests = 0.0
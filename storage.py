@@ -0,0 +1,389 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    text TEXT NOT NULL,
+    mood TEXT,
+    summary TEXT,
+    tip TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_journal_user_date ON journal_entries (user_id, date, id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    user_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user_id, conversation_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages (user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    user_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    summarized_through INTEGER NOT NULL,
+    PRIMARY KEY (user_id, conversation_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS quiz_results (
+    user_id TEXT PRIMARY KEY,
+    answers TEXT NOT NULL,
+    persona TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Statements are kept as constants so sqlite3's per-connection statement
+# cache reuses the prepared statement on every call.
+INSERT_JOURNAL = (
+    "INSERT INTO journal_entries (user_id, date, text, mood, summary, tip, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+# Only fills in an entry that has no analysis yet, so two concurrent analyses
+# of the same entry cannot both count towards the mood analytics.
+UPDATE_JOURNAL_ANALYSIS = (
+    "UPDATE journal_entries SET mood = ?, summary = ?, tip = ? WHERE user_id = ? AND id = ? AND mood IS NULL"
+)
+DELETE_JOURNAL = "DELETE FROM journal_entries WHERE user_id = ? AND id = ?"
+SELECT_JOURNAL_PAGE = (
+    "SELECT id, date, text, mood, summary, tip FROM journal_entries "
+    "WHERE user_id = ? AND date BETWEEN ? AND ? ORDER BY date DESC, id DESC LIMIT ? OFFSET ?"
+)
+COUNT_JOURNAL = "SELECT COUNT(*) FROM journal_entries WHERE user_id = ? AND date BETWEEN ? AND ?"
+SELECT_JOURNAL_MOODS = (
+    "SELECT id, date, mood FROM journal_entries WHERE user_id = ? ORDER BY date, id"
+)
+SELECT_JOURNAL_EXPORT = (
+    "SELECT date, text, mood, summary, tip FROM journal_entries WHERE user_id = ? ORDER BY date, id"
+)
+SELECT_MESSAGES_EXPORT = (
+    "SELECT conversation_id, seq, role, content, created_at FROM messages "
+    "WHERE user_id = ? ORDER BY conversation_id, seq"
+)
+SELECT_JOURNAL_TEXTS = "SELECT id, text, summary FROM journal_entries WHERE user_id = ? ORDER BY id"
+SELECT_JOURNAL_BY_IDS = (
+    "SELECT id, date, text, mood, summary, tip FROM journal_entries "
+    "WHERE user_id = ? AND id IN (SELECT value FROM json_each(?))"
+)
+SELECT_RECENT_MOODS = (
+    "SELECT mood FROM journal_entries WHERE user_id = ? AND mood IS NOT NULL "
+    "ORDER BY date DESC, id DESC LIMIT ?"
+)
+INSERT_MESSAGE = (
+    "INSERT INTO messages (user_id, conversation_id, seq, role, content, created_at) "
+    "SELECT ?, ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM messages "
+    "WHERE user_id = ? AND conversation_id = ?"
+)
+SELECT_MESSAGES = (
+    "SELECT seq, role, content FROM messages WHERE user_id = ? AND conversation_id = ? "
+    "AND seq < ? ORDER BY seq DESC LIMIT ?"
+)
+SELECT_MESSAGES_AFTER = (
+    "SELECT seq, role, content FROM messages WHERE user_id = ? AND conversation_id = ? "
+    "AND seq > ? ORDER BY seq LIMIT ?"
+)
+SELECT_LATEST_CONVERSATION = (
+    "SELECT conversation_id FROM messages WHERE user_id = ? ORDER BY created_at DESC LIMIT 1"
+)
+UPSERT_SUMMARY = (
+    "INSERT INTO conversation_summaries (user_id, conversation_id, summary, summarized_through) "
+    "VALUES (?, ?, ?, ?) ON CONFLICT (user_id, conversation_id) DO UPDATE SET "
+    "summary = excluded.summary, summarized_through = excluded.summarized_through"
+)
+SELECT_SUMMARY = (
+    "SELECT summary, summarized_through FROM conversation_summaries WHERE user_id = ? AND conversation_id = ?"
+)
+UPSERT_QUIZ = (
+    "INSERT INTO quiz_results (user_id, answers, persona, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET answers = excluded.answers, "
+    "persona = excluded.persona, updated_at = excluded.updated_at"
+)
+SELECT_QUIZ = "SELECT answers, persona FROM quiz_results WHERE user_id = ?"
+
+JOURNAL_FIELDS = ("id", "date", "text", "mood", "summary", "tip")
+MIN_DATE = "0000-01-01"
+MAX_DATE = "9999-12-31"
+
+
+class Storage(ABC):
+    """Repository interface for everything MannMitra keeps per user."""
+
+    @abstractmethod
+    def add_journal_entry(self, user_id, entry):
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_journal_entries(self, user_id, entries):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_journal_analysis(self, user_id, entry_id, mood, summary, tip):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_journal_entry(self, user_id, entry_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_journal_entries(self, user_id, limit=20, offset=0, start_date=None, end_date=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_journal_entries(self, user_id, start_date=None, end_date=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_journal_moods(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_journal_texts(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_journal_entries(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_journal_entries(self, user_id, entry_ids):
+        raise NotImplementedError
+
+    @abstractmethod
+    def recent_moods(self, user_id, limit=3):
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_message(self, user_id, conversation_id, role, content):
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_messages(self, user_id, messages):
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_messages(self, user_id, conversation_id, limit=50, before_seq=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_messages(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_messages_after(self, user_id, conversation_id, after_seq=0, limit=1000):
+        raise NotImplementedError
+
+    @abstractmethod
+    def latest_conversation_id(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_conversation_summary(self, user_id, conversation_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_conversation_summary(self, user_id, conversation_id, summary, summarized_through):
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_quiz_result(self, user_id, answers, persona):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_quiz_result(self, user_id):
+        raise NotImplementedError
+
+
+class SQLiteStorage(Storage):
+    """
+    SQLite implementation of Storage. Runs in WAL mode so readers never block
+    the writer. Each operation checks a connection out of a pool of at most
+    `pool_size` and returns it when done, so short-lived threads (every
+    Streamlit rerun runs on a new one) do not each keep a connection open.
+    """
+
+    def __init__(self, path="mannmitra.db", pool_size=8):
+        self.path = path
+        self.pool_size = pool_size
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._connections) < self.pool_size:
+                conn = self._open()
+                self._connections.append(conn)
+                return conn
+        return self._idle.get()
+
+    @contextmanager
+    def _connection(self):
+        """Checks out a connection for one transaction, committed on success and rolled back on error."""
+        conn = self._checkout()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._idle = queue.LifoQueue()
+
+    def add_journal_entry(self, user_id, entry):
+        with self._connection() as conn:
+            cursor = conn.execute(INSERT_JOURNAL, self._journal_row(user_id, entry))
+            return cursor.lastrowid
+
+    def add_journal_entries(self, user_id, entries):
+        """Inserts many entries in a single transaction."""
+        with self._connection() as conn:
+            cursor = conn.executemany(INSERT_JOURNAL, (self._journal_row(user_id, e) for e in entries))
+            return cursor.rowcount
+
+    @staticmethod
+    def _journal_row(user_id, entry):
+        return (
+            user_id, entry["date"], entry["text"], entry.get("mood"),
+            entry.get("summary"), entry.get("tip"), time.time(),
+        )
+
+    def update_journal_analysis(self, user_id, entry_id, mood, summary, tip):
+        """Fills in the model's analysis of an entry; returns False if it was deleted or analyzed meanwhile."""
+        with self._connection() as conn:
+            return conn.execute(UPDATE_JOURNAL_ANALYSIS, (mood, summary, tip, user_id, entry_id)).rowcount > 0
+
+    def delete_journal_entry(self, user_id, entry_id):
+        with self._connection() as conn:
+            return conn.execute(DELETE_JOURNAL, (user_id, entry_id)).rowcount > 0
+
+    def list_journal_entries(self, user_id, limit=20, offset=0, start_date=None, end_date=None):
+        """Returns one page of entries, newest first, optionally within an inclusive ISO date range."""
+        params = (user_id, start_date or MIN_DATE, end_date or MAX_DATE, limit, offset)
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_JOURNAL_PAGE, params).fetchall()
+        return [dict(zip(JOURNAL_FIELDS, row)) for row in rows]
+
+    def count_journal_entries(self, user_id, start_date=None, end_date=None):
+        params = (user_id, start_date or MIN_DATE, end_date or MAX_DATE)
+        with self._connection() as conn:
+            return conn.execute(COUNT_JOURNAL, params).fetchone()[0]
+
+    def iter_journal_moods(self, user_id):
+        """Yields (id, date, mood) for every entry of the user, oldest first."""
+        with self._connection() as conn:
+            yield from conn.execute(SELECT_JOURNAL_MOODS, (user_id,))
+
+    def iter_journal_texts(self, user_id):
+        """Yields (id, text, summary) for every entry of the user, oldest first."""
+        with self._connection() as conn:
+            yield from conn.execute(SELECT_JOURNAL_TEXTS, (user_id,))
+
+    def iter_journal_entries(self, user_id):
+        """Yields every entry of the user as (date, text, mood, summary, tip), oldest first, straight from the cursor."""
+        with self._connection() as conn:
+            yield from conn.execute(SELECT_JOURNAL_EXPORT, (user_id,))
+
+    def get_journal_entries(self, user_id, entry_ids):
+        """Returns the given entries in the order of `entry_ids`, skipping ones that no longer exist."""
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_JOURNAL_BY_IDS, (user_id, json.dumps(list(entry_ids)))).fetchall()
+        by_id = {row[0]: dict(zip(JOURNAL_FIELDS, row)) for row in rows}
+        return [by_id[entry_id] for entry_id in entry_ids if entry_id in by_id]
+
+    def recent_moods(self, user_id, limit=3):
+        """Returns the moods of the latest analyzed entries, newest first."""
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_RECENT_MOODS, (user_id, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def add_message(self, user_id, conversation_id, role, content):
+        with self._connection() as conn:
+            conn.execute(INSERT_MESSAGE, (user_id, conversation_id, role, content, time.time(), user_id, conversation_id))
+
+    def add_messages(self, user_id, messages):
+        """
+        Appends many messages, each a dict with conversation_id, role and
+        content, in a single transaction; returns the number inserted.
+        """
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.executemany(INSERT_MESSAGE, (
+                (user_id, m["conversation_id"], m["role"], m["content"], m.get("created_at") or now,
+                 user_id, m["conversation_id"])
+                for m in messages
+            ))
+            return cursor.rowcount
+
+    def iter_messages(self, user_id):
+        """Yields (conversation_id, seq, role, content, created_at) for every message of the user, per conversation."""
+        with self._connection() as conn:
+            yield from conn.execute(SELECT_MESSAGES_EXPORT, (user_id,))
+
+    def list_messages(self, user_id, conversation_id, limit=50, before_seq=None):
+        """Returns up to `limit` messages preceding `before_seq`, oldest first."""
+        before_seq = before_seq if before_seq is not None else 2 ** 62
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_MESSAGES, (user_id, conversation_id, before_seq, limit)).fetchall()
+        return [{"seq": seq, "role": role, "content": content} for seq, role, content in reversed(rows)]
+
+    def list_messages_after(self, user_id, conversation_id, after_seq=0, limit=1000):
+        """Returns up to `limit` messages following `after_seq`, oldest first."""
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_MESSAGES_AFTER, (user_id, conversation_id, after_seq, limit)).fetchall()
+        return [{"seq": seq, "role": role, "content": content} for seq, role, content in rows]
+
+    def latest_conversation_id(self, user_id):
+        with self._connection() as conn:
+            row = conn.execute(SELECT_LATEST_CONVERSATION, (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def load_conversation_summary(self, user_id, conversation_id):
+        """Returns (summary, seq of the last summarized message), or ("", 0) if nothing is summarized yet."""
+        with self._connection() as conn:
+            row = conn.execute(SELECT_SUMMARY, (user_id, conversation_id)).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def save_conversation_summary(self, user_id, conversation_id, summary, summarized_through):
+        with self._connection() as conn:
+            conn.execute(UPSERT_SUMMARY, (user_id, conversation_id, summary, summarized_through))
+
+    def save_quiz_result(self, user_id, answers, persona):
+        with self._connection() as conn:
+            conn.execute(UPSERT_QUIZ, (user_id, json.dumps(answers), persona, time.time()))
+
+    def load_quiz_result(self, user_id):
+        with self._connection() as conn:
+            row = conn.execute(SELECT_QUIZ, (user_id,)).fetchone()
+        if row is None:
+            return None
+        return {"answers": json.loads(row[0]), "persona": row[1]}
@@ -0,0 +1,197 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+def story_hash(story):
+    """Content hash used to de-duplicate stories, insensitive to case and whitespace."""
+    text = " ".join(f"{story.get('title', '')}\x1f{story.get('content', '')}".lower().split())
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _PooledStory:
+    __slots__ = ("story", "digest", "serves")
+
+    def __init__(self, story, digest, serves=0):
+        self.story = story
+        self.digest = digest
+        self.serves = serves
+
+
+class StoryPool:
+    """
+    Shared pool of pre-generated stories keyed by (mood, theme).
+
+    With a server-side `api_key`, a background worker keeps every requested
+    bucket at or above `low_water` stories by calling
+    `generate(api_key, mood, theme)`, which returns a parsed story dict or
+    None. Without one the pool only holds stories added with `add`, so users'
+    own keys are never spent on stories for other users. Stories are de-duplicated by content hash, are
+    retired after `max_serves` serves, and each bucket holds at most
+    `capacity` stories (the oldest is evicted first). With a `path`, the pool
+    is loaded from and saved to a JSON file so it survives restarts.
+    """
+
+    def __init__(self, generate, low_water=3, capacity=20, max_serves=3, path=None,
+                 api_key=None, metrics=METRICS):
+        self.generate = generate
+        self.low_water = low_water
+        self.capacity = capacity
+        self.max_serves = max_serves
+        self.path = path
+        self.api_key = api_key
+        self.metrics = metrics
+        self._buckets = {}
+        self._hashes = set()
+        self._pending = deque()
+        self._pending_keys = set()
+        self._dirty = False
+        self._condition = threading.Condition()
+        self.stats = {"served": 0, "generated": 0, "refilled": 0, "duplicates": 0, "evicted": 0}
+        if path:
+            self._load()
+        threading.Thread(target=self._work, name="story-pool", daemon=True).start()
+
+    def _bucket(self, mood, theme):
+        return self._buckets.setdefault((mood, theme), deque())
+
+    def _add(self, mood, theme, story, serves=0):
+        digest = story_hash(story)
+        if digest in self._hashes:
+            self.stats["duplicates"] += 1
+            return False
+        bucket = self._bucket(mood, theme)
+        if len(bucket) >= self.capacity:
+            self._hashes.discard(bucket.popleft().digest)
+            self.stats["evicted"] += 1
+        bucket.append(_PooledStory(story, digest, serves))
+        self._hashes.add(digest)
+        self._dirty = True
+        return True
+
+    def add(self, mood, theme, story, served=False):
+        """Adds a story, e.g. one generated inline; returns False for a duplicate."""
+        with self._condition:
+            added = self._add(mood, theme, story, serves=int(served))
+            if served:
+                self.stats["generated"] += 1
+                self.metrics.inc("story_pool_served_total", source="generated")
+            if added:
+                # Wakes the worker to save the pool.
+                self._condition.notify()
+            return added
+
+    def take(self, mood, theme, exclude=()):
+        """
+        Returns a pooled story for the bucket that is not in `exclude` (a set
+        of story hashes), or None. Schedules a refill when the bucket runs low.
+        """
+        with self._condition:
+            bucket = self._bucket(mood, theme)
+            chosen = next((item for item in bucket if item.digest not in exclude), None)
+            if chosen is not None:
+                chosen.serves += 1
+                if chosen.serves >= self.max_serves:
+                    bucket.remove(chosen)
+                    self._hashes.discard(chosen.digest)
+                self._dirty = True
+                self.stats["served"] += 1
+                self.metrics.inc("story_pool_served_total", source="pool")
+            if len(bucket) < self.low_water:
+                self._schedule(mood, theme)
+            return chosen.story if chosen is not None else None
+
+    def schedule(self, mood, theme):
+        with self._condition:
+            self._schedule(mood, theme)
+
+    def _schedule(self, mood, theme):
+        key = (mood, theme)
+        if not self.api_key or key in self._pending_keys:
+            return
+        self._pending.append(key)
+        self._pending_keys.add(key)
+        self._condition.notify()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending and not (self.path and self._dirty):
+                    self._condition.wait()
+                key = self._pending.popleft() if self._pending else None
+                if key is not None:
+                    self._pending_keys.discard(key)
+                    missing = self.low_water - len(self._bucket(*key))
+            if key is not None:
+                self._refill(*key, missing)
+            try:
+                self.save()
+            except OSError:
+                # The worker must outlive a full disk or a missing directory; the next change retries.
+                logger.exception("Could not save the story pool to %s", self.path)
+                self.metrics.inc("story_pool_save_errors_total")
+
+    def _refill(self, mood, theme, missing):
+        # Duplicates do not count towards the refill, but only a few extra attempts are made.
+        for _ in range(max(0, missing) * 2):
+            try:
+                story = self.generate(self.api_key, mood, theme)
+            except Exception:
+                story = None
+            with self._condition:
+                if story is not None and self._add(mood, theme, story):
+                    self.stats["refilled"] += 1
+                if len(self._bucket(mood, theme)) >= self.low_water:
+                    break
+
+    def ratio(self):
+        """Share of served stories that came from the pool rather than inline generation."""
+        with self._condition:
+            total = self.stats["served"] + self.stats["generated"]
+            return self.stats["served"] / total if total else 0.0
+
+    def snapshot(self):
+        with self._condition:
+            return {**self.stats, "size": len(self._hashes), "buckets": len(self._buckets)}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for item in saved.get("stories", []):
+            self._add(item["mood"], item["theme"], item["story"], item.get("serves", 0))
+        self._dirty = False
+
+    def save(self):
+        """Writes the pool to `path` atomically, if anything changed since the last save."""
+        if not self.path:
+            return
+        with self._condition:
+            if not self._dirty:
+                return
+            stories = [
+                {"mood": mood, "theme": theme, "story": item.story, "serves": item.serves}
+                for (mood, theme), bucket in self._buckets.items()
+                for item in bucket
+            ]
+            self._dirty = False
+        temp_path = f"{self.path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"stories": stories}, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
@@ -0,0 +1,209 @@
+import json
+import re
+import threading
+from collections import Counter
+
+from metrics import METRICS
+
+JOURNAL_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "mood": {"type": "STRING", "enum": ["happy", "calm", "sad", "stressed", "anxious"]},
+        "summary": {"type": "STRING"},
+        "coping_tip": {"type": "STRING"},
+    },
+    "required": ["mood", "summary", "coping_tip"],
+    "propertyOrdering": ["mood", "summary", "coping_tip"],
+}
+
+STORY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "content": {"type": "STRING"},
+        "coping_action": {"type": "STRING"},
+    },
+    "required": ["title", "content", "coping_action"],
+    "propertyOrdering": ["title", "content", "coping_action"],
+}
+
+JOURNAL_FIELDS = {
+    "mood": ["mood"],
+    "summary": ["summary"],
+    "coping_tip": ["coping tip", "coping_tip", "tip"],
+}
+
+STORY_FIELDS = {
+    "title": ["title"],
+    "content": ["content", "story"],
+    "coping_action": ["coping action", "coping_action", "action"],
+}
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+class ParseStats:
+    """
+    Counts which strategy parsed each model output, and how many could not be
+    parsed. With `metrics`, outcomes are also exported as
+    structured_parse_total{kind, strategy}.
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, outcome, kind="other"):
+        with self._lock:
+            self._counts[outcome] += 1
+        if self.metrics is not None:
+            self.metrics.inc("structured_parse_total", kind=kind, strategy=outcome)
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        failed = counts.get("failed", 0)
+        return {
+            "total": total,
+            "success_rate": (total - failed) / total if total else 1.0,
+            "by_strategy": counts,
+        }
+
+
+PARSE_STATS = ParseStats(metrics=METRICS)
+
+
+def _balanced_object(text):
+    """
+    Returns the first {...} object in the text. If the output was cut off,
+    closes the open string and brackets so the prefix can still be decoded.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    stack, in_string, escaped = [], False, False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return text[start:index + 1]
+    repaired = text[start:].rstrip()
+    if escaped:
+        repaired = repaired[:-1]
+    if in_string:
+        repaired += '"'
+    repaired = re.sub(r',\s*"[^"]*"?\s*:?\s*$', "", repaired)
+    repaired = re.sub(r"[,:]\s*$", "", repaired)
+    return repaired + "".join(reversed(stack))
+
+
+def _load_object(candidate):
+    if candidate is None:
+        return None
+    for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+        try:
+            value = json.loads(attempt)
+        except ValueError:
+            continue
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            value = value[0]
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def _normalize_keys(value, fields):
+    out = {}
+    lowered = {str(key).strip().lower().replace("-", " "): item for key, item in value.items()}
+    for field, aliases in fields.items():
+        for alias in aliases:
+            item = lowered.get(alias, lowered.get(alias.replace("_", " ")))
+            if item is not None:
+                out[field] = str(item).strip()
+                break
+    return out
+
+
+def _labelled_lines(text, fields):
+    """Fallback for "Label: value" output, tolerating markdown, bullets and preambles."""
+    out = {}
+    labels = {alias.replace("_", " "): field for field, aliases in fields.items() for alias in aliases}
+    pattern = re.compile(
+        r"^[\s*#>\-•]*(" + "|".join(re.escape(label) for label in sorted(labels, key=len, reverse=True)) + r")[\s*]*[:\-–][\s*]*(.*)$",
+        re.IGNORECASE,
+    )
+    current = None
+    for line in text.splitlines():
+        match = pattern.match(line)
+        if match:
+            current = labels[match.group(1).lower()]
+            if current in out:
+                current = None
+                continue
+            out[current] = match.group(2).strip().strip("*").strip()
+        elif current and line.strip() and not out[current]:
+            out[current] = line.strip().strip("*").strip()
+    return {field: value for field, value in out.items() if value}
+
+
+def parse_structured(text, fields, required=(), kind="other", stats=PARSE_STATS):
+    """
+    Extracts the given fields from model output without re-requesting.
+    Tries strict JSON first, then fenced JSON, then the first (repaired)
+    JSON object, then "Label: value" lines. Returns a dict that contains at
+    least the `required` fields, or None. `kind` labels the recorded outcome.
+    """
+    if not text:
+        stats.record("failed", kind)
+        return None
+    fenced = next(iter(_FENCE.findall(text)), None)
+    strategies = [
+        ("json", lambda: _load_object(text.strip())),
+        ("fenced_json", lambda: _load_object(fenced)),
+        ("repaired_json", lambda: _load_object(_balanced_object(fenced or text))),
+    ]
+    for name, strategy in strategies:
+        value = strategy()
+        if value is not None:
+            value = _normalize_keys(value, fields)
+            if all(value.get(field) for field in required):
+                stats.record(name, kind)
+                return value
+    value = _labelled_lines(text, fields)
+    if all(value.get(field) for field in required):
+        stats.record("labelled_lines", kind)
+        return value
+    stats.record("failed", kind)
+    return None
+
+
+def parse_journal_analysis(text, stats=PARSE_STATS):
+    analysis = parse_structured(text, JOURNAL_FIELDS, required=("mood",), kind="journal", stats=stats)
+    if analysis is not None:
+        analysis["mood"] = analysis["mood"].strip(" .").lower()
+        analysis.setdefault("summary", "")
+        analysis.setdefault("coping_tip", "")
+    return analysis
+
+
+def parse_story(text, stats=PARSE_STATS):
+    story = parse_structured(text, STORY_FIELDS, required=("title", "content"), kind="story", stats=stats)
+    if story is not None:
+        story.setdefault("coping_action", "")
+    return story
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from mock_gemini import MockCaches, MockConfig, MockStats, start_server  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def mock_server():
+    server = start_server()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def server(mock_server):
+    """Reconfigures the shared mock for one test and returns it."""
+    def configure(**config):
+        config.setdefault("chunk_delay", "const:0")
+        mock_server.config = MockConfig(**config)
+        mock_server.stats = MockStats()
+        mock_server.caches = MockCaches()
+        return mock_server
+
+    return configure
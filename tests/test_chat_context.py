@@ -0,0 +1,44 @@
+import pytest
+
+from chat_context import ChatContextManager
+from gemini_client import GeminiError
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "test.db"))
+    for i in range(20):
+        storage.add_message("u", "c", "user" if i % 2 == 0 else "assistant", f"message {i} " + "word " * 100)
+    yield storage
+    storage.close()
+
+
+def test_build_schedules_a_fold_and_keeps_every_turn(storage):
+    scheduled = []
+    manager = ChatContextManager(storage, token_budget=1000, schedule_fold=lambda *key: scheduled.append(key))
+    contents, summary = manager.build("u", "c")
+    assert scheduled == [("u", "c")]
+    assert len(contents) == 20 and summary == ""
+
+
+def test_failed_fold_keeps_the_turns(storage):
+    manager = ChatContextManager(storage, token_budget=1000)
+
+    def summarize(summary, messages):
+        raise GeminiError("upstream down")
+
+    with pytest.raises(GeminiError):
+        manager.fold("u", "c", summarize)
+    assert storage.load_conversation_summary("u", "c") == ("", 0)
+    assert len(manager.build("u", "c")[0]) == 20
+
+
+def test_fold_stores_the_summary_and_trims_the_window(storage):
+    manager = ChatContextManager(storage, token_budget=1000)
+    assert manager.fold("u", "c", lambda summary, messages: f"{len(messages)} turns")
+    contents, summary = manager.build("u", "c")
+    assert summary.endswith("turns")
+    # A leading assistant turn of the window is dropped as well.
+    assert int(summary.split()[0]) + len(contents) in (19, 20)
+    assert contents[0]["role"] == "user"
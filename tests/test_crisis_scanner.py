@@ -0,0 +1,31 @@
+from crisis_scanner import CrisisScanner, PhraseMatcher, normalize
+
+
+def find(matcher, text):
+    return sorted(matcher.phrases[index] for index in matcher.find(normalize(text)))
+
+
+def test_matches_on_word_boundaries_only():
+    matcher = PhraseMatcher(["die", "kill myself", "मरना चाहता"])
+    assert find(matcher, "I want to DIE.") == ["die"]
+    assert find(matcher, "diet plans and studies") == []
+    assert find(matcher, "i want to kill myselfie") == []
+    assert find(matcher, "मैं मरना चाहता हूँ") == ["मरना चाहता"]
+
+
+def test_reports_contained_and_overlapping_phrases():
+    matcher = PhraseMatcher(["want to die", "die", "to die now", "no way", "no way out"])
+    assert find(matcher, "i want to die now") == ["die", "to die now", "want to die"]
+    assert find(matcher, "there is no way out") == ["no way", "no way out"]
+
+
+def test_duplicate_phrases_keep_every_index():
+    matcher = PhraseMatcher(["self harm", "self-harm"])
+    assert matcher.find(normalize("thinking about self harm")) == {0, 1}
+
+
+def test_scanner_weights():
+    scanner = CrisisScanner([{"phrase": "kill myself", "weight": 1.0}, {"phrase": "hopeless", "weight": 0.3}])
+    assert scanner.scan("I want to kill myself").is_crisis
+    verdict = scanner.scan("feeling hopeless")
+    assert verdict.level == "none" and verdict.matches == ["hopeless"]
@@ -0,0 +1,40 @@
+import io
+
+import pytest
+
+from data_transfer import MAX_TEXT_LENGTH, ImportAborted, export_journal, import_journal
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "test.db"))
+    yield storage
+    storage.close()
+
+
+def csv_lines(rows):
+    return io.StringIO("date,text,mood,summary,tip\r\n" + "".join(f"{row}\r\n" for row in rows), newline="")
+
+
+def test_round_trip(storage):
+    storage.add_journal_entries("u", [{"date": "2026-01-01", "text": 'he said "hi",\nok', "mood": "sad"}])
+    exported = "".join(export_journal(storage, "u", "csv"))
+    imported, errors = import_journal(storage, "v", io.StringIO(exported, newline=""), "csv")
+    assert (imported, errors.count) == (1, 0)
+    assert list(storage.iter_journal_entries("v")) == list(storage.iter_journal_entries("u"))
+
+
+def test_over_long_field_is_an_invalid_row(storage):
+    rows = ["2026-01-01,short,,,", f"2026-01-02,{'x' * 150_000},,,", "2026-01-03,also short,,,"]
+    imported, errors = import_journal(storage, "u", csv_lines(rows), "csv")
+    assert imported == 2
+    assert errors.count == 1 and f"longer than {MAX_TEXT_LENGTH}" in errors.messages[0]
+
+
+def test_unreadable_csv_reports_the_rows_already_imported(storage):
+    rows = [f"2026-01-{day:02d},entry {day},,," for day in range(1, 5)] + [f"2026-02-01,{'x' * 300_000},,,"]
+    with pytest.raises(ImportAborted) as aborted:
+        import_journal(storage, "u", csv_lines(rows), "csv", batch_size=2)
+    assert aborted.value.imported == 4
+    assert storage.count_journal_entries("u") == 4
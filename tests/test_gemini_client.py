@@ -0,0 +1,158 @@
+import itertools
+import threading
+import time
+
+import pytest
+import requests
+
+import mock_gemini
+from gemini_client import CircuitBreaker, CircuitOpenError, GeminiClient, GeminiError
+from metrics import Metrics
+
+PAYLOAD = {"contents": [{"role": "user", "parts": [{"text": "I could not sleep last night."}]}]}
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault("backoff_cap", 0.01)
+    return GeminiClient(server.api_base, "gemini-test", metrics=Metrics(), **kwargs)
+
+
+def rolls(monkeypatch, *values):
+    """Makes the mock's failure rolls return `values` in turn, then always succeed."""
+    values = itertools.chain(values, itertools.repeat(1.0))
+    monkeypatch.setattr(mock_gemini.random, "random", lambda: next(values))
+
+
+def test_generate_text(server):
+    mock = server()
+    assert make_client(mock).generate_text("key", PAYLOAD)
+    assert mock.stats.snapshot() == {"200": 1}
+
+
+def test_stream_text_yields_sse_chunks(server):
+    mock = server(chunks=4)
+    chunks = list(make_client(mock).stream_text("key", PAYLOAD))
+    assert len(chunks) > 1 and all(chunks)
+    assert mock.stats.snapshot() == {"stream": 1}
+
+
+@pytest.mark.parametrize("config", [{"rate_429": 0.5, "retry_after": 0}, {"rate_5xx": 0.5}])
+def test_retries_then_succeeds(server, monkeypatch, config):
+    mock = server(**config)
+    rolls(monkeypatch, 0.0, 0.0)
+    client = make_client(mock, max_retries=3)
+    assert client.generate_text("key", PAYLOAD)
+    assert sum(mock.stats.snapshot().values()) == 3
+    assert client.circuit_breaker.state == "closed"
+
+
+def test_stream_retries_before_the_first_chunk(server, monkeypatch):
+    mock = server(rate_429=0.5, retry_after=0)
+    rolls(monkeypatch, 0.0)
+    assert "".join(make_client(mock).stream_text("key", PAYLOAD))
+    assert mock.stats.snapshot() == {"429": 1, "stream": 1}
+
+
+def test_gives_up_after_max_retries(server):
+    mock = server(rate_5xx=1.0)
+    client = make_client(mock, max_retries=2)
+    with pytest.raises(GeminiError) as error:
+        client.generate_text("key", PAYLOAD)
+    assert error.value.status in (500, 503)
+    assert sum(mock.stats.snapshot().values()) == 2
+
+
+def test_client_errors_are_not_retried(server):
+    mock = server()
+    with pytest.raises(GeminiError) as error:
+        make_client(mock).generate_text("key", {**PAYLOAD, "cachedContent": "cachedContents/missing"})
+    assert error.value.status == 403
+    assert mock.stats.snapshot() == {"403": 1}
+
+
+def test_connection_reset_mid_body_is_retried(server, monkeypatch):
+    mock = server()
+    client = make_client(mock)
+    request = client.session.request
+    calls = []
+
+    def flaky(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+        return request(*args, **kwargs)
+
+    monkeypatch.setattr(client.session, "request", flaky)
+    assert client.generate_text("key", PAYLOAD)
+    assert len(calls) == 2
+
+
+def test_invalid_requests_do_not_close_an_open_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    client = GeminiClient("http://127.0.0.1:1/v1beta", "gemini-test", circuit_breaker=breaker,
+                          max_retries=1, metrics=Metrics())
+    with pytest.raises(GeminiError):
+        client.generate_text("key", PAYLOAD)
+    assert breaker.state == "open"
+    client.api_base = "notascheme://host"
+    with pytest.raises(GeminiError):
+        client.generate_text("key", PAYLOAD)
+    assert breaker.state == "half_open"
+
+
+def test_open_circuit_fails_fast(server):
+    mock = server(rate_5xx=1.0)
+    client = make_client(mock, max_retries=1, circuit_breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    with pytest.raises(GeminiError):
+        client.generate_text("key", PAYLOAD)
+    with pytest.raises(CircuitOpenError):
+        client.generate_text("key", PAYLOAD)
+    assert sum(mock.stats.snapshot().values()) == 1
+
+
+def test_cached_content_lifecycle(server):
+    mock = server(cache_min_tokens=10)
+    client = make_client(mock)
+    instruction = {"parts": [{"text": "You are a calm and supportive companion. " * 5}]}
+    name = client.create_cached_content("key", None, instruction, PAYLOAD["contents"], 600)
+    client.update_cached_content_ttl("key", name, 60)
+    assert client.generate_text("key", {**PAYLOAD, "cachedContent": name})
+    assert mock.stats.snapshot() == {"cache_create": 1, "cache_update": 1, "200": 1}
+
+
+
+def test_key_slots_limit_concurrency_and_are_dropped_when_idle():
+    client = GeminiClient("http://127.0.0.1:1/v1beta", "gemini-test", max_concurrency_per_key=2)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def call(api_key):
+        with client._key_slot(api_key):
+            if api_key == "key-a":
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            if api_key == "key-a":
+                with lock:
+                    active[0] -= 1
+
+    threads = [threading.Thread(target=call, args=("key-a",)) for _ in range(6)]
+    threads += [threading.Thread(target=call, args=(f"key-{i}",)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    assert client._key_slots == {}
+
+
+def test_key_slot_is_released_on_error():
+    client = GeminiClient("http://127.0.0.1:1/v1beta", "gemini-test", max_concurrency_per_key=1)
+    with pytest.raises(RuntimeError):
+        with client._key_slot("key"):
+            raise RuntimeError
+    assert client._key_slots == {}
+    with client._key_slot("key"):
+        assert client._key_slots["key"][1] == 1
@@ -0,0 +1,83 @@
+import time
+
+from context_cache import ContextCache
+from gemini_client import GeminiClient
+from llm_backend import FallbackBackend, FallbackText, GeminiBackend, LocalFallbackBackend
+from metrics import Metrics
+
+PERSONA = {"parts": [{"text": "You are a calm, supportive companion who listens first. " * 4}]}
+
+
+def conversation(turns):
+    contents = []
+    for i in range(turns):
+        contents.append({"role": "user", "parts": [{"text": f"Turn {i}: exams are stressing me out a lot lately."}]})
+        contents.append({"role": "model", "parts": [{"text": "That sounds hard. What part feels heaviest?"}]})
+    contents.append({"role": "user", "parts": [{"text": "I keep thinking about the results."}]})
+    return {"systemInstruction": PERSONA, "contents": contents}
+
+
+def context_cache_total(metrics, outcome):
+    counters, _ = metrics.snapshot()
+    return sum(value for (name, labels), value in counters.items()
+               if name == "gemini_context_cache_total" and ("outcome", outcome) in labels)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def cached_backend(mock):
+    metrics = Metrics()
+    client = GeminiClient(mock.api_base, "gemini-test", backoff_cap=0.01, metrics=metrics)
+    cache = ContextCache(client, min_tokens=50, metrics=metrics)
+    return GeminiBackend(client, context_cache=cache), metrics
+
+
+def test_chat_reuses_a_cached_prefix(server):
+    mock = server(cache_min_tokens=50)
+    backend, metrics = cached_backend(mock)
+    payload = conversation(3)
+    assert backend.generate_text("key", payload, call_site="chat")
+    assert wait_for(lambda: context_cache_total(metrics, "created") == 1)
+    assert "".join(backend.stream_text("key", payload, call_site="chat"))
+    assert context_cache_total(metrics, "hit") == 1
+    counters, _ = metrics.snapshot()
+    assert counters[("gemini_tokens_total", (("call_site", "chat"), ("kind", "prompt_cached")))] > 0
+
+
+def test_rejected_cache_falls_back_to_the_full_payload(server):
+    mock = server(cache_min_tokens=50)
+    backend, metrics = cached_backend(mock)
+    payload = conversation(3)
+    backend.generate_text("key", payload, call_site="chat")
+    assert wait_for(lambda: context_cache_total(metrics, "created") == 1)
+    with mock.caches.lock:
+        mock.caches.items.clear()
+    assert backend.generate_text("key", payload, call_site="chat")
+    assert context_cache_total(metrics, "fallback") == 1
+    assert mock.stats.snapshot()["403"] == 1
+
+
+def test_offline_fallback_when_gemini_fails(server):
+    mock = server(rate_5xx=1.0)
+    client = GeminiClient(mock.api_base, "gemini-test", max_retries=2, backoff_cap=0.01, metrics=Metrics())
+    backend = FallbackBackend(GeminiBackend(client), LocalFallbackBackend({"chat": ["I'm here with you."]}),
+                              metrics=Metrics())
+    payload = conversation(1)
+    assert backend.generate_text("key", payload, call_site="chat") == "I'm here with you."
+    chunks = list(backend.stream_text("key", payload, call_site="chat"))
+    assert chunks == ["I'm here with you."] and isinstance(chunks[0], FallbackText)
+
+
+def test_fallback_serves_the_last_good_response(server):
+    mock = server()
+    client = GeminiClient(mock.api_base, "gemini-test", max_retries=1, metrics=Metrics())
+    backend = FallbackBackend(GeminiBackend(client), LocalFallbackBackend({"chat": ["canned"]}), metrics=Metrics())
+    payload = conversation(1)
+    text = "".join(backend.stream_text("key", payload, call_site="chat"))
+    server(rate_5xx=1.0)
+    assert backend.generate_text("key", payload, call_site="chat") == text != "canned"
@@ -0,0 +1,48 @@
+from itertools import permutations
+
+import pytest
+
+from mood_analytics import MoodAnalytics
+
+ENTRIES = [
+    (1, "2026-01-01", "happy"),
+    (2, "2026-01-02", "sad"),
+    (3, "2026-01-03", "stressed"),
+    (4, "2026-01-04", "anxious"),
+]
+
+
+def analytics_with(stored, window=7):
+    """MoodAnalytics over an in-memory store; `stored` is mutated as entries are analyzed."""
+    analytics = MoodAnalytics(lambda user_id: sorted(stored, key=lambda e: (e[1], e[0])), window=window)
+    analytics.recent_negative_count("u")
+    return analytics
+
+
+@pytest.mark.parametrize("order", list(permutations(ENTRIES)))
+def test_out_of_order_adds_match_a_rebuild(order):
+    stored = []
+    analytics = analytics_with(stored, window=3)
+    for entry in order:
+        stored.append(entry)
+        analytics.add_entry("u", *entry)
+
+    rebuilt = analytics_with(stored, window=3)
+    assert analytics.recent_negative_count("u", last=3) == rebuilt.recent_negative_count("u", last=3) == 3
+    assert analytics.negative_ratio("u") == rebuilt.negative_ratio("u")
+
+
+def test_entry_older_than_a_full_window_is_left_out():
+    stored = list(ENTRIES[1:])
+    analytics = analytics_with(stored, window=3)
+    stored.append(ENTRIES[0])
+    analytics.add_entry("u", *ENTRIES[0])
+    assert analytics.recent_negative_count("u", last=3) == 3
+
+
+def test_remove_refills_the_window():
+    stored = list(ENTRIES)
+    analytics = analytics_with(stored, window=3)
+    stored.remove(ENTRIES[3])
+    analytics.remove_entry("u", *ENTRIES[3])
+    assert analytics.recent_negative_count("u", last=3) == 2
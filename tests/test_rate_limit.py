@@ -0,0 +1,21 @@
+import time
+
+from rate_limit import RateLimiter
+
+
+def test_refilled_buckets_are_expired():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60_000, expire_every=0.05)
+    for i in range(50):
+        limiter.acquire(f"key-{i}", tokens=100)
+    assert len(limiter._keys) == 50
+    time.sleep(0.2)
+    limiter.acquire("key-0", tokens=100)
+    assert list(limiter._keys) == ["key-0"]
+
+
+def test_paused_and_draining_buckets_are_kept():
+    limiter = RateLimiter(requests_per_minute=6, tokens_per_minute=60_000, expire_every=0.0)
+    limiter.acquire("busy")
+    limiter.pause("paused", 60)
+    limiter.acquire("other")
+    assert set(limiter._keys) == {"busy", "paused", "other"}
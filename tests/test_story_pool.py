@@ -0,0 +1,48 @@
+import threading
+import time
+
+from story_pool import StoryPool
+
+
+def story_generator():
+    calls = []
+
+    def generate(api_key, mood, theme):
+        calls.append(api_key)
+        return {"title": f"story {len(calls)}", "content": f"{mood} {theme}"}
+
+    return generate, calls
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_no_background_refills_without_a_server_key():
+    generate, calls = story_generator()
+    pool = StoryPool(generate)
+    assert pool.take("sad", "exams") is None
+    pool.add("sad", "exams", {"title": "inline", "content": "x"}, served=True)
+    time.sleep(0.1)
+    assert calls == []
+
+
+def test_refills_use_the_server_key():
+    generate, calls = story_generator()
+    pool = StoryPool(generate, low_water=2, api_key="server-key")
+    pool.take("sad", "exams")
+    assert wait_for(lambda: pool.snapshot()["size"] == 2)
+    assert set(calls) == {"server-key"}
+
+
+def test_worker_survives_save_errors(tmp_path):
+    generate, calls = story_generator()
+    pool = StoryPool(generate, low_water=1, api_key="server-key", path=str(tmp_path / "missing" / "pool.json"))
+    pool.take("sad", "exams")
+    assert wait_for(lambda: len(calls) == 1)
+    pool.take("calm", "exams")
+    assert wait_for(lambda: len(calls) == 2)
+    assert any(thread.name == "story-pool" for thread in threading.enumerate())